@@ -0,0 +1,129 @@
+"""Peak memory of holding the analysis of a whole history in memory.
+
+Analyzes the revisions of a synthetic project from generate_project.py (20,000
+by default, generated in memory) and keeps every result, once with the
+statements as they are now (__slots__, interned names) and once as plain
+objects with a __dict__ and a copy of every name, the way statements were held
+before. Each runs in a fresh process so the peak RSS figures don't contaminate
+each other. With --retained, retained_kb is what tracemalloc sees still
+allocated at the end, without allocator overhead.
+
+    python benchmarks/bench_memory.py [--revisions N] [--retained]
+"""
+
+import argparse
+import json
+from pathlib import Path
+import resource
+import subprocess
+import sys
+import tracemalloc
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import alembic_tools.analyze_revision as ar
+from generate_project import generate_revisions
+
+
+class PlainObject:
+    pass
+
+
+# The statement classes without __slots__, one per slotted class
+PLAIN_CLASSES: dict[type, type] = {}
+
+
+def slot_names(cls: type) -> list[str]:
+    return [name for c in cls.__mro__ for name in c.__dict__.get("__slots__", ())]
+
+
+def unslotted(obj):
+    # A copy of a statement, column or revision as an object with a __dict__,
+    # holding copies of its names rather than the interned ones
+    match obj:
+        case str():
+            return "".join(list(obj))
+        case list():
+            return [unslotted(item) for item in obj]
+        case ar.Statement() | ar.Column() | ar.Revision():
+            cls = type(obj)
+            plain_cls = PLAIN_CLASSES.get(cls)
+            if plain_cls is None:
+                plain_cls = PLAIN_CLASSES[cls] = type(cls.__name__, (PlainObject,), {})
+            plain = plain_cls()
+            for name in slot_names(cls):
+                setattr(plain, name, unslotted(getattr(obj, name)))
+            return plain
+    return obj
+
+
+def peak_rss_kb() -> int:
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes everywhere else
+    return usage // 1024 if sys.platform == "darwin" else usage
+
+
+def measure(mode: str, revisions: int, retained: bool) -> dict:
+    # make sure the analyzer itself is warmed up before taking the baseline
+    ar.analyze_revision_text(next(generate_revisions(1))[2], "rev.py")
+    baseline = peak_rss_kb()
+    if retained:
+        tracemalloc.start()
+    statements = 0
+    kept = []
+    for _, _, text in generate_revisions(revisions):
+        rev = ar.analyze_revision_text(text, "rev.py")
+        statements += len(rev.statements)
+        kept.append(unslotted(rev) if mode == "plain" else rev)
+    peak = peak_rss_kb()
+    result = {
+        "mode": mode,
+        "revisions": revisions,
+        "statements": statements,
+        "baseline_rss_kb": baseline,
+        "peak_rss_kb": peak,
+        "analysis_rss_kb": peak - baseline,
+    }
+    if retained:
+        result["retained_kb"] = tracemalloc.get_traced_memory()[0] // 1024
+        tracemalloc.stop()
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--revisions", type=int, default=20_000)
+    parser.add_argument("--mode", choices=["plain", "slotted"])
+    parser.add_argument(
+        "--retained",
+        action="store_true",
+        help="Also trace allocations (slower, and inflates the RSS figures)",
+    )
+    args = parser.parse_args()
+    if args.mode is not None:
+        print(json.dumps(measure(args.mode, args.revisions, args.retained)))
+        return 0
+    results = []
+    for mode in ["plain", "slotted"]:
+        out = subprocess.run(
+            [
+                sys.executable,
+                __file__,
+                "--mode",
+                mode,
+                "--revisions",
+                str(args.revisions),
+                *(["--retained"] if args.retained else []),
+            ],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        results.append(json.loads(out.stdout))
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+"""Time the main operations of alembic_tools on a synthetic project.
+
+Generates a project with generate_project.py (or uses --project), then times
+scanning the revision headers, building the graph, assign_order, analyzing
+every revision, searching (cold, with a warm analysis cache, and from the
+index) and moving a revision. Each benchmark reports the best of --repeat runs.
+Results are printed as JSON and written to --output if given; pass a previous
+results file to --compare to see the change for each benchmark.
+
+    python benchmarks/bench_suite.py [--revisions N] [--repeat N] [--output FILE]
+        [--compare FILE] [--project DIR]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+from pathlib import Path
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import alembic_tools.analyze_revision as ar
+from alembic_tools.entity_index import index_collection
+from alembic_tools.move_revision import move_in_graph, move_revision
+from alembic_tools.revision_collection import (
+    RevisionGraph,
+    assign_order,
+    build_graph_from_headers,
+    get_script_directory,
+    list_revision_files,
+    scan_revision_headers,
+    topological_sort,
+)
+from alembic_tools.search_collection import search_collection
+from generate_project import generate_project
+
+
+def best_of(repeat: int, fn: Callable[[], object]) -> dict:
+    runs = []
+    for _ in range(repeat):
+        # the tools print their results; only the timing matters here
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            fn()
+            runs.append(time.perf_counter() - start)
+    return {"seconds": min(runs), "runs": runs}
+
+
+def git_commit() -> str | None:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).resolve().parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+def pick_search_names(graph: RevisionGraph) -> tuple[str, str]:
+    # a table and a replaceable from the middle of the history, so neither is
+    # found in the first revision looked at
+    middle = graph.revisions[graph.order[len(graph.order) // 2]]
+    table = "table_1"
+    replaceable = "vw_report_0"
+    for stmt in ar.analyze_revision(middle.path).statements:
+        match stmt:
+            case ar.ReplaceableStatement():
+                replaceable = stmt.replaceable_name
+            case ar.AddColumnStatement() | ar.CreateTableStatement():
+                table = stmt.table_name
+    return table, replaceable
+
+
+def run_suite(repeat: int, jobs: int) -> dict[str, dict]:
+    results: dict[str, dict] = {}
+    script_folder = get_script_directory()
+    headers = scan_revision_headers(script_folder)
+    graph = RevisionGraph(script_folder, headers)
+    paths = list_revision_files(script_folder)
+    table, replaceable = pick_search_names(graph)
+    cache_dir = Path(".alembic_tools_cache")
+
+    def clear_cache() -> None:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    results["scan_headers"] = best_of(
+        repeat, lambda: scan_revision_headers(script_folder)
+    )
+    results["build_graph"] = best_of(
+        repeat, lambda: RevisionGraph(script_folder, headers)
+    )
+    results["revision_walk"] = best_of(
+        repeat, lambda: topological_sort(build_graph_from_headers(headers))
+    )
+    results["assign_order"] = best_of(repeat, lambda: assign_order(script_folder))
+    results["analyze_revision"] = best_of(
+        repeat, lambda: [ar.analyze_revision(p) for p in paths]
+    )
+
+    def search(use_cache: bool, search_jobs: int) -> None:
+        search_collection(
+            script_folder, [table], [replaceable], use_cache=use_cache, jobs=search_jobs
+        )
+
+    clear_cache()
+    results["search_cold"] = best_of(repeat, lambda: search(False, 1))
+    if jobs > 1:
+        results["search_cold_parallel"] = best_of(repeat, lambda: search(False, jobs))
+    search(True, jobs)
+    results["search_warm_cache"] = best_of(repeat, lambda: search(True, 1))
+    index_collection(script_folder, use_cache=True, jobs=jobs)
+    results["search_index"] = best_of(repeat, lambda: search(True, 1))
+    clear_cache()
+
+    # the middle revision moves to just after the base
+    to_move = graph.order[len(graph.order) // 2]
+    while len(graph.parents[to_move]) != 1:
+        to_move = graph.order[graph.order_map[to_move] + 1]
+
+    def move_in_memory() -> None:
+        parents = {rev: list(ps) for rev, ps in graph.parents.items()}
+        children = {rev: list(cs) for rev, cs in graph.children.items()}
+        move_in_graph(parents, children, to_move, graph.bases[0])
+
+    results["move_in_graph"] = best_of(repeat, move_in_memory)
+    # moving rewrites files, so it's done once, last
+    results["move"] = best_of(
+        1,
+        lambda: move_revision(RevisionGraph.load(), to_move, graph.bases[0]),
+    )
+    return results
+
+
+def compare(results: dict[str, dict], previous: dict) -> None:
+    print(f"Compared with {previous.get('commit')}:", file=sys.stderr)
+    for name, result in results.items():
+        before = previous["results"].get(name)
+        if before is None:
+            continue
+        ratio = result["seconds"] / before["seconds"] if before["seconds"] else 0
+        print(
+            f"  {name:24} {before['seconds']:9.4f}s -> {result['seconds']:9.4f}s"
+            f"  ({ratio:.2f}x)",
+            file=sys.stderr,
+        )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--revisions", type=int, default=5000)
+    parser.add_argument("--branch-rate", type=float, default=0.05)
+    parser.add_argument("--ops-per-revision", type=int, default=4)
+    parser.add_argument("--replaceables", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--project",
+        type=Path,
+        help="Benchmark a copy of this project instead of generating one",
+    )
+    parser.add_argument("--output", type=Path, help="Write the results here")
+    parser.add_argument("--compare", type=Path, help="Earlier results to compare to")
+    args = parser.parse_args()
+
+    params = {
+        "revisions": args.revisions,
+        "branch_rate": args.branch_rate,
+        "ops_per_revision": args.ops_per_revision,
+        "replaceables": args.replaceables,
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "jobs": args.jobs,
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp) / "project"
+        if args.project is not None:
+            shutil.copytree(args.project, root)
+            params = {"project": str(args.project), "repeat": args.repeat}
+        else:
+            start = time.perf_counter()
+            generate_project(
+                root,
+                revisions=args.revisions,
+                branch_rate=args.branch_rate,
+                ops_per_revision=args.ops_per_revision,
+                replaceables=args.replaceables,
+                seed=args.seed,
+            )
+            print(
+                f"Generated {args.revisions} revisions in "
+                f"{time.perf_counter() - start:.1f}s",
+                file=sys.stderr,
+            )
+        cwd = os.getcwd()
+        os.chdir(root)
+        try:
+            results = run_suite(args.repeat, args.jobs)
+        finally:
+            os.chdir(cwd)
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": params,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output is not None:
+        args.output.write_text(text + "\n")
+    if args.compare is not None:
+        compare(results, json.loads(args.compare.read_text()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
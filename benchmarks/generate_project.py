@@ -0,0 +1,292 @@
+"""Write a synthetic alembic project for benchmarking.
+
+The history is mostly linear, like a real one: every so often a short branch
+is opened next to the main line and merged back in with a merge revision.
+Revisions create, alter and drop tables, columns, indexes and foreign keys, and
+create and replace ReplaceableObjects.
+
+    python benchmarks/generate_project.py OUTPUT_DIR [--revisions N] [--branch-rate P]
+        [--ops-per-revision N] [--replaceables N] [--seed N]
+"""
+
+import argparse
+import contextlib
+import io
+from pathlib import Path
+import random
+import re
+import sys
+from typing import Iterator
+
+from alembic import command
+from alembic.config import Config
+
+HEADER_TEMPLATE = '''"""{message}
+
+Revision ID: {rev}
+Revises: {revises}
+Create Date: 2024-01-01 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+{objects}
+
+# revision identifiers, used by Alembic.
+revision: str = {rev!r}
+down_revision: Union[str, Sequence[str], None] = {down_revision!r}
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+{upgrade}
+
+
+def downgrade() -> None:
+    pass
+'''
+
+# Lives next to alembic.ini, which alembic puts on sys.path
+REPLACEABLE_MODULE = """class ReplaceableObject:
+    def __init__(self, name, sqltext):
+        self.name = name
+        self.sqltext = sqltext
+"""
+
+COLUMN_TYPES = ["sa.Integer", "sa.Text", "sa.DateTime", "sa.Boolean", "sa.Numeric"]
+
+
+# The state of the fake schema, so that generated operations refer to tables,
+# columns and objects that exist at that point in the history
+class SchemaModel:
+    def __init__(self, rng: random.Random, replaceables: int) -> None:
+        self.rng = rng
+        self.tables: dict[str, list[str]] = {}
+        self.table_count = 0
+        self.column_count = 0
+        self.replaceable_names = [f"vw_report_{i}" for i in range(replaceables)]
+        # replaceable name -> revision that last created or replaced it
+        self.replaceables: dict[str, str] = {}
+
+    def new_column(self) -> str:
+        self.column_count += 1
+        return f"col_{self.column_count}"
+
+    def column_call(self, name: str) -> str:
+        return f'sa.Column("{name}", {self.rng.choice(COLUMN_TYPES)})'
+
+    def op_lines(self, rev: str, objects: list[str]) -> list[str]:
+        rng = self.rng
+        choice = rng.random()
+        if not self.tables or choice < 0.12:
+            self.table_count += 1
+            table = f"table_{self.table_count}"
+            columns = ["id"] + [self.new_column() for _ in range(rng.randint(2, 6))]
+            self.tables[table] = columns
+            lines = ["    op.create_table(", f'        "{table}",']
+            lines += [f"        {self.column_call(c)}," for c in columns]
+            lines.append("    )")
+            return lines
+        table = rng.choice(list(self.tables))
+        columns = self.tables[table]
+        if choice < 0.40:
+            column = self.new_column()
+            columns.append(column)
+            return [f'    op.add_column("{table}", {self.column_call(column)})']
+        if choice < 0.55 and len(columns) > 1:
+            column = rng.choice(columns[1:])
+            return [f'    op.alter_column("{table}", "{column}", nullable=True)']
+        if choice < 0.62 and len(columns) > 2:
+            column = rng.choice(columns[1:])
+            columns.remove(column)
+            return [f'    op.drop_column("{table}", "{column}")']
+        if choice < 0.72:
+            column = rng.choice(columns)
+            return [
+                f'    op.create_index("ix_{table}_{column}_{rev}", "{table}", ["{column}"])'
+            ]
+        if choice < 0.80:
+            referent = rng.choice(list(self.tables))
+            return [
+                f'    op.create_foreign_key("fk_{table}_{rev}", "{table}", "{referent}", '
+                f'["id"], ["id"])'
+            ]
+        if choice < 0.82 and len(self.tables) > 1:
+            del self.tables[table]
+            return [f'    op.drop_table("{table}")']
+        if self.replaceable_names:
+            name = rng.choice(self.replaceable_names)
+            objects.append(
+                f'{name} = ReplaceableObject("{name}", "select * from {table}")'
+            )
+            previous = self.replaceables.get(name)
+            self.replaceables[name] = rev
+            if previous is None:
+                return [f"    op.create_view({name})"]
+            return [f'    op.replace_view({name}, replaces="{previous}.{name}")']
+        return [f'    op.execute("update {table} set id = id")']
+
+
+def revision_text(
+    rev: str,
+    down_revision: str | tuple[str, ...] | None,
+    message: str,
+    upgrade_lines: list[str],
+    objects: list[str],
+) -> str:
+    if down_revision is None:
+        revises = ""
+    elif isinstance(down_revision, tuple):
+        revises = ", ".join(down_revision)
+    else:
+        revises = down_revision
+    return HEADER_TEMPLATE.format(
+        message=message,
+        rev=rev,
+        revises=revises,
+        down_revision=down_revision,
+        objects=(
+            "from replaceable import ReplaceableObject\n\n" + "\n".join(objects) + "\n"
+            if objects
+            else ""
+        ),
+        upgrade="\n".join(upgrade_lines) if upgrade_lines else "    pass",
+    )
+
+
+def init_project(root: Path) -> Path:
+    root.mkdir(parents=True, exist_ok=True)
+    config = Config(str(root / "alembic.ini"))
+    with contextlib.redirect_stdout(io.StringIO()):
+        command.init(config, str(root / "migrations"))
+    (root / "replaceable.py").write_text(REPLACEABLE_MODULE)
+    # keep the project relocatable
+    ini = root / "alembic.ini"
+    ini.write_text(
+        re.sub(
+            R"^script_location = .*$",
+            "script_location = migrations",
+            ini.read_text(),
+            count=1,
+            flags=re.M,
+        )
+    )
+    return root / "migrations" / "versions"
+
+
+def generate_revisions(
+    revisions: int = 1000,
+    branch_rate: float = 0.05,
+    ops_per_revision: int = 4,
+    replaceables: int = 50,
+    seed: int = 0,
+) -> Iterator[tuple[str, str, str]]:
+    # Yields (revision id, file name, text) for each revision, in a
+    # topological order of the history
+    rng = random.Random(seed)
+    model = SchemaModel(rng, replaceables)
+    used: set[str] = set()
+    count = 0
+
+    def new_id() -> str:
+        while True:
+            rev = f"{rng.getrandbits(48):012x}"
+            if rev not in used:
+                used.add(rev)
+                return rev
+
+    def make(
+        down_revision: str | tuple[str, ...] | None, merge: bool = False
+    ) -> tuple[str, str, str]:
+        nonlocal count
+        rev = new_id()
+        objects: list[str] = []
+        lines: list[str] = []
+        if not merge:
+            for _ in range(ops_per_revision):
+                lines += model.op_lines(rev, objects)
+        message = "merge heads" if merge else f"revision {count}"
+        count += 1
+        text = revision_text(rev, down_revision, message, lines, objects)
+        return rev, f"{rev}_{message.replace(' ', '_')}.py", text
+
+    revision = make(None)
+    yield revision
+    head = revision[0]
+    while count < revisions:
+        remaining = revisions - count
+        if remaining >= 3 and rng.random() < branch_rate:
+            # a side branch and the main line both grow from head, then merge
+            branch_length = min(rng.randint(1, 5), remaining - 2)
+            branch = head
+            for _ in range(branch_length):
+                revision = make(branch)
+                yield revision
+                branch = revision[0]
+            revision = make(head)
+            yield revision
+            main = revision[0]
+            revision = make((main, branch), merge=True)
+        else:
+            revision = make(head)
+        yield revision
+        head = revision[0]
+
+
+def generate_project(
+    root: Path,
+    revisions: int = 1000,
+    branch_rate: float = 0.05,
+    ops_per_revision: int = 4,
+    replaceables: int = 50,
+    seed: int = 0,
+) -> list[str]:
+    # Returns the revision ids in the order they were written, which is a
+    # topological order of the history
+    versions = init_project(root)
+    written = []
+    for rev, name, text in generate_revisions(
+        revisions, branch_rate, ops_per_revision, replaceables, seed
+    ):
+        (versions / name).write_text(text)
+        written.append(rev)
+    return written
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("output", type=Path)
+    parser.add_argument("--revisions", type=int, default=1000)
+    parser.add_argument(
+        "--branch-rate",
+        type=float,
+        default=0.05,
+        help="Chance of a revision opening a branch that is later merged",
+    )
+    parser.add_argument("--ops-per-revision", type=int, default=4)
+    parser.add_argument("--replaceables", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.output.exists() and any(args.output.iterdir()):
+        print(f"{args.output} is not empty")
+        return 1
+    if not 1 <= args.revisions <= 50_000:
+        print("--revisions must be between 1 and 50000")
+        return 1
+    written = generate_project(
+        args.output,
+        revisions=args.revisions,
+        branch_rate=args.branch_rate,
+        ops_per_revision=args.ops_per_revision,
+        replaceables=args.replaceables,
+        seed=args.seed,
+    )
+    print(f"Wrote {len(written)} revisions to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
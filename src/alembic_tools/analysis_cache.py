@@ -0,0 +1,135 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+import pickle
+from pathlib import Path
+
+import alembic_tools.analyze_revision as ar
+import alembic_tools.git_state as git_state
+import alembic_tools.timings as timings
+from alembic_tools.prefetch import prefetch, read_text
+
+CACHE_DIR = Path(".alembic_tools_cache")
+ANALYSIS_CACHE_FILE = "analysis.pickle"
+# Below this many files the cost of starting worker processes outweighs the
+# parallel speedup, so they are analyzed in-process
+PARALLEL_THRESHOLD = 64
+
+
+# Per-file analysis results persisted between runs. Entries are keyed by path
+# and validated against the file's size and mtime, so only files that changed
+# since the last run are read and parsed again. The git commit the entries were
+# saved at is kept too: files git reports as unchanged since then aren't even
+# looked at, so after a pull only the pulled files cost anything.
+class AnalysisCache:
+    path: Path
+    entries: dict[str, tuple[int, int, ar.Revision]]
+
+    def __init__(self, cache_dir: Path = CACHE_DIR) -> None:
+        self.path = cache_dir / ANALYSIS_CACHE_FILE
+        self.entries = {}
+        self._seen: set[str] = set()
+        self._dirty = False
+        self._git: git_state.RepoState | None = None
+        self._trusted: set[str] = set()
+
+    def load(self) -> None:
+        # taken before any file is read, so that whatever changes after this
+        # shows up as changed next time
+        self._git = git_state.repo_state()
+        if not self.path.exists():
+            return
+        try:
+            with timings.phase("load_cache"), self.path.open("rb") as f:
+                data = pickle.load(f)
+        except Exception:
+            # A corrupt or incompatible cache is simply rebuilt
+            self._dirty = True
+            return
+        if data.get("version") != ar.analyzer_version():
+            self._dirty = True
+            return
+        self.entries = data["entries"]
+        self._trusted = git_state.unchanged_files(data.get("git"), self.entries)
+
+    def get(self, p: Path) -> ar.Revision | None:
+        key = str(p)
+        self._seen.add(key)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        size, mtime, rev = entry
+        if key in self._trusted:
+            return rev
+        st = p.stat()
+        if st.st_size != size or st.st_mtime_ns != mtime:
+            return None
+        return rev
+
+    def put(self, p: Path, rev: ar.Revision) -> None:
+        key = str(p)
+        st = p.stat()
+        self._seen.add(key)
+        self.entries[key] = (st.st_size, st.st_mtime_ns, rev)
+        self._dirty = True
+
+    def save(self) -> None:
+        # Anything not looked up during this run belongs to a file that no
+        # longer exists in the versions directory
+        stale = [k for k in self.entries if k not in self._seen]
+        for k in stale:
+            del self.entries[k]
+        if not self._dirty and not stale:
+            return
+        self.path.parent.mkdir(exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with timings.phase("save_cache"), tmp_path.open("wb") as f:
+            pickle.dump(
+                {
+                    "version": ar.analyzer_version(),
+                    "git": self._git,
+                    "entries": self.entries,
+                },
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+
+def analyze_revisions(
+    paths: list[Path], cache: AnalysisCache | None = None, jobs: int = 1
+) -> list[ar.Revision]:
+    with timings.phase("analyze"):
+        found: dict[int, ar.Revision] = {}
+        if cache is not None:
+            for i, p in enumerate(paths):
+                rev = cache.get(p)
+                if rev is not None:
+                    found[i] = rev
+        misses = [i for i in range(len(paths)) if i not in found]
+        timings.count("cache_hits", len(found))
+        to_analyze = [paths[i] for i in misses]
+        if jobs > 1 and len(to_analyze) >= PARALLEL_THRESHOLD:
+            # reads and parses in the workers aren't timed or counted
+            timings.count("files_analyzed_in_workers", len(to_analyze))
+            chunksize = max(1, len(to_analyze) // (jobs * 4))
+            # workers may be spawned rather than forked, so plugins are loaded again
+            with ProcessPoolExecutor(
+                max_workers=jobs, initializer=ar.load_plugins
+            ) as pool:
+                results = list(
+                    pool.map(ar.analyze_revision, to_analyze, chunksize=chunksize)
+                )
+        else:
+            # the next files are read while this one is parsed
+            timings.count("files_read", len(to_analyze))
+            results = [
+                ar.analyze_revision(p, text)
+                for p, text in prefetch(read_text, to_analyze)
+            ]
+        # results come back in submission order, so they line up with misses
+        for i, rev in zip(misses, results):
+            found[i] = rev
+            if cache is not None:
+                cache.put(paths[i], rev)
+        return [found[i] for i in range(len(paths))]
@@ -1,6 +1,17 @@
 import ast
 from enum import Enum
+import hashlib
+from importlib.metadata import entry_points
 from pathlib import Path
+from sys import intern
+from typing import Callable
+
+import alembic_tools.timings as timings
+
+# Bump whenever the statements extracted from a revision change shape, so that
+# anything persisted from a previous analyzer (e.g. the search cache) is dropped.
+ANALYZER_VERSION = 3
+PLUGIN_ENTRY_POINT_GROUP = "alembic_tools.operations"
 
 
 class StatementType(Enum):
@@ -13,9 +24,13 @@ class StatementType(Enum):
     CREATE_FK = 6
     DROP_TABLE = 7
     ALTER_COLUMN = 8
+    CUSTOM = 9
 
 
+# Statements use __slots__ and intern their names: a whole history's worth of
+# them is kept in memory for indexing and schema replay.
 class Statement:
+    __slots__ = ("stype",)
     stype: StatementType
 
     def __init__(self, stype: StatementType) -> None:
@@ -23,84 +38,92 @@ class Statement:
 
 
 class Column:
+    __slots__ = ("column_name",)
 
     column_name: str
 
     def __init__(self, column_name: str) -> None:
-        self.column_name = column_name
+        self.column_name = intern(column_name)
 
 
 class CreateTableStatement(Statement):
+    __slots__ = ("table_name", "columns")
 
     table_name: str
     columns: list[Column]
 
     def __init__(self, table_name: str) -> None:
-        self.table_name = table_name
+        self.table_name = intern(table_name)
         super().__init__(StatementType.CREATE_TABLE)
         self.columns = []
 
 
 class AddColumnStatement(Statement):
+    __slots__ = ("table_name", "column_name")
 
     table_name: str
     column_name: str
 
     def __init__(self, table_name: str, column_name: str) -> None:
         super().__init__(StatementType.ADD_COLUMN)
-        self.table_name = table_name
-        self.column_name = column_name
+        self.table_name = intern(table_name)
+        self.column_name = intern(column_name)
 
 
 class AlterColumnStatement(Statement):
+    __slots__ = ("table_name", "column_name")
 
     table_name: str
     column_name: str
 
     def __init__(self, table_name: str, column_name: str) -> None:
         super().__init__(StatementType.ALTER_COLUMN)
-        self.table_name = table_name
-        self.column_name = column_name
+        self.table_name = intern(table_name)
+        self.column_name = intern(column_name)
 
 
 class DropColumnStatement(Statement):
+    __slots__ = ("table_name", "column_name")
 
     table_name: str
     column_name: str
 
     def __init__(self, table_name: str, column_name: str) -> None:
         super().__init__(StatementType.DROP_COLUMN)
-        self.table_name = table_name
-        self.column_name = column_name
+        self.table_name = intern(table_name)
+        self.column_name = intern(column_name)
 
 
 class CreateIndexStatement(Statement):
+    __slots__ = ("table_name",)
 
     table_name: str
 
     def __init__(self, table_name: str) -> None:
         super().__init__(StatementType.CREATE_INDEX)
-        self.table_name = table_name
+        self.table_name = intern(table_name)
 
 
 class DropTableStatement(Statement):
+    __slots__ = ("table_name",)
 
     table_name: str
 
     def __init__(self, table_name: str) -> None:
         super().__init__(StatementType.DROP_TABLE)
-        self.table_name = table_name
+        self.table_name = intern(table_name)
 
 
 class CreateForeignKeyStatement(Statement):
+    __slots__ = ("table_name", "referent_table_name")
 
     table_name: str
     referent_table_name: str
 
     def __init__(self, table_name: str, referent_table_name: str) -> None:
         super().__init__(StatementType.CREATE_FK)
-        self.table_name = table_name
-        self.referent_table_name = referent_table_name
+        self.table_name = intern(table_name)
+        self.referent_table_name = intern(referent_table_name)
 
 
 class ReplaceableOperation(Enum):
@@ -111,6 +134,7 @@ class ReplaceableOperation(Enum):
 
 
 class ReplaceableStatement(Statement):
+    __slots__ = ("replaceable_name", "replaceable_op", "replaces")
 
     replaceable_name: str
     replaceable_op: ReplaceableOperation
@@ -123,12 +147,14 @@ class ReplaceableStatement(Statement):
         replaces: str | None = None,
     ) -> None:
         super().__init__(StatementType.REPLACEABLE_OP)
-        self.replaceable_name = replaceable_name
+        self.replaceable_name = intern(replaceable_name)
         self.replaceable_op = op
         self.replaces = replaces
 
 
 class Revision:
+    __slots__ = ("statements",)
+
     statements: list[Statement]
 
     def __init__(self) -> None:
@@ -263,11 +289,6 @@ OPERATION_NAMES = {
 }
 
 
-def is_replaceable_op(child: ast.Attribute) -> bool:
-    # TODO: This fails if someone calls create_view instead of utils.create_view
-    return child.attr in OPERATION_NAMES
-
-
 def parse_replaceable(child: ast.Call) -> ReplaceableStatement:
     assert isinstance(child.func, ast.Attribute)
     operation = child.func.attr
@@ -285,45 +306,101 @@ def parse_replaceable(child: ast.Call) -> ReplaceableStatement:
     return ReplaceableStatement(arg.id, OPERATION_NAMES[operation], replaces=replaces)
 
 
+OperationHandler = Callable[[ast.Call], Statement]
+
+# Maps the attribute name of a call to the object the call must be made on
+# (None for any object) and the function that turns the call into a Statement
+OPERATION_HANDLERS: dict[str, tuple[str | None, OperationHandler]] = {}
+
+
+def register_operation(
+    name: str, handler: OperationHandler, receiver: str | None = "op"
+) -> None:
+    OPERATION_HANDLERS[name] = (receiver, handler)
+
+
+register_operation("create_table", parse_table_create)
+register_operation("add_column", parse_add_column)
+register_operation("drop_column", parse_drop_column)
+register_operation("create_index", parse_create_index)
+register_operation("create_foreign_key", parse_create_fk)
+register_operation("drop_table", parse_drop_table)
+register_operation("alter_column", parse_alter_column)
+# TODO: This fails if someone calls create_view instead of utils.create_view
+for replaceable_operation in OPERATION_NAMES:
+    register_operation(replaceable_operation, parse_replaceable, receiver=None)
+
+
+# The distributions whose plugins have been loaded, and their versions
+PLUGIN_VERSIONS: dict[str, str] = {}
+
+
+def load_plugins() -> None:
+    # Packages can add handlers for their own operations by exposing a
+    # function under this entry point group that calls register_operation
+    for entry_point in entry_points(group=PLUGIN_ENTRY_POINT_GROUP):
+        entry_point.load()()
+        if entry_point.dist is not None:
+            PLUGIN_VERSIONS[entry_point.dist.name] = entry_point.dist.version
+
+
+def handler_name(handler: OperationHandler) -> str:
+    # partials and other callable objects have no __qualname__ of their own
+    qualname = getattr(handler, "__qualname__", type(handler).__qualname__)
+    return f"{handler.__module__}.{qualname}"
+
+
+def analyzer_version() -> str:
+    # Registered operations change what gets extracted, so the functions that
+    # handle them and the versions of the plugins that registered them are
+    # part of the version that persisted analysis is checked against
+    parts = [
+        f"{name}:{receiver}:{handler_name(handler)}"
+        for name, (receiver, handler) in sorted(OPERATION_HANDLERS.items())
+    ]
+    parts += [f"{name}=={version}" for name, version in sorted(PLUGIN_VERSIONS.items())]
+    digest = hashlib.sha256("\n".join(parts).encode()).hexdigest()[:16]
+    return f"{ANALYZER_VERSION}:{digest}"
+
+
 def parse_expr(expr: ast.Expr) -> Statement:
-    for child in ast.walk(expr):
-        if isinstance(child, ast.Call):
-            if not isinstance(child.func, ast.Attribute):
-                continue
-            if is_alembic_call(child.func, "create_table"):
-                return parse_table_create(child)
-            if is_alembic_call(child.func, "add_column"):
-                return parse_add_column(child)
-            if is_alembic_call(child.func, "drop_column"):
-                return parse_drop_column(child)
-            if is_alembic_call(child.func, "create_index"):
-                return parse_create_index(child)
-            if is_alembic_call(child.func, "create_foreign_key"):
-                return parse_create_fk(child)
-            if is_alembic_call(child.func, "drop_table"):
-                return parse_drop_table(child)
-            if is_alembic_call(child.func, "alter_column"):
-                return parse_alter_column(child)
-            if is_replaceable_op(child.func):
-                return parse_replaceable(child)
-    return Statement(StatementType.UNKNOWN)
+    call = expr.value
+    if not isinstance(call, ast.Call) or not isinstance(call.func, ast.Attribute):
+        return Statement(StatementType.UNKNOWN)
+    entry = OPERATION_HANDLERS.get(call.func.attr)
+    if entry is None:
+        return Statement(StatementType.UNKNOWN)
+    receiver, handler = entry
+    if receiver is not None and not (
+        isinstance(call.func.value, ast.Name) and call.func.value.id == receiver
+    ):
+        return Statement(StatementType.UNKNOWN)
+    return handler(call)
 
 
 def analyze_revision_text(text: str, p: Path | str) -> Revision:
-    tree = ast.parse(text, filename=p)
-    upgrade_function = find_upgrade_function(tree)
-    if not upgrade_function:
-        raise Exception("Could not find upgrade function")
-    rev = Revision()
-    for child in upgrade_function.body:
-        if isinstance(child, ast.Expr):
-            rev.statements.append(parse_expr(child))
+    with timings.phase("parse"):
+        tree = ast.parse(text, filename=p)
+    timings.count("chars_parsed", len(text))
+    with timings.phase("extract"):
+        upgrade_function = find_upgrade_function(tree)
+        if not upgrade_function:
+            raise Exception("Could not find upgrade function")
+        rev = Revision()
+        for child in upgrade_function.body:
+            if isinstance(child, ast.Expr):
+                rev.statements.append(parse_expr(child))
     return rev
 
 
-def analyze_revision(path: str | Path):
+def analyze_revision(path: str | Path, text: str | None = None):
     if isinstance(path, str):
         p = Path(path)
     else:
         p = path
-    return analyze_revision_text(p.read_text(), p)
+    # text is given when the file was already read, e.g. by prefetch
+    if text is None:
+        with timings.phase("read"):
+            text = p.read_text()
+        timings.count("files_read")
+    return analyze_revision_text(text, p)
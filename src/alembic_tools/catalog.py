@@ -0,0 +1,310 @@
+import json
+from pathlib import Path
+import sqlite3
+from typing import TYPE_CHECKING, Any
+
+import alembic_tools.analyze_revision as ar
+import alembic_tools.git_state as git_state
+import alembic_tools.timings as timings
+from alembic_tools.analysis_cache import CACHE_DIR, AnalysisCache, analyze_revisions
+from alembic_tools.entity_index import file_fingerprint
+from alembic_tools.revision_collection import (
+    RevisionGraph,
+    RevisionHeader,
+    scan_changed_headers,
+)
+
+if TYPE_CHECKING:
+    from alembic.script import ScriptDirectory
+
+CATALOG_FILE = "catalog.sqlite"
+# Bump when the tables change
+CATALOG_VERSION = 1
+
+# type is the statement's StatementType in lower case ("add_column",
+# "create_fk", "replaceable_op", ...). created_columns lists the columns of
+# each create_table, under the statement's ordinal.
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE files (
+    path TEXT PRIMARY KEY,
+    revision TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE revisions (
+    revision TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    doc TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    generation INTEGER NOT NULL
+);
+CREATE TABLE edges (
+    revision TEXT NOT NULL,
+    down_revision TEXT NOT NULL,
+    ordinal INTEGER NOT NULL,
+    PRIMARY KEY (revision, down_revision)
+);
+CREATE TABLE statements (
+    revision TEXT NOT NULL,
+    ordinal INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    table_name TEXT,
+    column_name TEXT,
+    referent_table TEXT,
+    replaceable TEXT,
+    replaceable_op TEXT,
+    replaces TEXT,
+    PRIMARY KEY (revision, ordinal)
+);
+CREATE TABLE created_columns (
+    revision TEXT NOT NULL,
+    ordinal INTEGER NOT NULL,
+    table_name TEXT NOT NULL,
+    column_name TEXT NOT NULL
+);
+CREATE INDEX revisions_position ON revisions (position);
+CREATE INDEX edges_down_revision ON edges (down_revision);
+CREATE INDEX statements_type ON statements (type);
+CREATE INDEX statements_table ON statements (table_name, type);
+CREATE INDEX statements_referent ON statements (referent_table);
+CREATE INDEX statements_replaceable ON statements (replaceable);
+CREATE INDEX created_columns_revision ON created_columns (revision);
+CREATE INDEX created_columns_table ON created_columns (table_name, column_name);
+"""
+
+StatementRow = tuple[Any, ...]
+
+
+def catalog_version() -> str:
+    return f"{CATALOG_VERSION}:{ar.analyzer_version()}"
+
+
+def text_attribute(stmt: ar.Statement, name: str) -> str | None:
+    # statements from plugins can have any attributes, so only names that are
+    # actually strings are stored
+    value = getattr(stmt, name, None)
+    return value if isinstance(value, str) else None
+
+
+def statement_rows(
+    revision: str, rev_analysis: ar.Revision
+) -> tuple[list[StatementRow], list[StatementRow]]:
+    statements = []
+    created_columns = []
+    for ordinal, stmt in enumerate(rev_analysis.statements):
+        op_name = None
+        if isinstance(stmt, ar.ReplaceableStatement):
+            op_name = stmt.replaceable_op.name.lower()
+        statements.append(
+            (
+                revision,
+                ordinal,
+                stmt.stype.name.lower(),
+                text_attribute(stmt, "table_name"),
+                text_attribute(stmt, "column_name"),
+                text_attribute(stmt, "referent_table_name"),
+                text_attribute(stmt, "replaceable_name"),
+                op_name,
+                text_attribute(stmt, "replaces"),
+            )
+        )
+        if isinstance(stmt, ar.CreateTableStatement):
+            created_columns += [
+                (revision, ordinal, stmt.table_name, c.column_name)
+                for c in stmt.columns
+            ]
+    return statements, created_columns
+
+
+def open_catalog(path: Path) -> sqlite3.Connection:
+    # A catalog from another version of the tables or the analyzer is
+    # started again from scratch
+    conn = sqlite3.connect(path)
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    except sqlite3.DatabaseError:
+        row = None
+    if row is not None and row[0] == catalog_version():
+        return conn
+    conn.close()
+    path.unlink(missing_ok=True)
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executescript(SCHEMA)
+        conn.execute(
+            "INSERT INTO meta VALUES ('version', ?), ('git', 'null')",
+            (catalog_version(),),
+        )
+    return conn
+
+
+def stored_headers(
+    conn: sqlite3.Connection, paths: set[str]
+) -> dict[str, RevisionHeader]:
+    downs: dict[str, list[str]] = {}
+    for revision, parent in conn.execute(
+        "SELECT revision, down_revision FROM edges ORDER BY revision, ordinal"
+    ):
+        downs.setdefault(revision, []).append(parent)
+    headers = {}
+    for revision, path, doc in conn.execute(
+        "SELECT revision, path, doc FROM revisions"
+    ):
+        if path not in paths:
+            continue
+        down = downs.get(revision, [])
+        down_revision: str | tuple[str, ...] | None = None
+        if len(down) == 1:
+            down_revision = down[0]
+        elif down:
+            down_revision = tuple(down)
+        headers[path] = RevisionHeader(revision, down_revision, doc, path)
+    return headers
+
+
+def refresh_catalog(
+    conn: sqlite3.Connection,
+    script_folder: "ScriptDirectory",
+    use_cache: bool = True,
+    jobs: int = 1,
+) -> int:
+    # Brings the catalog up to date with the versions folder and returns how
+    # many revision files had to be read again. Only those files' statements
+    # are rewritten; the revisions and edges are rewritten whenever anything
+    # changed, since one new revision can move the position of many others.
+    (git_text,) = conn.execute("SELECT value FROM meta WHERE key = 'git'").fetchone()
+    # taken before any file is read, so that whatever changes after this
+    # shows up as changed next time
+    state = git_state.repo_state()
+    stored = {
+        path: (revision, [size, mtime_ns])
+        for path, revision, size, mtime_ns in conn.execute(
+            "SELECT path, revision, size, mtime_ns FROM files"
+        )
+    }
+    unchanged = git_state.unchanged_files(json.loads(git_text), stored)
+    with timings.phase("check_catalog"):
+        for path, (_, fingerprint) in stored.items():
+            if path in unchanged:
+                continue
+            p = Path(path)
+            if p.exists() and file_fingerprint(p) == fingerprint:
+                unchanged.add(path)
+    graph = RevisionGraph(
+        script_folder,
+        scan_changed_headers(script_folder, stored_headers(conn, unchanged)),
+    )
+    current = {rev.path: rev for rev in graph.revisions.values()}
+    changed = [path for path in current if path not in unchanged]
+    # a changed file's old statements go too, whatever revision it declared
+    removed = [path for path in stored if path not in unchanged or path not in current]
+    if not changed and not removed:
+        with conn:
+            conn.execute(
+                "UPDATE meta SET value = ? WHERE key = 'git'", (json.dumps(state),)
+            )
+        return 0
+    cache = None
+    if use_cache:
+        cache = AnalysisCache()
+        cache.load()
+    # Only the changed files are looked up, so the cache isn't saved: saving
+    # drops every entry that wasn't looked up
+    analyses = analyze_revisions([Path(path) for path in changed], cache, jobs=jobs)
+    with timings.phase("write_catalog"), conn:
+        for path in removed:
+            revision = stored[path][0]
+            conn.execute("DELETE FROM statements WHERE revision = ?", (revision,))
+            conn.execute("DELETE FROM created_columns WHERE revision = ?", (revision,))
+            conn.execute("DELETE FROM files WHERE path = ?", (path,))
+        for path, rev_analysis in zip(changed, analyses):
+            revision = current[path].revision
+            conn.execute("DELETE FROM statements WHERE revision = ?", (revision,))
+            conn.execute("DELETE FROM created_columns WHERE revision = ?", (revision,))
+            statements, created_columns = statement_rows(revision, rev_analysis)
+            conn.executemany(
+                "INSERT INTO statements VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", statements
+            )
+            conn.executemany(
+                "INSERT INTO created_columns VALUES (?, ?, ?, ?)", created_columns
+            )
+            conn.execute(
+                "INSERT INTO files VALUES (?, ?, ?, ?)",
+                (path, revision, *file_fingerprint(Path(path))),
+            )
+        conn.execute("DELETE FROM revisions")
+        conn.executemany(
+            "INSERT INTO revisions VALUES (?, ?, ?, ?, ?)",
+            (
+                (
+                    rev.revision,
+                    rev.path,
+                    rev.doc,
+                    graph.order_map[rev.revision],
+                    graph.generations[rev.revision],
+                )
+                for rev in graph.revisions.values()
+            ),
+        )
+        conn.execute("DELETE FROM edges")
+        conn.executemany(
+            "INSERT OR IGNORE INTO edges VALUES (?, ?, ?)",
+            (
+                (rev, parent, ordinal)
+                for rev, parents in graph.parents.items()
+                for ordinal, parent in enumerate(parents)
+            ),
+        )
+        conn.execute(
+            "UPDATE meta SET value = ? WHERE key = 'git'", (json.dumps(state),)
+        )
+    return len(changed)
+
+
+def print_rows(cursor: sqlite3.Cursor, as_json: bool) -> None:
+    names = [d[0] for d in cursor.description or []]
+    rows = cursor.fetchall()
+    if as_json:
+        print(json.dumps([dict(zip(names, row)) for row in rows], indent=2))
+        return
+    if not names:
+        return
+    cells = [["" if v is None else str(v) for v in row] for row in [names, *rows]]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(names))]
+    for row in cells:
+        print("  ".join(v.ljust(w) for v, w in zip(row, widths)).rstrip())
+    print(f"({len(rows)} rows)")
+
+
+def query_collection(
+    script_folder: "ScriptDirectory",
+    sql: str,
+    as_json: bool = False,
+    use_cache: bool = True,
+    jobs: int = 1,
+    cache_dir: Path = CACHE_DIR,
+) -> int:
+    cache_dir.mkdir(exist_ok=True)
+    path = cache_dir / CATALOG_FILE
+    if not use_cache:
+        path.unlink(missing_ok=True)
+    conn = open_catalog(path)
+    try:
+        reread = refresh_catalog(conn, script_folder, use_cache, jobs)
+    finally:
+        conn.close()
+    if reread and not as_json:
+        print(f"Updated the catalog from {reread} revision files")
+    # the query itself can only read, so that it can't break the catalog
+    conn = sqlite3.connect(f"{path.resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        with timings.phase("query"):
+            cursor = conn.execute(sql)
+            print_rows(cursor, as_json)
+    except sqlite3.Error as e:
+        print(f"Query failed: {e}")
+        return 1
+    finally:
+        conn.close()
+    return 0
@@ -0,0 +1,206 @@
+from collections import deque
+import json
+from pathlib import Path
+from typing import NamedTuple
+
+from alembic_tools.git_state import GitException, changed_files
+from alembic_tools.prefetch import prefetch
+from alembic_tools.revision_collection import (
+    RevisionHeader,
+    build_graph_from_headers,
+    list_files,
+    read_header_text,
+    scan_revision_header,
+    version_locations,
+)
+import alembic_tools.timings as timings
+
+
+class Diagnostic(NamedTuple):
+    # short, stable name for scripts to match on, e.g. "multiple-heads"
+    code: str
+    message: str
+    revisions: list[str]
+    paths: list[str]
+
+
+def read_header_or_error(p: Path) -> tuple[str, bool] | Exception:
+    try:
+        return read_header_text(p)
+    except (OSError, UnicodeDecodeError) as e:
+        return e
+
+
+def scan_files(paths: list[Path]) -> tuple[list[RevisionHeader], list[Diagnostic]]:
+    # Static scanning only: a file it can't read is reported rather than
+    # handed to alembic to import
+    headers = []
+    diagnostics = []
+    with timings.phase("scan_headers"):
+        for p, header_text in prefetch(read_header_or_error, paths):
+            try:
+                if isinstance(header_text, Exception):
+                    raise header_text
+                header = scan_revision_header(p, header_text)
+            except (OSError, UnicodeDecodeError) as e:
+                header = None
+                reason = str(e)
+            else:
+                reason = "revision and down_revision must be plain string literals"
+            if header is None:
+                diagnostics.append(
+                    Diagnostic(
+                        "unreadable-revision",
+                        f"Could not read the revision identifiers of {p}: {reason}",
+                        [],
+                        [str(p)],
+                    )
+                )
+            else:
+                headers.append(header)
+    return headers, diagnostics
+
+
+def find_duplicates(headers: list[RevisionHeader]) -> list[Diagnostic]:
+    by_revision: dict[str, list[RevisionHeader]] = {}
+    for header in headers:
+        by_revision.setdefault(header.revision, []).append(header)
+    return [
+        Diagnostic(
+            "duplicate-revision",
+            f"Revision {rev} is declared in {len(found)} files: {', '.join(h.path for h in found)}",
+            [rev],
+            [h.path for h in found],
+        )
+        for rev, found in by_revision.items()
+        if len(found) > 1
+    ]
+
+
+def find_dangling(
+    headers: list[RevisionHeader], parents: dict[str, list[str]]
+) -> list[Diagnostic]:
+    diagnostics = []
+    for header in headers:
+        missing = [p for p in parents[header.revision] if p not in parents]
+        if missing:
+            diagnostics.append(
+                Diagnostic(
+                    "dangling-down-revision",
+                    f"{header.revision} follows {', '.join(missing)}, which doesn't exist",
+                    [header.revision, *missing],
+                    [header.path],
+                )
+            )
+    return diagnostics
+
+
+def find_cycle_members(parents: dict[str, list[str]]) -> list[str]:
+    # Peel off revisions that can't be on a cycle: first those whose down
+    # revisions are all peeled off already, then those with nothing left
+    # after them. Whatever remains is on a cycle or between two.
+    children: dict[str, list[str]] = {rev: [] for rev in parents}
+    pending = {}
+    for rev, ps in parents.items():
+        known = [p for p in ps if p in parents]
+        pending[rev] = len(known)
+        for p in known:
+            children[p].append(rev)
+    ready = deque(rev for rev, count in pending.items() if count == 0)
+    while ready:
+        rev = ready.popleft()
+        for child in children[rev]:
+            pending[child] -= 1
+            if pending[child] == 0:
+                ready.append(child)
+    left = {rev for rev, count in pending.items() if count > 0}
+    remaining_children = {
+        rev: sum(1 for child in children[rev] if child in left) for rev in left
+    }
+    ready = deque(rev for rev, count in remaining_children.items() if count == 0)
+    while ready:
+        rev = ready.popleft()
+        left.discard(rev)
+        for p in parents[rev]:
+            if p in remaining_children and p in left:
+                remaining_children[p] -= 1
+                if remaining_children[p] == 0:
+                    ready.append(p)
+    return [rev for rev in parents if rev in left]
+
+
+def check_headers(headers: list[RevisionHeader]) -> list[Diagnostic]:
+    revision_paths = {h.revision: h.path for h in headers}
+    diagnostics = find_duplicates(headers)
+    parents = build_graph_from_headers(headers)
+    diagnostics += find_dangling(headers, parents)
+    in_cycle = find_cycle_members(parents)
+    if in_cycle:
+        diagnostics.append(
+            Diagnostic(
+                "cycle",
+                f"The revision graph has a cycle through {', '.join(in_cycle)}",
+                in_cycle,
+                [revision_paths[rev] for rev in in_cycle],
+            )
+        )
+    has_children = {p for ps in parents.values() for p in ps}
+    heads = [rev for rev in parents if rev not in has_children]
+    if len(heads) > 1:
+        diagnostics.append(
+            Diagnostic(
+                "multiple-heads",
+                f"There are {len(heads)} heads: {', '.join(heads)}",
+                heads,
+                [revision_paths[rev] for rev in heads],
+            )
+        )
+    return diagnostics
+
+
+def print_diagnostics(diagnostics: list[Diagnostic], as_json: bool) -> None:
+    if as_json:
+        data = {
+            "ok": not diagnostics,
+            "diagnostics": [d._asdict() for d in diagnostics],
+        }
+        print(json.dumps(data, indent=2))
+        return
+    for diagnostic in diagnostics:
+        print(f"{diagnostic.code}: {diagnostic.message}")
+    if not diagnostics:
+        print("No problems found")
+
+
+def check_collection(
+    changed_only: bool = False,
+    git_range: str | None = None,
+    as_json: bool = False,
+) -> int:
+    changed: set[Path] | None = None
+    if changed_only:
+        try:
+            changed = changed_files(git_range)
+        except GitException as e:
+            print(f"Could not find the changed files: {e}")
+            return 1
+    # every header is read even when only some files changed: a head or a
+    # cycle is a property of the whole graph
+    with timings.phase("load_config"):
+        locations, recursive = version_locations()
+    headers, diagnostics = scan_files(list_files(locations, recursive))
+    with timings.phase("check"):
+        diagnostics += check_headers(headers)
+    if changed is not None:
+        changed_paths = {str(p) for p in changed}
+        # a deleted revision leaves its children dangling without them changing
+        removed = any(not p.exists() and p.suffix == ".py" for p in changed)
+        diagnostics = [
+            d
+            for d in diagnostics
+            if d.code in ("cycle", "multiple-heads")
+            or (removed and d.code == "dangling-down-revision")
+            or any(path in changed_paths for path in d.paths)
+        ]
+    print_diagnostics(diagnostics, as_json)
+    return 1 if diagnostics else 0
@@ -1,27 +1,99 @@
 import ast
 from pathlib import Path
+from typing import NamedTuple
+
+from alembic_tools.prefetch import prefetch, read_text
+import alembic_tools.timings as timings
+
+
+class RevisionMethods(NamedTuple):
+    upgrade: str
+    downgrade: str
+    # first and last line (1-based, inclusive) of each function in the file
+    upgrade_lines: tuple[int, int]
+    downgrade_lines: tuple[int, int]
+
+
+# A revision file read and parsed once, for callers that need more of it than
+# the two methods
+class RevisionSource(NamedTuple):
+    lines: list[str]
+    tree: ast.Module
+    methods: RevisionMethods
 
 
 def get_revision_methods(p: Path) -> tuple[str, str] | None:
-    code = p.read_text()
-    tree = ast.parse(p.read_text(), filename=p)
-    upgrade_code = extract_function_code(tree, code, "upgrade")
-    downgrade_code = extract_function_code(tree, code, "downgrade")
-    if upgrade_code is None:
+    methods = read_revision_methods(p)
+    if methods is None:
+        return None
+    return methods.upgrade, methods.downgrade
+
+
+def read_revision_methods(p: Path, text: str | None = None) -> RevisionMethods | None:
+    # text is given when the file was already read, e.g. by prefetch
+    if text is None:
+        with timings.phase("read"):
+            text = p.read_text()
+    timings.count("files_read")
+    with timings.phase("read_methods"):
+        return read_revision_methods_text(text, p)
+
+
+def read_revision_methods_many(paths: list[Path]) -> list[RevisionMethods | None]:
+    return [read_revision_methods(p, text) for p, text in prefetch(read_text, paths)]
+
+
+def read_revision_source(p: Path, text: str | None = None) -> RevisionSource | None:
+    if text is None:
+        with timings.phase("read"):
+            text = p.read_text()
+    timings.count("files_read")
+    with timings.phase("read_methods"):
+        tree = ast.parse(text, filename=p)
+        lines = text.splitlines(keepends=True)
+        methods = revision_methods_from_tree(tree, lines)
+    if methods is None:
         return None
-    if downgrade_code is None:
+    return RevisionSource(lines, tree, methods)
+
+
+def read_revision_methods_text(code: str, p: Path | str) -> RevisionMethods | None:
+    tree = ast.parse(code, filename=p)
+    return revision_methods_from_tree(tree, code.splitlines(keepends=True))
+
+
+def revision_methods_from_tree(
+    tree: ast.Module, lines: list[str]
+) -> RevisionMethods | None:
+    found: dict[str, tuple[str, tuple[int, int]]] = {}
+    for node in tree.body:
+        if not isinstance(node, ast.FunctionDef):
+            continue
+        if node.name not in ("upgrade", "downgrade") or node.name in found:
+            continue
+        function_code = get_node_source(lines, node)
+        if function_code is None:
+            return None
+        assert node.end_lineno is not None
+        found[node.name] = (function_code.strip(), (node.lineno, node.end_lineno))
+    if "upgrade" not in found or "downgrade" not in found:
         return None
-    return upgrade_code, downgrade_code
+    upgrade_code, upgrade_lines = found["upgrade"]
+    downgrade_code, downgrade_lines = found["downgrade"]
+    return RevisionMethods(upgrade_code, downgrade_code, upgrade_lines, downgrade_lines)
 
 
-def extract_function_code(tree, code, function_name) -> str | None:
-    for node in ast.walk(tree):
-        if isinstance(node, ast.FunctionDef) and node.name == function_name:
-            function_code = ast.get_source_segment(code, node)
-            if function_code is None:
-                return None
-            return function_code.strip()
-    return None
+def get_node_source(lines: list[str], node: ast.stmt) -> str | None:
+    # Same as ast.get_source_segment, but reuses lines that were split once for
+    # the whole file
+    if node.end_lineno is None or node.end_col_offset is None:
+        return None
+    first = lines[node.lineno - 1].encode()[node.col_offset :].decode()
+    if node.lineno == node.end_lineno:
+        last_line = lines[node.lineno - 1].encode()
+        return last_line[node.col_offset : node.end_col_offset].decode()
+    last = lines[node.end_lineno - 1].encode()[: node.end_col_offset].decode()
+    return "".join([first, *lines[node.lineno : node.end_lineno - 1], last])
 
 
 def find_upgrade_function(node: ast.AST) -> ast.FunctionDef | None:
@@ -1,20 +1,54 @@
 import argparse
+import cProfile
 import os
 from pathlib import Path
 import sys
-from alembic_tools.move_revision import move_revision
-
-from alembic_tools.revision_collection import assign_order, get_script_directory
-from alembic_tools.search_collection import search_collection
+from alembic_tools.analyze_revision import load_plugins
+from alembic_tools.daemon_client import request_daemon
+from alembic_tools.revision_collection import CycleException
 from alembic_tools.visualize_graph import (
-    is_graphviz_installed,
-    visualize_graph_graphviz,
+    DEFAULT_COLLAPSE_RUN,
+    FORMATS,
+    GRAPHVIZ_FORMATS,
 )
-from alembic_tools.squash import squash_commits
+import alembic_tools.prefetch as prefetch
+import alembic_tools.timings as timings
 
 
 def main() -> int:
     parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="Print how long each phase of the command took",
+    )
+    parser.add_argument(
+        "--timings-json", metavar="FILE", help="Write the phase timings to FILE"
+    )
+    parser.add_argument(
+        "--profile", metavar="FILE", help="Run under cProfile and save stats to FILE"
+    )
+    parser.add_argument(
+        "--io-threads",
+        type=int,
+        default=prefetch.IO_THREADS,
+        metavar="N",
+        help=f"Read up to N revision files at once (default: {prefetch.IO_THREADS})",
+    )
+    parser.add_argument(
+        "--no-daemon",
+        action="store_true",
+        help="Don't hand search, order and schema to a running alembic_tools serve",
+    )
+    # shared by the subcommands that analyze revisions
+    jobs_p = argparse.ArgumentParser(add_help=False)
+    jobs_p.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of processes used to analyze revisions (default: CPU count)",
+    )
     subp = parser.add_subparsers(
         dest="subparser_name",
         help="Your help message",
@@ -29,61 +63,379 @@ def main() -> int:
     viz_p.add_argument(
         "--open", action="store_true", help="Open image after generating"
     )
+    viz_p.add_argument(
+        "--format",
+        choices=list(FORMATS),
+        default="png",
+        help="Output format; dot, json and mermaid don't need Graphviz (default: png)",
+    )
+    viz_p.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Write the output even if the graph hasn't changed since it was last made",
+    )
+    viz_p.add_argument(
+        "--around", metavar="REV", help="Only show revisions near this one"
+    )
+    viz_p.add_argument(
+        "--depth",
+        type=int,
+        default=2,
+        help="How many steps away from --around to go (default: 2)",
+    )
+    viz_p.add_argument(
+        "--since", metavar="REV", help="Only show this revision and what follows it"
+    )
+    viz_p.add_argument(
+        "--collapse",
+        nargs="?",
+        type=int,
+        const=DEFAULT_COLLAPSE_RUN,
+        metavar="N",
+        help=f"Draw runs of at least N revisions with no branches or merges as one node (default: {DEFAULT_COLLAPSE_RUN})",
+    )
     squash_p = subp.add_parser(
-        "squash", help="Squash/combine two revisions into a single revision"
+        "squash",
+        help="Squash/combine two revisions, or every revision between them, into a single revision",
     )
     squash_p.add_argument("revision_1", help="First revision to combine")
-    squash_p.add_argument("revision_2", help="Second revision to combine")
+    squash_p.add_argument(
+        "revision_2",
+        help="Last revision to combine; everything in between is combined too",
+    )
     squash_p.add_argument("-m", "--message", help="Name of commit")
     move_p = subp.add_parser(
         "move", help="Move a revision to another part of the graph"
     )
-    move_p.add_argument("rev_to_move", help="Revision to move")
+    move_p.add_argument("rev_to_move", nargs="?", help="Revision to move")
     move_p.add_argument(
         "rev_to_put_after",
+        nargs="?",
         help="Revision to put the moved revision after. Use base if you want to put it at the beginning.",
     )
-    search_p = subp.add_parser("search", help="Search for an entity to see its changes")
-    search_p.add_argument("-t", "--table")
-    search_p.add_argument("-r", "--replaceable")
+    move_p.add_argument(
+        "--plan",
+        type=Path,
+        help="File with one move per line (REV AFTER), or every revision in the order wanted, applied all at once",
+    )
+    search_p = subp.add_parser(
+        "search", parents=[jobs_p], help="Search for an entity to see its changes"
+    )
+    search_p.add_argument(
+        "-t", "--table", action="append", default=[], help="Can be repeated"
+    )
+    search_p.add_argument(
+        "-r", "--replaceable", action="append", default=[], help="Can be repeated"
+    )
+    search_p.add_argument(
+        "-c",
+        "--column",
+        action="append",
+        default=[],
+        metavar="TABLE.COLUMN",
+        help="Every revision that creates, adds, alters or drops the column. Can be repeated",
+    )
+    search_p.add_argument(
+        "--from-file",
+        type=Path,
+        help="File with one table name per line (prefix replaceable entities with replaceable:)",
+    )
+    search_p.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Re-analyze every revision instead of using .alembic_tools_cache",
+    )
+    index_p = subp.add_parser(
+        "index",
+        parents=[jobs_p],
+        help="Build the on-disk entity index used to speed up search",
+    )
+    index_p.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Re-analyze every revision instead of using .alembic_tools_cache",
+    )
+    schema_p = subp.add_parser(
+        "schema",
+        parents=[jobs_p],
+        help="Show the tables and columns as of a revision",
+    )
+    schema_p.add_argument("--at", required=True, help="Revision to show the schema at")
+    schema_p.add_argument("-t", "--table", help="Only show this table")
+    schema_p.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Re-analyze every revision instead of using .alembic_tools_cache",
+    )
+    check_p = subp.add_parser(
+        "check",
+        help="Check the graph for multiple heads, cycles, missing down revisions and duplicate ids",
+    )
+    check_p.add_argument(
+        "--changed-only",
+        nargs="?",
+        const="",
+        metavar="GIT_RANGE",
+        help="Only report problems with revisions changed in the working tree, or in GIT_RANGE (e.g. main..HEAD)",
+    )
+    check_p.add_argument(
+        "--json", action="store_true", help="Print the problems found as JSON"
+    )
+    query_p = subp.add_parser(
+        "query",
+        parents=[jobs_p],
+        help="Run SQL against a catalog of the revisions, edges and statements",
+    )
+    query_p.add_argument("sql", help='The query, e.g. "SELECT * FROM statements"')
+    query_p.add_argument("--json", action="store_true", help="Print the rows as JSON")
+    query_p.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Rebuild the catalog from scratch instead of updating it",
+    )
+    serve_p = subp.add_parser(
+        "serve",
+        parents=[jobs_p],
+        help="Keep the graph and analysis loaded and answer search, order and schema from memory",
+    )
+    serve_p.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Re-analyze every revision instead of using .alembic_tools_cache",
+    )
     # temp
     subp.add_parser("order")
 
     args = parser.parse_args()
+    if args.io_threads < 1:
+        print("--io-threads must be at least 1")
+        return 1
+    prefetch.IO_THREADS = args.io_threads
+    if getattr(args, "jobs", 1) < 1:
+        print("--jobs must be at least 1")
+        return 1
+    if args.timings or args.timings_json is not None:
+        timings.TIMINGS.enabled = True
+    profiler = cProfile.Profile()
+    if args.profile:
+        profiler.enable()
+    try:
+        with timings.phase(args.subparser_name or "help"):
+            return run_command(parser, args)
+    except CycleException as e:
+        # every command that loads the graph orders it first
+        print(f"Error: {e}")
+        return 1
+    finally:
+        if args.profile:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if args.timings:
+            timings.TIMINGS.print_summary()
+        if args.timings_json is not None:
+            timings.TIMINGS.write_json(args.timings_json)
+
+
+def run_command(parser: argparse.ArgumentParser, args: argparse.Namespace) -> int:
+    with timings.phase("load_plugins"):
+        load_plugins()
     if not Path("./alembic.ini").exists():
         print("Cannot find alembic.ini in the current folder.")
         return 1
+    # Each command imports what it needs as it runs: alembic alone takes longer
+    # to import than a running daemon takes to answer
     match args.subparser_name:
         case "visualize":
-            if not is_graphviz_installed():
+            from alembic_tools.revision_collection import (
+                RevisionGraph,
+                get_unambiguous_revision,
+            )
+            from alembic_tools.visualize_graph import (
+                collapse_chains,
+                descendants,
+                graph_view,
+                is_graphviz_installed,
+                neighborhood,
+                render_view,
+            )
+
+            if args.format in GRAPHVIZ_FORMATS and not is_graphviz_installed():
                 print(
                     "Graphviz is not found in the path. Please install it from https://graphviz.org/download/ and make sure to select the option to add it to your path."
                 )
                 return 1
+            if args.depth < 0:
+                print("--depth must be at least 0")
+                return 1
+            if args.collapse is not None and args.collapse < 2:
+                print("--collapse must be at least 2")
+                return 1
+            graph = RevisionGraph.load()
+            revisions: set[str] | None = None
+            if args.around is not None:
+                success, around = get_unambiguous_revision(args.around, graph)
+                if not success:
+                    return 1
+                revisions = neighborhood(graph, around, args.depth)
+            if args.since is not None:
+                success, since = get_unambiguous_revision(args.since, graph)
+                if not success:
+                    return 1
+                after = descendants(graph, since)
+                revisions = after if revisions is None else revisions & after
             print("Vizualizing")
-            visualize_graph_graphviz(horiz=args.horiz)
+            view = graph_view(graph, revisions)
+            if args.collapse is not None:
+                view = collapse_chains(view, args.collapse)
+            output, written = render_view(
+                view, args.horiz, args.format, use_cache=not args.no_cache
+            )
+            if written:
+                print(f"Wrote {output}")
+            else:
+                print(f"{output} is already up to date")
             if args.open:
-                os.startfile("alembic_graph.png")
+                os.startfile(output)
             return 0
         case "squash":
+            from alembic_tools.revision_collection import RevisionGraph
+            from alembic_tools.squash import squash_commits
+
             rev1 = args.revision_1
             rev2 = args.revision_2
             commit_name = args.message
-            return squash_commits(rev1, rev2, commit_name)
+            return squash_commits(RevisionGraph.load(), rev1, rev2, commit_name)
         case "move":
+            from alembic_tools.move_revision import move_plan, move_revision, read_plan
+            from alembic_tools.revision_collection import RevisionGraph
+
+            if args.plan is not None:
+                if args.rev_to_move is not None:
+                    print("Give either --plan or a revision to move, not both")
+                    return 1
+                if not args.plan.exists():
+                    print(f"Cannot find {args.plan}")
+                    return 1
+                return move_plan(RevisionGraph.load(), read_plan(args.plan))
+            if args.rev_to_move is None or args.rev_to_put_after is None:
+                print("Must specify a revision to move and where to put it, or --plan")
+                return 1
             rev_to_move = args.rev_to_move
             rev_to_put_after = args.rev_to_put_after
-            return move_revision(rev_to_move, rev_to_put_after)
+            return move_revision(RevisionGraph.load(), rev_to_move, rev_to_put_after)
         case "search":
-            if args.table is None and args.replaceable is None:
-                print("Must specify either a table or a replaceable entity")
+            from alembic_tools.search_collection import (
+                NamesFileException,
+                read_names_file,
+                split_column_name,
+            )
+
+            table_names = list(args.table)
+            replaceable_names = list(args.replaceable)
+            columns = []
+            for column_name in args.column:
+                column = split_column_name(column_name)
+                if column is None:
+                    print(f"Columns are given as table.column, not {column_name!r}")
+                    return 1
+                columns.append(column)
+            if args.from_file is not None:
+                if not args.from_file.exists():
+                    print(f"Cannot find {args.from_file}")
+                    return 1
+                try:
+                    file_names = read_names_file(args.from_file)
+                except NamesFileException as e:
+                    print(e)
+                    return 1
+                table_names += file_names[0]
+                replaceable_names += file_names[1]
+                columns += file_names[2]
+            if not table_names and not replaceable_names and not columns:
+                print("Must specify a table, a replaceable entity or a column")
                 return 1
-            search_collection(args.table, args.replaceable)
+            if not args.no_daemon and not args.no_cache:
+                code = request_daemon(
+                    {
+                        "command": "search",
+                        "tables": table_names,
+                        "replaceables": replaceable_names,
+                        "columns": columns,
+                    }
+                )
+                if code is not None:
+                    return code
+            from alembic_tools.revision_collection import get_script_directory
+            from alembic_tools.search_collection import search_collection
+
+            search_collection(
+                get_script_directory(),
+                table_names,
+                replaceable_names,
+                use_cache=not args.no_cache,
+                jobs=args.jobs,
+                columns=columns,
+            )
             return 0
+        case "index":
+            from alembic_tools.entity_index import index_collection
+            from alembic_tools.revision_collection import get_script_directory
+
+            return index_collection(
+                get_script_directory(), use_cache=not args.no_cache, jobs=args.jobs
+            )
+        case "query":
+            from alembic_tools.catalog import query_collection
+            from alembic_tools.revision_collection import get_script_directory
+
+            return query_collection(
+                get_script_directory(),
+                args.sql,
+                as_json=args.json,
+                use_cache=not args.no_cache,
+                jobs=args.jobs,
+            )
+        case "schema":
+            if not args.no_daemon and not args.no_cache:
+                code = request_daemon(
+                    {"command": "schema", "at": args.at, "table": args.table}
+                )
+                if code is not None:
+                    return code
+            from alembic_tools.revision_collection import RevisionGraph
+            from alembic_tools.schema_replay import schema_collection
+
+            return schema_collection(
+                RevisionGraph.load(),
+                args.at,
+                args.table,
+                use_cache=not args.no_cache,
+                jobs=args.jobs,
+            )
+        case "check":
+            from alembic_tools.check_graph import check_collection
+
+            return check_collection(
+                changed_only=args.changed_only is not None,
+                git_range=args.changed_only or None,
+                as_json=args.json,
+            )
+        case "serve":
+            from alembic_tools.daemon import serve
+            from alembic_tools.revision_collection import get_script_directory
+
+            return serve(
+                get_script_directory(), use_cache=not args.no_cache, jobs=args.jobs
+            )
         # temp
         case "order":
-            folder = get_script_directory()
-            print(assign_order(folder))
+            if not args.no_daemon:
+                code = request_daemon({"command": "order"})
+                if code is not None:
+                    return code
+            from alembic_tools.revision_collection import RevisionGraph, print_order
+
+            print_order(RevisionGraph.load())
             return 0
         case _:
             parser.print_help()
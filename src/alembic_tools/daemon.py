@@ -0,0 +1,274 @@
+from contextlib import redirect_stdout
+import io
+import json
+from pathlib import Path
+import signal
+import socket
+import socketserver
+import sys
+import traceback
+from typing import TYPE_CHECKING
+
+import alembic_tools.analyze_revision as ar
+from alembic_tools.analysis_cache import AnalysisCache, analyze_revisions
+from alembic_tools.daemon_client import daemon_supported, daemon_version, socket_path
+from alembic_tools.entity_index import file_fingerprint
+from alembic_tools.revision_collection import (
+    RevisionGraph,
+    RevisionHeader,
+    get_unambiguous_revision,
+    list_revision_files,
+    print_order,
+    read_revision_header,
+)
+from alembic_tools.schema_replay import SchemaSnapshots, print_schema
+from alembic_tools.search_collection import print_search_results, search_analyses
+import alembic_tools.timings as timings
+
+if TYPE_CHECKING:
+    from alembic.script import ScriptDirectory
+
+# How often the versions directory is checked for changes while idle
+POLL_INTERVAL = 1.0
+
+
+# The graph and the analysis of every revision, kept in memory and brought up
+# to date by re-reading only the files that changed
+class WarmProject:
+    script_folder: "ScriptDirectory"
+    files: dict[str, list[int]]
+    headers: dict[str, RevisionHeader]
+    analyses: dict[str, ar.Revision]
+    # files that couldn't be analyzed, and why; they're retried on every poll
+    failed: dict[str, str]
+    graph: RevisionGraph | None
+    graph_error: str | None
+    snapshots: SchemaSnapshots | None
+
+    def __init__(self, script_folder: "ScriptDirectory") -> None:
+        self.script_folder = script_folder
+        self.files = {}
+        self.headers = {}
+        self.analyses = {}
+        self.failed = {}
+        self.graph = None
+        self.graph_error = None
+        self.snapshots = None
+
+    def refresh(self, cache: AnalysisCache | None = None, jobs: int = 1) -> bool:
+        # Returns whether anything changed
+        with timings.phase("refresh"):
+            paths = list_revision_files(self.script_folder)
+            current = {}
+            for p in paths:
+                try:
+                    current[str(p)] = file_fingerprint(p)
+                except FileNotFoundError:
+                    # deleted since the directory was listed
+                    continue
+            changed = [
+                p
+                for p in paths
+                if str(p) in current and self.files.get(str(p)) != current[str(p)]
+            ]
+            removed = [key for key in self.files if key not in current]
+            if not changed and not removed and self.graph is not None:
+                return False
+            for key in removed:
+                del self.files[key]
+                self.headers.pop(key, None)
+                self.analyses.pop(key, None)
+                self.failed.pop(key, None)
+            to_analyze = []
+            for p in changed:
+                key = str(p)
+                self.analyses.pop(key, None)
+                self.failed.pop(key, None)
+                try:
+                    header = read_revision_header(self.script_folder, p)
+                except Exception as e:
+                    self.headers.pop(key, None)
+                    self.failed[key] = f"Could not read {p}: {e}"
+                    continue
+                if header is None:
+                    self.headers.pop(key, None)
+                else:
+                    self.headers[key] = header
+                    to_analyze.append(p)
+                self.files[key] = current[key]
+            self._analyze(to_analyze, cache, jobs)
+            self._rebuild_graph(paths)
+            return True
+
+    def _analyze(
+        self, paths: list[Path], cache: AnalysisCache | None, jobs: int
+    ) -> None:
+        try:
+            analyses = analyze_revisions(paths, cache, jobs=jobs)
+        except Exception:
+            # find out which ones are broken
+            analyses = []
+            for p in paths:
+                try:
+                    analyses.append(ar.analyze_revision(p))
+                except Exception as e:
+                    analyses.append(None)
+                    self.failed[str(p)] = f"Could not analyze {p}: {e}"
+        for p, rev_analysis in zip(paths, analyses):
+            if rev_analysis is None:
+                # not fingerprinted, so it's looked at again next time
+                self.files.pop(str(p), None)
+            else:
+                self.analyses[str(p)] = rev_analysis
+
+    def _rebuild_graph(self, paths: list[Path]) -> None:
+        self.snapshots = None
+        # keep the same header order as a fresh scan would
+        headers = [self.headers[str(p)] for p in paths if str(p) in self.headers]
+        try:
+            self.graph = RevisionGraph(self.script_folder, headers)
+            self.graph_error = None
+        except Exception as e:
+            self.graph = None
+            self.graph_error = str(e)
+
+    def analyses_by_revision(self) -> dict[str, ar.Revision]:
+        return {
+            header.revision: self.analyses[key]
+            for key, header in self.headers.items()
+            if key in self.analyses
+        }
+
+    def answer(self, request: dict) -> tuple[int | None, str]:
+        # A code of None tells the client to do the work itself
+        if request.get("version") != daemon_version():
+            return None, ""
+        out = io.StringIO()
+        with redirect_stdout(out):
+            try:
+                code = self._answer(request)
+            except Exception:
+                # a bug here shouldn't stop the command working: the client
+                # runs it instead, and the traceback goes to the daemon's stderr
+                traceback.print_exc()
+                return None, ""
+        return code, out.getvalue()
+
+    def _answer(self, request: dict) -> int | None:
+        self.refresh()
+        if self.graph is None:
+            print(self.graph_error)
+            return 1
+        command = request["command"]
+        if command == "order":
+            print_order(self.graph)
+            return 0
+        if self.failed:
+            for message in self.failed.values():
+                print(message)
+            return 1
+        analyses = self.analyses_by_revision()
+        match command:
+            case "search":
+                results = search_analyses(
+                    self.graph,
+                    analyses,
+                    request["tables"],
+                    request["replaceables"],
+                    # (table, column) pairs come over as lists
+                    [(table, column) for table, column in request["columns"]],
+                )
+                print_search_results(results)
+                return 0
+            case "schema":
+                success, revision = get_unambiguous_revision(request["at"], self.graph)
+                if not success:
+                    return 1
+                snapshots = self.snapshots
+                if snapshots is None:
+                    snapshots = SchemaSnapshots()
+                    snapshots.build(self.graph, analyses)
+                    self.snapshots = snapshots
+                schema = snapshots.schema_at(self.graph, revision, analyses)
+                return print_schema(schema, revision, request["table"])
+        return None
+
+
+class DaemonHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError:
+            return
+        assert isinstance(self.server, DaemonServer)
+        code, output = self.server.project.answer(request)
+        self.wfile.write(json.dumps({"code": code, "output": output}).encode())
+
+
+# socketserver only has UnixStreamServer where there are Unix domain sockets.
+# DaemonServer is defined everywhere so the module imports, but serve refuses to
+# run without them.
+if sys.platform == "win32":
+    ServerBase = socketserver.TCPServer
+else:
+    ServerBase = socketserver.UnixStreamServer
+
+
+# One request at a time; between requests the versions directory is polled
+class DaemonServer(ServerBase):
+    timeout = POLL_INTERVAL
+    project: WarmProject
+
+    def handle_timeout(self) -> None:
+        try:
+            if self.project.refresh():
+                print("Revisions changed; brought up to date", file=sys.stderr)
+        except Exception:
+            traceback.print_exc()
+
+
+def is_daemon_running(path: Path) -> bool:
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(str(path))
+        return True
+    except OSError:
+        return False
+
+
+def serve(
+    script_folder: "ScriptDirectory", use_cache: bool = True, jobs: int = 1
+) -> int:
+    if not daemon_supported():
+        print("serve needs Unix domain sockets, which this platform doesn't have")
+        return 1
+    path = socket_path()
+    if path.exists():
+        if is_daemon_running(path):
+            print(f"A daemon is already listening on {path}")
+            return 1
+        # left behind by a daemon that didn't shut down cleanly
+        path.unlink()
+    project = WarmProject(script_folder)
+    cache = None
+    if use_cache:
+        cache = AnalysisCache()
+        cache.load()
+    project.refresh(cache, jobs)
+    if cache is not None:
+        cache.save()
+    path.parent.mkdir(exist_ok=True)
+    server = DaemonServer(str(path), DaemonHandler)
+    server.project = project
+    print(f"Loaded {len(project.headers)} revisions; listening on {path}")
+    # stopped with kill as often as with Ctrl-C; either way the socket goes
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        while True:
+            server.handle_request()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        path.unlink(missing_ok=True)
+    return 0
@@ -0,0 +1,60 @@
+import json
+from pathlib import Path
+import socket
+
+import alembic_tools.analyze_revision as ar
+from alembic_tools.analysis_cache import CACHE_DIR
+import alembic_tools.timings as timings
+
+# Kept apart from the daemon itself, which needs alembic: handing a query to a
+# running daemon should cost little more than starting Python.
+
+SOCKET_NAME = "daemon.sock"
+# Bump when requests or replies change shape
+PROTOCOL_VERSION = 2
+# How long a client waits for an answer before doing the work itself
+CLIENT_TIMEOUT = 60.0
+
+
+def socket_path(cache_dir: Path = CACHE_DIR) -> Path:
+    # relative to the folder with alembic.ini, which keeps it well inside the
+    # length limit for socket paths
+    return cache_dir / SOCKET_NAME
+
+
+def daemon_version() -> str:
+    # a daemon started by another version of the tools can't be trusted to
+    # give the same answers
+    return f"{PROTOCOL_VERSION}:{ar.analyzer_version()}"
+
+
+def daemon_supported() -> bool:
+    return hasattr(socket, "AF_UNIX")
+
+
+def request_daemon(request: dict, cache_dir: Path = CACHE_DIR) -> int | None:
+    # Hand a query to a running daemon and print its answer. Returns None when
+    # there's no daemon to ask, or it can't answer, so the caller does the work.
+    path = socket_path(cache_dir)
+    if not daemon_supported() or not path.exists():
+        return None
+    with timings.phase("daemon_request"):
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(CLIENT_TIMEOUT)
+                sock.connect(str(path))
+                message = {**request, "version": daemon_version()}
+                sock.sendall(json.dumps(message).encode() + b"\n")
+                chunks = []
+                while chunk := sock.recv(65536):
+                    chunks.append(chunk)
+        except OSError:
+            return None
+    try:
+        reply = json.loads(b"".join(chunks))
+    except ValueError:
+        return None
+    if reply.get("code") is None:
+        return None
+    print(reply["output"], end="")
+    return reply["code"]
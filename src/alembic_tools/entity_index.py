@@ -0,0 +1,343 @@
+import json
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+import alembic_tools.analyze_revision as ar
+import alembic_tools.git_state as git_state
+import alembic_tools.timings as timings
+from alembic_tools.analysis_cache import CACHE_DIR, AnalysisCache, analyze_revisions
+from alembic_tools.revision_collection import (
+    RevisionGraph,
+    RevisionHeader,
+    list_revision_files,
+    scan_changed_headers,
+)
+
+if TYPE_CHECKING:
+    from alembic.script import ScriptDirectory
+
+INDEX_FILE = "index.json"
+# Bump when the layout of the index file changes
+INDEX_VERSION = 2
+
+Record = list[Any]
+
+
+def statement_to_record(stmt: ar.Statement) -> Record | None:
+    match stmt:
+        case ar.CreateTableStatement():
+            return [
+                "create_table",
+                stmt.table_name,
+                [c.column_name for c in stmt.columns],
+            ]
+        case ar.AddColumnStatement():
+            return ["add_column", stmt.table_name, stmt.column_name]
+        case ar.AlterColumnStatement():
+            return ["alter_column", stmt.table_name, stmt.column_name]
+        case ar.DropColumnStatement():
+            return ["drop_column", stmt.table_name, stmt.column_name]
+        case ar.CreateIndexStatement():
+            return ["create_index", stmt.table_name]
+        case ar.DropTableStatement():
+            return ["drop_table", stmt.table_name]
+        case ar.CreateForeignKeyStatement():
+            return ["create_foreign_key", stmt.table_name, stmt.referent_table_name]
+        case ar.ReplaceableStatement():
+            return [
+                "replaceable",
+                stmt.replaceable_name,
+                stmt.replaceable_op.value,
+                stmt.replaces,
+            ]
+    return None
+
+
+def statement_from_record(record: Record) -> ar.Statement:
+    match record:
+        case ["create_table", table_name, column_names]:
+            create = ar.CreateTableStatement(table_name)
+            create.columns = [ar.Column(c) for c in column_names]
+            return create
+        case ["add_column", table_name, column_name]:
+            return ar.AddColumnStatement(table_name, column_name)
+        case ["alter_column", table_name, column_name]:
+            return ar.AlterColumnStatement(table_name, column_name)
+        case ["drop_column", table_name, column_name]:
+            return ar.DropColumnStatement(table_name, column_name)
+        case ["create_index", table_name]:
+            return ar.CreateIndexStatement(table_name)
+        case ["drop_table", table_name]:
+            return ar.DropTableStatement(table_name)
+        case ["create_foreign_key", table_name, referent_table_name]:
+            return ar.CreateForeignKeyStatement(table_name, referent_table_name)
+        case ["replaceable", name, op, replaces]:
+            return ar.ReplaceableStatement(
+                name, ar.ReplaceableOperation(op), replaces=replaces
+            )
+    raise ValueError(f"Unknown index record {record}")
+
+
+def revision_from_records(records: list[Record]) -> ar.Revision:
+    rev = ar.Revision()
+    rev.statements = [statement_from_record(r) for r in records]
+    return rev
+
+
+def file_fingerprint(p: Path) -> list[int]:
+    st = p.stat()
+    return [st.st_size, st.st_mtime_ns]
+
+
+def files_are_fresh(
+    files: dict[str, list[int]],
+    paths: list[Path],
+    git: git_state.RepoState | None = None,
+) -> bool:
+    # True if paths are exactly the files fingerprinted, all unchanged. Given
+    # the git state the fingerprints were taken at, files git reports as
+    # unchanged since then are taken as they are.
+    if len(paths) != len(files):
+        return False
+    if any(str(p) not in files for p in paths):
+        return False
+    unchanged = git_state.unchanged_files(git, files)
+    for p in paths:
+        key = str(p)
+        if key not in unchanged and files[key] != file_fingerprint(p):
+            return False
+    return True
+
+
+# Inverted index from entity names to the revisions (and the operations in
+# them) that touch those entities, so that a search only has to look at hits.
+class EntityIndex:
+    files: dict[str, list[int]]
+    git: git_state.RepoState | None
+    # path -> [revision, down revision, doc], so that rebuilding the index
+    # only has to read the files that changed
+    headers: dict[str, list[Any]]
+    order: dict[str, int]
+    tables: dict[str, dict[str, list[Record]]]
+    columns: dict[str, list[str]]
+    replaceables: dict[str, dict[str, list[Record]]]
+
+    def __init__(self) -> None:
+        self.files = {}
+        self.git = None
+        self.headers = {}
+        self.order = {}
+        self.tables = {}
+        self.columns = {}
+        self.replaceables = {}
+        self._unchanged: set[str] | None = None
+
+    def add_revision(self, revision_id: str, rev_analysis: ar.Revision) -> None:
+        for stmt in rev_analysis.statements:
+            record = statement_to_record(stmt)
+            if record is None:
+                continue
+            match stmt:
+                case ar.ReplaceableStatement():
+                    self._post(
+                        self.replaceables, stmt.replaceable_name, revision_id, record
+                    )
+                case ar.CreateForeignKeyStatement():
+                    self._post(self.tables, stmt.table_name, revision_id, record)
+                    if stmt.referent_table_name != stmt.table_name:
+                        self._post(
+                            self.tables, stmt.referent_table_name, revision_id, record
+                        )
+                case ar.CreateTableStatement():
+                    self._post(self.tables, stmt.table_name, revision_id, record)
+                    for c in stmt.columns:
+                        self._post_column(stmt.table_name, c.column_name, revision_id)
+                case (
+                    ar.AddColumnStatement()
+                    | ar.AlterColumnStatement()
+                    | ar.DropColumnStatement()
+                ):
+                    self._post(self.tables, stmt.table_name, revision_id, record)
+                    self._post_column(stmt.table_name, stmt.column_name, revision_id)
+                case ar.CreateIndexStatement() | ar.DropTableStatement():
+                    self._post(self.tables, stmt.table_name, revision_id, record)
+
+    def _post(
+        self,
+        postings: dict[str, dict[str, list[Record]]],
+        name: str,
+        revision_id: str,
+        record: Record,
+    ) -> None:
+        postings.setdefault(name, {}).setdefault(revision_id, []).append(record)
+
+    def _post_column(self, table_name: str, column_name: str, revision_id: str) -> None:
+        revs = self.columns.setdefault(f"{table_name}.{column_name}", [])
+        if not revs or revs[-1] != revision_id:
+            revs.append(revision_id)
+
+    def table_hits(self, table_name: str) -> dict[str, ar.Revision]:
+        return {
+            rev_id: revision_from_records(records)
+            for rev_id, records in self.tables.get(table_name, {}).items()
+        }
+
+    def column_hits(self, table_name: str, column_name: str) -> dict[str, ar.Revision]:
+        # the revisions come from the column's own postings, and their
+        # statements from the table's
+        postings = self.tables.get(table_name, {})
+        return {
+            rev_id: revision_from_records(postings[rev_id])
+            for rev_id in self.columns.get(f"{table_name}.{column_name}", [])
+        }
+
+    def replaceable_hits(self, replaceable_name: str) -> dict[str, ar.Revision]:
+        return {
+            rev_id: revision_from_records(records)
+            for rev_id, records in self.replaceables.get(replaceable_name, {}).items()
+        }
+
+    def unchanged_files(self) -> set[str]:
+        # the files git vouches for as unchanged since the index was built
+        unchanged = self._unchanged
+        if unchanged is None:
+            unchanged = git_state.unchanged_files(self.git, self.files)
+            self._unchanged = unchanged
+        return unchanged
+
+    def is_fresh(self, paths: list[Path]) -> bool:
+        return files_are_fresh(self.files, paths, self.git)
+
+    def save(self, cache_dir: Path = CACHE_DIR) -> None:
+        cache_dir.mkdir(exist_ok=True)
+        path = cache_dir / INDEX_FILE
+        tmp_path = path.with_suffix(".tmp")
+        with timings.phase("save_index"):
+            tmp_path.write_text(
+                json.dumps(
+                    {
+                        "version": [INDEX_VERSION, ar.analyzer_version()],
+                        "files": self.files,
+                        "git": self.git,
+                        "headers": self.headers,
+                        "order": self.order,
+                        "tables": self.tables,
+                        "columns": self.columns,
+                        "replaceables": self.replaceables,
+                    }
+                )
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, cache_dir: Path = CACHE_DIR) -> "EntityIndex | None":
+        path = cache_dir / INDEX_FILE
+        if not path.exists():
+            return None
+        try:
+            with timings.phase("load_index"):
+                data = json.loads(path.read_text())
+        except ValueError:
+            return None
+        if data.get("version") != [INDEX_VERSION, ar.analyzer_version()]:
+            return None
+        index = cls()
+        index.files = data["files"]
+        index.git = data["git"]
+        index.headers = data["headers"]
+        index.order = data["order"]
+        index.tables = data["tables"]
+        index.columns = data["columns"]
+        index.replaceables = data["replaceables"]
+        return index
+
+
+def header_to_record(header: RevisionHeader) -> list[Any]:
+    down_revision = header.down_revision
+    if isinstance(down_revision, tuple):
+        down_revision = list(down_revision)
+    return [header.revision, down_revision, header.doc]
+
+
+def header_from_record(record: list[Any], path: str) -> RevisionHeader:
+    revision, down_revision, doc = record
+    if isinstance(down_revision, list):
+        down_revision = tuple(down_revision)
+    return RevisionHeader(revision, down_revision, doc, path)
+
+
+def scan_headers_since(
+    script_folder: "ScriptDirectory", previous: EntityIndex | None
+) -> list[RevisionHeader]:
+    # The headers of every revision file, reusing those stored in previous for
+    # the files git reports as unchanged since it was built
+    known = {}
+    if previous is not None:
+        known = {
+            key: header_from_record(previous.headers[key], key)
+            for key in previous.unchanged_files()
+        }
+    return scan_changed_headers(script_folder, known)
+
+
+def build_index(
+    graph: RevisionGraph,
+    use_cache: bool = True,
+    jobs: int = 1,
+    previous: EntityIndex | None = None,
+) -> EntityIndex:
+    revisions = list(graph.revisions.values())
+    paths = [Path(rev.path) for rev in revisions]
+    cache = None
+    if use_cache:
+        cache = AnalysisCache()
+        cache.load()
+    analyses = analyze_revisions(paths, cache, jobs=jobs)
+    if cache is not None:
+        cache.save()
+    # fingerprints of files git vouches for are carried over without a stat
+    unchanged = set() if previous is None else previous.unchanged_files()
+    index = EntityIndex()
+    index.order = graph.order_map
+    with timings.phase("build_index"):
+        for rev, p, rev_analysis in zip(revisions, paths, analyses):
+            key = str(p)
+            if previous is not None and key in unchanged:
+                index.files[key] = previous.files[key]
+            else:
+                index.files[key] = file_fingerprint(p)
+            index.headers[key] = header_to_record(rev)
+            index.add_revision(rev.revision, rev_analysis)
+    return index
+
+
+def load_fresh_index(script_folder: "ScriptDirectory") -> EntityIndex | None:
+    index = EntityIndex.load()
+    if index is None:
+        return None
+    with timings.phase("check_index"):
+        fresh = index.is_fresh(list_revision_files(script_folder))
+    if not fresh:
+        print("Index is out of date, falling back to a full scan.")
+        print("Run alembic_tools index to bring it up to date.")
+        return None
+    return index
+
+
+def index_collection(
+    script_folder: "ScriptDirectory", use_cache: bool = True, jobs: int = 1
+) -> int:
+    # taken before any file is read, so that whatever changes after this
+    # shows up as changed next time
+    state = git_state.repo_state()
+    previous = EntityIndex.load() if use_cache else None
+    graph = RevisionGraph(script_folder, scan_headers_since(script_folder, previous))
+    index = build_index(graph, use_cache=use_cache, jobs=jobs, previous=previous)
+    index.git = state
+    index.save()
+    print(
+        f"Indexed {len(index.files)} revisions: {len(index.tables)} tables, "
+        f"{len(index.columns)} columns, {len(index.replaceables)} replaceables"
+    )
+    return 0
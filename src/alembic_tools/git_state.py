@@ -0,0 +1,99 @@
+import os
+from pathlib import Path
+import subprocess
+from typing import Any, Iterable
+
+import alembic_tools.timings as timings
+
+# The commit a cache or index was built at, and the files that differed from
+# it at the time, as stored alongside it:
+#     {"commit": "<sha>", "dirty": ["/abs/path", ...]}
+RepoState = dict[str, Any]
+
+
+class GitException(Exception):
+    pass
+
+
+def git_lines(args: list[str], cwd: str | None = None) -> list[str]:
+    try:
+        result = subprocess.run(
+            ["git", *args], capture_output=True, text=True, check=True, cwd=cwd
+        )
+    except FileNotFoundError:
+        raise GitException("git is not installed")
+    except subprocess.CalledProcessError as e:
+        raise GitException(e.stderr.strip() or f"git {' '.join(args)} failed")
+    return [line for line in result.stdout.splitlines() if line]
+
+
+def changed_files(git_range: str | None) -> set[Path]:
+    # Files changed in the working tree (staged or not, and untracked ones), or
+    # between the two ends of a range such as main..HEAD
+    if git_range is None:
+        names = git_lines(["diff", "--name-only", "--relative", "HEAD"])
+        names += git_lines(["ls-files", "--others", "--exclude-standard"])
+    else:
+        names = git_lines(["diff", "--name-only", "--relative", git_range])
+    return {Path(name).resolve() for name in names}
+
+
+def git_paths(args: list[str], cwd: str) -> list[str]:
+    # Absolute paths of the files git lists, unquoted whatever their names
+    output = subprocess.run(
+        ["git", *args, "-z"], capture_output=True, text=True, cwd=cwd
+    )
+    if output.returncode != 0:
+        raise GitException(output.stderr.strip() or f"git {' '.join(args)} failed")
+    return [os.path.join(cwd, name) for name in output.stdout.split("\0") if name]
+
+
+def differences(commit: str) -> tuple[str, str, set[str]]:
+    # The top folder of the repository, the commit resolved to a sha, and every
+    # file in the working tree that isn't as it is in that commit
+    toplevel, sha = git_lines(["rev-parse", "--show-toplevel", commit])
+    changed = git_paths(["diff", "--name-only", sha], toplevel)
+    changed += git_paths(["ls-files", "--others", "--exclude-standard"], toplevel)
+    return toplevel, sha, set(changed)
+
+
+def repo_state() -> RepoState | None:
+    # None outside a git repository, or before its first commit
+    with timings.phase("git"):
+        try:
+            _, sha, dirty = differences("HEAD")
+        except GitException:
+            return None
+    return {"commit": sha, "dirty": sorted(dirty)}
+
+
+def unchanged_files(state: RepoState | None, paths: Iterable[str]) -> set[str]:
+    # The paths git can vouch for as unchanged since state was recorded: in the
+    # repository, not ignored by it, and neither changed since the commit then
+    # nor already changed at the time. Empty when there is no state or git
+    # can't tell, in which case every file has to be checked.
+    if state is None:
+        return set()
+    with timings.phase("git"):
+        try:
+            toplevel, _, changed = differences(state["commit"])
+            ignored = git_paths(
+                [
+                    "ls-files",
+                    "--others",
+                    "--ignored",
+                    "--exclude-standard",
+                    "--directory",
+                ],
+                toplevel,
+            )
+        except GitException:
+            return set()
+    changed.update(state["dirty"])
+    inside = os.path.join(toplevel, "")
+    outside = tuple(ignored)
+    return {
+        p
+        for p in paths
+        if p.startswith(inside) and not p.startswith(outside) and p not in changed
+    }
@@ -1,91 +1,285 @@
+import ast
 from pathlib import Path
 import re
 import shutil
-from alembic.script import Script
+import alembic_tools.timings as timings
 from alembic_tools.revision_collection import (
-    get_revision_map,
-    get_script_directory,
+    CycleException,
+    RevisionGraph,
+    RevisionHeader,
     get_unambiguous_revision,
+    get_unambiguous_revisions,
+    topological_sort,
 )
 
 
-def find_rev_with_down_revision(
-    revision_map: dict[str, Script], rev_to_move_after: str | None
-) -> tuple[bool, str]:
-    for rev, scr in revision_map.items():
-        if scr.down_revision == rev_to_move_after:
-            return True, rev
-    print(f"Error: Could not find a node that points back to {rev_to_move_after}")
-    return False, ""
+def to_down_revision(parents: list[str]) -> str | tuple[str, ...] | None:
+    if not parents:
+        return None
+    if len(parents) == 1:
+        return parents[0]
+    return tuple(parents)
 
 
-def change_down_revision(script: Script, down_revision: str | None) -> None:
+def replace_parent(parents: list[str], old: str, new: list[str]) -> list[str]:
+    # Keeps the position of the replaced parent so merge tuples stay in order
+    ret: list[str] = []
+    for parent in parents:
+        for p in new if parent == old else [parent]:
+            if p not in ret:
+                ret.append(p)
+    return ret
+
+
+def bases_of(parents: dict[str, list[str]], revs: list[str]) -> list[str]:
+    # The bases that revs descend from, leaving out down revisions that aren't
+    # in the graph
+    bases = []
+    seen = set(revs)
+    stack = list(revs)
+    while stack:
+        rev = stack.pop()
+        if rev not in parents:
+            continue
+        if not parents[rev] and rev not in bases:
+            bases.append(rev)
+        for parent in parents[rev]:
+            if parent not in seen:
+                seen.add(parent)
+                stack.append(parent)
+    return bases
+
+
+def move_in_graph(
+    parents: dict[str, list[str]],
+    children: dict[str, list[str]],
+    rev_to_move: str,
+    rev_to_move_after: str | None,
+) -> None:
+    # Take the revision out of the graph: its children now follow whatever it
+    # was following
+    old_parents = parents[rev_to_move]
+    old_children = children[rev_to_move]
+    for child in children[rev_to_move]:
+        parents[child] = replace_parent(parents[child], rev_to_move, old_parents)
+        for parent in old_parents:
+            if child not in children[parent]:
+                children[parent].append(child)
+    for parent in old_parents:
+        children[parent].remove(rev_to_move)
+    children[rev_to_move] = []
+
+    # Put it back after its new down revision, ahead of everything that
+    # currently follows that revision
+    if rev_to_move_after is None:
+        # only the base of its own line goes after it; other bases are
+        # independent and stay where they are
+        if old_parents:
+            followers = bases_of(parents, old_parents)
+        else:
+            followers = [child for child in old_children if not parents[child]]
+    else:
+        followers = children[rev_to_move_after]
+        children[rev_to_move_after] = []
+    for child in followers:
+        if rev_to_move_after is None:
+            parents[child] = [rev_to_move]
+        else:
+            parents[child] = replace_parent(
+                parents[child], rev_to_move_after, [rev_to_move]
+            )
+        children[rev_to_move].append(child)
+    if rev_to_move_after is None:
+        parents[rev_to_move] = []
+    else:
+        parents[rev_to_move] = [rev_to_move_after]
+        children[rev_to_move_after].append(rev_to_move)
+
+
+def set_down_revision_text(
+    text: str, down_revision: str | tuple[str, ...] | None
+) -> str:
+    revises = ""
+    if isinstance(down_revision, str):
+        revises = down_revision
+    elif down_revision is not None:
+        revises = ", ".join(down_revision)
+    text = re.sub(R"Revises:[ \t]?[^\n]*", f"Revises: {revises}", text, count=1)
+    # Find the assignment itself so any annotation and layout is kept and only
+    # the value is swapped, even when it's a tuple spread across lines
+    tree = ast.parse(text)
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1:
+            target, value = node.targets[0], node.value
+        elif isinstance(node, ast.AnnAssign) and node.value is not None:
+            target, value = node.target, node.value
+        else:
+            continue
+        if isinstance(target, ast.Name) and target.id == "down_revision":
+            break
+    else:
+        raise Exception("Could not find down_revision in revision file")
+    lines = text.splitlines(keepends=True)
+    assert value.end_lineno is not None and value.end_col_offset is not None
+    # ast offsets are in utf-8 bytes
+    start = lines[value.lineno - 1].encode()[: value.col_offset].decode()
+    end = lines[value.end_lineno - 1].encode()[value.end_col_offset :].decode()
+    new_lines = [start + repr(down_revision) + end]
+    return "".join(lines[: value.lineno - 1] + new_lines + lines[value.end_lineno :])
+
+
+def change_down_revision(
+    script: RevisionHeader, down_revision: str | tuple[str, ...] | None
+) -> None:
     print(f"Change {script.revision} to have its down revision be {down_revision}")
     # stash the file
     current_path = Path(script.path)
     shutil.copy2(current_path, Path(".") / "moved_revisions" / current_path.name)
     current_text = current_path.read_text()
-    target_text = down_revision if down_revision is not None else ""
-    modified_text = re.sub(
-        R"Revises:\s?[^\n]*", f"Revises: {target_text}", current_text
-    )
-    target_text = f"'{down_revision}'" if down_revision is not None else "None"
-    modified_text = re.sub(
-        R"down_revision: Union\[str, None\] = (?:['\"][a-z0-9]+['\"]|None)",
-        f"down_revision: Union[str, None] = {target_text}",
-        modified_text,
-    )
-    current_path.write_text(modified_text)
-
-
-def move_revision(rev_to_move: str, rev_to_move_after: str) -> int:
-    # TODO: Handle if rev_to_move_after is head
-    script_folder = get_script_directory()
-    revision_map = get_revision_map(script_folder)
+    current_path.write_text(set_down_revision_text(current_text, down_revision))
+
+
+def write_parent_changes(graph: RevisionGraph, parents: dict[str, list[str]]) -> int:
+    # the order also has down revisions that no file declares
+    changed = [
+        rev
+        for rev in graph.order
+        if rev in graph.revisions and parents[rev] != graph.parents[rev]
+    ]
+    if not changed:
+        print("Nothing to change.")
+        return 0
+    (Path(".") / "moved_revisions").mkdir(exist_ok=True)
+    with timings.phase("write_files"):
+        for rev in changed:
+            change_down_revision(graph.revisions[rev], to_down_revision(parents[rev]))
+    return len(changed)
+
+
+def apply_move(
+    graph: RevisionGraph,
+    parents: dict[str, list[str]],
+    children: dict[str, list[str]],
+    rev_to_move: str,
+    rev_to_move_after: str,
+) -> bool:
+    # Moves a revision in parents and children, which may already differ from
+    # the graph through earlier moves. Returns False if the move can't be made.
     destination_is_base = rev_to_move_after == "base"
-    success, rev_to_move = get_unambiguous_revision(rev_to_move, revision_map)
+    success, rev_to_move = get_unambiguous_revision(rev_to_move, graph)
     if not success:
-        return 1
+        return False
+    destination: str | None = None
     if not destination_is_base:
-        success, rev_to_move_after = get_unambiguous_revision(
-            rev_to_move_after, revision_map
-        )
+        success, destination = get_unambiguous_revision(rev_to_move_after, graph)
         if not success:
             print(f"Could not find revision {rev_to_move_after}.")
-            return 1
-    script_to_move = revision_map[rev_to_move]
-    # TODO: print a warning if this the current head
+            return False
+    if destination == rev_to_move:
+        print("Error: cannot move a revision after itself")
+        return False
+    # a merge has no single place to go, so it isn't moved
+    if len(parents[rev_to_move]) > 1:
+        merged = ", ".join(parents[rev_to_move])
+        print(f"Error: {rev_to_move} merges {merged}; merge revisions can't be moved")
+        return False
+    if parents[rev_to_move] == ([destination] if destination else []):
+        print(f"{rev_to_move} is already after {rev_to_move_after}.")
+        return True
+    move_in_graph(parents, children, rev_to_move, destination)
+    return True
 
-    if not destination_is_base:
-        success, currently_after_rev_to_move_after = find_rev_with_down_revision(
-            revision_map, rev_to_move_after
-        )
-        if not success:
-            print(f"Could not find revision pointing to the base.")
-            return 1
-    else:
-        success, currently_after_rev_to_move_after = find_rev_with_down_revision(
-            revision_map, None
-        )
-        if not success:
-            print(f"Could not find revision after {rev_to_move_after}.")
-            return 1
-    success, currently_after_rev_to_move = find_rev_with_down_revision(
-        revision_map, rev_to_move
-    )
-    currently_before_rev_to_move = script_to_move.down_revision
-    # TODO: Handle branching
-    if not isinstance(currently_before_rev_to_move, str):
-        print(f"Error: there are multiple revisions pointed to be {rev_to_move}")
+
+def move_revision(
+    graph: RevisionGraph, rev_to_move: str, rev_to_move_after: str
+) -> int:
+    parents = {rev: list(ps) for rev, ps in graph.parents.items()}
+    children = {rev: list(cs) for rev, cs in graph.children.items()}
+    if not apply_move(graph, parents, children, rev_to_move, rev_to_move_after):
         return 1
-    (Path(".") / "moved_revisions").mkdir(exist_ok=True)
+    if parents != graph.parents:
+        write_parent_changes(graph, parents)
+    return 0
 
-    change_down_revision(revision_map[currently_after_rev_to_move_after], rev_to_move)
-    if destination_is_base:
-        change_down_revision(revision_map[rev_to_move], None)
-    else:
-        change_down_revision(revision_map[rev_to_move], rev_to_move_after)
-    change_down_revision(
-        revision_map[currently_after_rev_to_move], currently_before_rev_to_move
-    )
+
+def read_plan(p: Path) -> list[list[str]]:
+    # One entry per line: "REV AFTER" to move REV after AFTER (or base), or a
+    # lone revision as part of a full order. Blank lines and lines starting
+    # with # are skipped.
+    entries = []
+    for line in p.read_text().splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        entries.append(line.split())
+    return entries
+
+
+def order_parents(
+    graph: RevisionGraph, prefixes: list[str]
+) -> dict[str, list[str]] | None:
+    # Every revision, one after the other in the given order
+    success, order = get_unambiguous_revisions(prefixes, graph)
+    if not success:
+        return None
+    seen: set[str] = set()
+    repeated = []
+    for rev in order:
+        if rev in seen:
+            repeated.append(rev)
+        seen.add(rev)
+    if repeated:
+        print(f"Error: {', '.join(repeated)} listed more than once")
+        return None
+    missing = [rev for rev in graph.order if rev in graph.revisions and rev not in seen]
+    if missing:
+        print(f"Error: the order leaves out {', '.join(missing)}")
+        return None
+    parents = {order[0]: []}
+    for previous, rev in zip(order, order[1:]):
+        parents[rev] = [previous]
+    return parents
+
+
+def plan_parents(
+    graph: RevisionGraph, plan: list[list[str]]
+) -> dict[str, list[str]] | None:
+    # The down revisions of every revision once the whole plan is carried out
+    if not plan:
+        print("Error: the plan is empty")
+        return None
+    if all(len(entry) == 1 for entry in plan):
+        return order_parents(graph, [entry[0] for entry in plan])
+    parents = {rev: list(ps) for rev, ps in graph.parents.items()}
+    children = {rev: list(cs) for rev, cs in graph.children.items()}
+    for entry in plan:
+        if len(entry) != 2:
+            print(
+                f"Error: {' '.join(entry)!r} is not a move; a plan is either all moves (REV AFTER) or a full order (one REV per line)"
+            )
+            return None
+        if not apply_move(graph, parents, children, entry[0], entry[1]):
+            return None
+    return parents
+
+
+def move_plan(graph: RevisionGraph, plan: list[list[str]]) -> int:
+    # Work out where everything ends up before touching any file, so that a
+    # plan either applies in full or not at all
+    parents = plan_parents(graph, plan)
+    if parents is None:
+        return 1
+    try:
+        topological_sort(parents)
+    except CycleException as e:
+        print(f"Error: {e}")
+        return 1
+    has_children = {parent for ps in parents.values() for parent in ps}
+    heads = [rev for rev in graph.order if rev in parents and rev not in has_children]
+    if len(heads) > max(1, len(graph.heads)):
+        print(f"Error: the plan would leave {len(heads)} heads: {', '.join(heads)}")
+        return 1
+    changed = write_parent_changes(graph, parents)
+    if changed:
+        print(f"Rewrote {changed} revisions")
     return 0
@@ -0,0 +1,60 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Iterator, TypeVar
+
+import alembic_tools.timings as timings
+
+T = TypeVar("T")
+
+# How many revision files are read at once. Reading is mostly waiting on the
+# disk, or on the network for a versions folder on NFS or a bind mount, so it
+# pays to have many more reads in flight than there are cores. Set from
+# --io-threads; 1 reads one file at a time in the calling thread.
+IO_THREADS = 16
+# How many results may be read ahead of the consumer, per thread
+READ_AHEAD = 2
+
+
+def read_text(p: Path) -> str:
+    return p.read_text()
+
+
+def prefetch(
+    read: Callable[[Path], T], paths: list[Path], threads: int | None = None
+) -> Iterator[tuple[Path, T]]:
+    # Yields (path, read(path)) in the order of paths, with the reads done in
+    # a pool of threads ahead of the consumer, so that reading many files takes
+    # as long as the storage needs to deliver them rather than a round trip
+    # each. The reads in flight and the results waiting to be consumed are
+    # bounded, so memory doesn't grow with the number of files. An exception
+    # raised by read is raised here when its path is reached.
+    #
+    # read runs in the pool, so it must not record timings itself; the time
+    # spent waiting on it is recorded as "read".
+    if threads is None:
+        threads = IO_THREADS
+    if threads <= 1 or len(paths) <= 1:
+        for p in paths:
+            with timings.phase("read"):
+                result = read(p)
+            yield p, result
+        return
+    pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="prefetch")
+    try:
+        remaining = iter(paths)
+        pending: deque[tuple[Path, Future[T]]] = deque(
+            (p, pool.submit(read, p)) for p in islice(remaining, threads * READ_AHEAD)
+        )
+        while pending:
+            p, future = pending.popleft()
+            following = next(remaining, None)
+            if following is not None:
+                pending.append((following, pool.submit(read, following)))
+            with timings.phase("read"):
+                result = future.result()
+            yield p, result
+    finally:
+        # stopped early (by an exception or the consumer): skip what's left
+        pool.shutdown(wait=True, cancel_futures=True)
@@ -1,46 +1,310 @@
-from alembic.script import ScriptDirectory, Script
-from alembic.config import Config
+import ast
+from bisect import bisect_left
+from collections import deque
+import json
+import os
+from pathlib import Path
+import re
+from typing import TYPE_CHECKING, Iterable
 
+from alembic_tools.analysis_cache import CACHE_DIR
+from alembic_tools.prefetch import prefetch
+import alembic_tools.timings as timings
 
-def find_revs_that_start_with(
-    prefix: str, revision_map: dict[str, Script]
-) -> list[str]:
-    ret = []
-    for rev in revision_map:
-        if rev.startswith(prefix):
-            ret.append(rev)
-    return ret
+# alembic takes longer to import than scanning hundreds of headers does, so
+# it's only imported once something needs it
+if TYPE_CHECKING:
+    from alembic.script import ScriptDirectory
 
+LOCATIONS_FILE = "locations.json"
 
-def get_script_directory() -> ScriptDirectory:
-    alembic_config = Config(file_="alembic.ini", ini_section="alembic")
-    return ScriptDirectory.from_config(alembic_config)
+# First top-level definition in a revision file; the revision identifiers are
+# always assigned above it
+HEADER_END = re.compile(r"^(?:async def|def|class) ")
 
 
-def get_revision_walk(script_folder: ScriptDirectory):
-    return script_folder.walk_revisions()
+class ScanException(Exception):
+    pass
 
 
-def get_revision_map(script_folder: ScriptDirectory):
-    return {a.revision: a for a in script_folder.walk_revisions()}
+class CycleException(Exception):
+    pass
 
 
-def get_unambiguous_revision(rev_to_move, revision_map) -> tuple[bool, str]:
-    revs1 = find_revs_that_start_with(rev_to_move, revision_map)
-    if len(revs1) == 0:
-        print(f"Could not find revision beginning with {rev_to_move}")
-        return False, ""
-    if len(revs1) > 1:
-        print(
-            f"Revision {rev_to_move} is ambiguous. Could be any of {', '.join(revs1)}"
+# The parts of a revision that can be read without importing it. Mirrors the
+# attributes of alembic's Script that the rest of the tools rely on.
+class RevisionHeader:
+    revision: str
+    down_revision: str | tuple[str, ...] | None
+    doc: str
+    path: str
+
+    def __init__(
+        self,
+        revision: str,
+        down_revision: str | tuple[str, ...] | None,
+        doc: str,
+        path: str,
+    ) -> None:
+        self.revision = revision
+        self.down_revision = down_revision
+        self.doc = doc
+        self.path = path
+
+    def __repr__(self) -> str:
+        return f"RevisionHeader({self.revision!r}, {self.down_revision!r})"
+
+
+# Sorted revision ids, so that every revision starting with a prefix can be
+# found with a binary search instead of a scan of the whole map
+class PrefixIndex:
+    keys: list[str]
+
+    def __init__(self, revisions: Iterable[str]) -> None:
+        self.keys = sorted(revisions)
+
+    def find(self, prefix: str) -> list[str]:
+        ret = []
+        for i in range(bisect_left(self.keys, prefix), len(self.keys)):
+            if not self.keys[i].startswith(prefix):
+                break
+            ret.append(self.keys[i])
+        return ret
+
+    def find_many(self, prefixes: Iterable[str]) -> dict[str, list[str]]:
+        return {prefix: self.find(prefix) for prefix in prefixes}
+
+
+def get_script_directory() -> "ScriptDirectory":
+    from alembic.config import Config
+    from alembic.script import ScriptDirectory
+
+    with timings.phase("load_config"):
+        alembic_config = Config(file_="alembic.ini", ini_section="alembic")
+        return ScriptDirectory.from_config(alembic_config)
+
+
+def list_revision_files(script_folder: "ScriptDirectory") -> list[Path]:
+    # alembic keeps the locations as Paths
+    locations = [str(location) for location in script_folder._version_locations]
+    return list_files(locations, script_folder.recursive_version_locations)
+
+
+def list_files(locations: list[str], recursive: bool) -> list[Path]:
+    # The same files alembic would load, found without importing any of them
+    pattern = "**/*.py" if recursive else "*.py"
+    paths = []
+    for location in locations:
+        folder = Path(location)
+        if not folder.exists():
+            continue
+        # resolving the folder once makes every path under it absolute, with
+        # no per-file system calls
+        for p in sorted(folder.resolve().glob(pattern)):
+            if p.name.startswith((".#", "__init__")) or "__pycache__" in p.parts:
+                continue
+            paths.append(p)
+    return paths
+
+
+def version_locations(cache_dir: Path = CACHE_DIR) -> tuple[list[str], bool]:
+    # Where the revision files are, and whether to look in subfolders. Kept in
+    # the cache folder along with where alembic.ini is and its size and mtime,
+    # so that working it out again (and importing alembic to do so) is rarely
+    # needed.
+    config = Path("alembic.ini")
+    st = config.stat()
+    # a moved or copied project can have the same alembic.ini, but the stored
+    # locations are absolute
+    fingerprint = [str(config.resolve()), os.getcwd(), st.st_size, st.st_mtime_ns]
+    path = cache_dir / LOCATIONS_FILE
+    try:
+        data = json.loads(path.read_text())
+        if data["config"] == fingerprint and all(
+            Path(location).is_dir() for location in data["locations"]
+        ):
+            return data["locations"], data["recursive"]
+    except (OSError, ValueError, KeyError):
+        pass
+    script_folder = get_script_directory()
+    locations = [str(Path(loc).resolve()) for loc in script_folder._version_locations]
+    recursive = bool(script_folder.recursive_version_locations)
+    cache_dir.mkdir(exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(
+        json.dumps(
+            {"config": fingerprint, "locations": locations, "recursive": recursive}
         )
+    )
+    os.replace(tmp_path, path)
+    return locations, recursive
+
+
+def read_header_text(p: Path) -> tuple[str, bool]:
+    # Read only up to the first top-level def; returns whether that was the
+    # whole file
+    lines = []
+    with p.open(encoding="utf-8") as f:
+        for line in f:
+            if HEADER_END.match(line):
+                return "".join(lines), False
+            lines.append(line)
+    return "".join(lines), True
+
+
+def header_from_source(text: str, p: Path) -> RevisionHeader | None:
+    try:
+        tree = ast.parse(text, filename=str(p))
+    except SyntaxError:
+        return None
+    values = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1:
+            target, value = node.targets[0], node.value
+        elif isinstance(node, ast.AnnAssign) and node.value is not None:
+            target, value = node.target, node.value
+        else:
+            continue
+        if not isinstance(target, ast.Name):
+            continue
+        if target.id in ("revision", "down_revision"):
+            try:
+                values[target.id] = ast.literal_eval(value)
+            except ValueError:
+                # computed at import time; only alembic can tell
+                return None
+    revision = values.get("revision")
+    if not isinstance(revision, str) or "down_revision" not in values:
+        return None
+    down_revision = values["down_revision"]
+    if isinstance(down_revision, (list, tuple)):
+        if not all(isinstance(d, str) for d in down_revision):
+            return None
+        down_revision = tuple(down_revision)
+    elif down_revision is not None and not isinstance(down_revision, str):
+        return None
+    # alembic's Script.doc is the first paragraph of the module docstring
+    doc = (ast.get_docstring(tree, clean=False) or "").strip()
+    doc = re.split("\n\n", doc)[0]
+    return RevisionHeader(revision, down_revision, doc, str(p))
+
+
+def scan_revision_header(
+    p: Path, header_text: tuple[str, bool] | None = None
+) -> RevisionHeader | None:
+    # header_text is what read_header_text(p) returns, if it was already read
+    text, complete = read_header_text(p) if header_text is None else header_text
+    timings.count("header_files_read")
+    timings.count("header_chars_read", len(text))
+    header = header_from_source(text, p)
+    if header is None and not complete:
+        timings.count("header_full_reads")
+        header = header_from_source(p.read_text(encoding="utf-8"), p)
+    return header
+
+
+def scan_revision_headers(
+    script_folder: "ScriptDirectory", fallback: bool = True
+) -> list[RevisionHeader]:
+    headers = []
+    with timings.phase("scan_headers"):
+        paths = list_revision_files(script_folder)
+        for p, header_text in prefetch(read_header_text, paths):
+            header = read_revision_header(script_folder, p, fallback, header_text)
+            if header is not None:
+                headers.append(header)
+    return headers
+
+
+def scan_changed_headers(
+    script_folder: "ScriptDirectory", known: dict[str, RevisionHeader]
+) -> list[RevisionHeader]:
+    # The headers of every revision file, taking those in known (by path) as
+    # they are and reading only the others
+    paths = list_revision_files(script_folder)
+    # read in the same order as the loop below asks for them
+    fresh = prefetch(read_header_text, [p for p in paths if str(p) not in known])
+    headers = []
+    reused = 0
+    with timings.phase("scan_headers"):
+        for p in paths:
+            header = known.get(str(p))
+            if header is not None:
+                reused += 1
+            else:
+                _, header_text = next(fresh)
+                header = read_revision_header(script_folder, p, header_text=header_text)
+            if header is not None:
+                headers.append(header)
+    timings.count("headers_reused", reused)
+    return headers
+
+
+def read_revision_header(
+    script_folder: "ScriptDirectory",
+    p: Path,
+    fallback: bool = True,
+    header_text: tuple[str, bool] | None = None,
+) -> RevisionHeader | None:
+    header = scan_revision_header(p, header_text)
+    if header is not None:
+        return header
+    if not fallback:
+        raise ScanException(f"Could not read revision identifiers from {p}")
+    # let alembic import this one file to work out what it declares
+    from alembic.script import Script
+
+    timings.count("alembic_imports")
+    script = Script._from_path(script_folder, p)
+    if script is None:
+        return None
+    # a merge's down_revision can be written as a list as well as a tuple
+    down_revision = script.down_revision
+    if isinstance(down_revision, list):
+        down_revision = tuple(down_revision)
+    return RevisionHeader(script.revision, down_revision, script.doc, script.path)
+
+
+def get_unambiguous_revision(
+    rev_to_move: str, graph: "RevisionGraph"
+) -> tuple[bool, str]:
+    success, revs = get_unambiguous_revisions([rev_to_move], graph)
+    if not success:
         return False, ""
-    return True, revs1[0]
+    return True, revs[0]
+
 
+def get_unambiguous_revisions(
+    prefixes: list[str], graph: "RevisionGraph"
+) -> tuple[bool, list[str]]:
+    # Reports every prefix that can't be resolved, not just the first one
+    matches = graph.prefix_index.find_many(prefixes)
+    resolved = []
+    success = True
+    for prefix in prefixes:
+        revs = matches[prefix]
+        if len(revs) == 0:
+            print(f"Could not find revision beginning with {prefix}")
+            success = False
+        elif len(revs) > 1:
+            print(f"Revision {prefix} is ambiguous. Could be any of {', '.join(revs)}")
+            success = False
+        else:
+            resolved.append(revs[0])
+    if not success:
+        return False, []
+    return True, resolved
 
-def build_graph(script_folder: ScriptDirectory) -> dict[str, list[str]]:
+
+def build_graph(script_folder: "ScriptDirectory") -> dict[str, list[str]]:
+    return build_graph_from_headers(scan_revision_headers(script_folder))
+
+
+def build_graph_from_headers(
+    headers: list[RevisionHeader],
+) -> dict[str, list[str]]:
     graph = {}
-    for revision in script_folder.walk_revisions():
+    for revision in headers:
         revision_id = revision.revision
         down_revisions = revision.down_revision
         if down_revisions is None:
@@ -54,30 +318,96 @@ def build_graph(script_folder: ScriptDirectory) -> dict[str, list[str]]:
 
 
 def topological_sort(graph: dict[str, list[str]]) -> list[str]:
-    visited: set[str] = set()
-    stack: list[str] = []
+    return topological_sort_with_generations(graph)[0]
 
-    def dfs(node: str):
-        if node not in visited:
-            visited.add(node)
-            for neighbor in graph.get(node, []):
-                if isinstance(neighbor, list):
-                    for sub_neighbor in neighbor:
-                        if sub_neighbor not in visited:
-                            dfs(sub_neighbor)
-                elif neighbor not in visited:
-                    dfs(neighbor)
-            stack.append(node)
 
-    for node in graph:
-        if node not in visited:
-            dfs(node)
+def topological_sort_with_generations(
+    graph: dict[str, list[str]],
+) -> tuple[list[str], dict[str, int]]:
+    # Kahn's algorithm on the revision -> down revisions graph, so down revisions
+    # always come first. Ready revisions are taken in the order they first show
+    # up in the graph, which keeps the result stable between runs. The
+    # generation of a revision is the length of the longest path from a base.
+    children: dict[str, list[str]] = {}
+    pending: dict[str, int] = {}
+    for node, parents in graph.items():
+        pending[node] = len(parents)
+        for parent in parents:
+            children.setdefault(parent, []).append(node)
+            # a down revision missing from the graph still gets ordered
+            pending.setdefault(parent, 0)
+    ready = deque(node for node, count in pending.items() if count == 0)
+    generations = {node: 0 for node in ready}
+    order: list[str] = []
+    while ready:
+        node = ready.popleft()
+        order.append(node)
+        child_generation = generations[node] + 1
+        for child in children.get(node, ()):
+            if generations.get(child, 0) < child_generation:
+                generations[child] = child_generation
+            pending[child] -= 1
+            if pending[child] == 0:
+                ready.append(child)
+    if len(order) != len(pending):
+        in_cycle = sorted(node for node, count in pending.items() if count > 0)
+        raise CycleException(
+            f"Revision graph has a cycle through {', '.join(in_cycle)}"
+        )
+    return order, generations
+
 
-    return stack
+def print_order(graph: "RevisionGraph") -> None:
+    for revision, idx in graph.order_map.items():
+        print(f"{idx} {revision} (generation {graph.generations[revision]})")
 
 
-def assign_order(script_folder: ScriptDirectory) -> dict[str, int]:
+def assign_order(script_folder: "ScriptDirectory") -> dict[str, int]:
     graph = build_graph(script_folder)
     topo_order = topological_sort(graph)
     order = {revision: idx for idx, revision in enumerate(topo_order)}
     return order
+
+
+# Everything the subcommands need to know about the revision graph, loaded from
+# the versions directory once and precomputed up front
+class RevisionGraph:
+    # None when the graph is built from headers alone, as the tests do
+    script_folder: "ScriptDirectory | None"
+    revisions: dict[str, RevisionHeader]
+    parents: dict[str, list[str]]
+    children: dict[str, list[str]]
+    order: list[str]
+    order_map: dict[str, int]
+    prefix_index: PrefixIndex
+    generations: dict[str, int]
+    heads: list[str]
+    bases: list[str]
+
+    def __init__(
+        self, script_folder: "ScriptDirectory | None", headers: list[RevisionHeader]
+    ) -> None:
+        with timings.phase("build_graph"):
+            self.script_folder = script_folder
+            self.revisions = {h.revision: h for h in headers}
+            self.parents = build_graph_from_headers(headers)
+            self.children = {rev: [] for rev in self.revisions}
+            for rev, parents in self.parents.items():
+                for parent in parents:
+                    self.children.setdefault(parent, []).append(rev)
+            self.order, self.generations = topological_sort_with_generations(
+                self.parents
+            )
+            self.order_map = {revision: idx for idx, revision in enumerate(self.order)}
+            self.prefix_index = PrefixIndex(self.revisions)
+            self.heads = [rev for rev in self.revisions if not self.children[rev]]
+            self.bases = [rev for rev in self.revisions if not self.parents[rev]]
+
+    @classmethod
+    def load(cls, script_folder: "ScriptDirectory | None" = None) -> "RevisionGraph":
+        if script_folder is None:
+            script_folder = get_script_directory()
+        return cls(script_folder, scan_revision_headers(script_folder))
+
+    def find_revs_that_start_with(self, prefix: str) -> list[str]:
+        return self.prefix_index.find(prefix)
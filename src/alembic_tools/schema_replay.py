@@ -0,0 +1,271 @@
+import heapq
+import os
+import pickle
+from pathlib import Path
+from typing import NamedTuple
+
+import alembic_tools.analyze_revision as ar
+import alembic_tools.git_state as git_state
+import alembic_tools.timings as timings
+from alembic_tools.analysis_cache import CACHE_DIR, AnalysisCache, analyze_revisions
+from alembic_tools.entity_index import file_fingerprint, files_are_fresh
+from alembic_tools.revision_collection import (
+    RevisionGraph,
+    get_unambiguous_revision,
+    list_revision_files,
+)
+
+SCHEMA_FILE = "schema.pickle"
+# Bump when the layout of the snapshot file changes
+SCHEMA_VERSION = 2
+# Replaying from a snapshot never needs more than about this many revisions
+# while the history is linear
+SNAPSHOT_INTERVAL = 100
+
+
+class ColumnState(NamedTuple):
+    # None when the column predates anything the analyzer understood
+    added_in: str | None
+    altered_in: str | None
+
+
+# Tables are never changed in place once they are part of a schema; changing
+# one replaces it with a copy, so snapshots can share every untouched table.
+class TableState:
+    created_in: str | None
+    columns: dict[str, ColumnState]
+
+    def __init__(
+        self, created_in: str | None, columns: dict[str, ColumnState] | None = None
+    ) -> None:
+        self.created_in = created_in
+        self.columns = {} if columns is None else columns
+
+    def copy(self) -> "TableState":
+        return TableState(self.created_in, dict(self.columns))
+
+
+Schema = dict[str, TableState]
+
+
+def _table_for_update(schema: Schema, table_name: str) -> TableState:
+    table = schema.get(table_name)
+    # a table touched before any create_table we saw was made some other way
+    table = TableState(None) if table is None else table.copy()
+    schema[table_name] = table
+    return table
+
+
+def apply_revision(schema: Schema, revision: str, rev_analysis: ar.Revision) -> None:
+    for stmt in rev_analysis.statements:
+        match stmt:
+            case ar.CreateTableStatement():
+                schema[stmt.table_name] = TableState(
+                    revision,
+                    {c.column_name: ColumnState(revision, None) for c in stmt.columns},
+                )
+            case ar.AddColumnStatement():
+                table = _table_for_update(schema, stmt.table_name)
+                table.columns[stmt.column_name] = ColumnState(revision, None)
+            case ar.AlterColumnStatement():
+                table = _table_for_update(schema, stmt.table_name)
+                column = table.columns.get(stmt.column_name)
+                added_in = None if column is None else column.added_in
+                table.columns[stmt.column_name] = ColumnState(added_in, revision)
+            case ar.DropColumnStatement():
+                table = schema.get(stmt.table_name)
+                if table is not None and stmt.column_name in table.columns:
+                    table = _table_for_update(schema, stmt.table_name)
+                    del table.columns[stmt.column_name]
+            case ar.DropTableStatement():
+                schema.pop(stmt.table_name, None)
+
+
+# The schema after a handful of revisions, from which the schema at any later
+# revision can be had by replaying only what came after.
+#
+# A snapshot is only taken at a revision that every earlier revision (in
+# topological order) leads up to. For any revision, the nearest snapshot among
+# its ancestors then accounts for everything at or before it, and what is left
+# to replay are the ancestors that come after it.
+class SchemaSnapshots:
+    files: dict[str, list[int]]
+    git: git_state.RepoState | None
+    snapshots: dict[str, Schema]
+
+    def __init__(self) -> None:
+        self.files = {}
+        self.git = None
+        self.snapshots = {}
+
+    def build(
+        self,
+        graph: RevisionGraph,
+        analyses: dict[str, ar.Revision],
+        interval: int = SNAPSHOT_INTERVAL,
+    ) -> None:
+        schema: Schema = {}
+        # revisions without children among the ones replayed so far
+        heads = 0
+        has_child: set[str] = set()
+        next_snapshot = 0
+        for idx, revision in enumerate(graph.order):
+            if revision not in graph.revisions:
+                continue
+            apply_revision(schema, revision, analyses[revision])
+            heads += 1
+            for parent in graph.parents[revision]:
+                if parent in graph.revisions and parent not in has_child:
+                    has_child.add(parent)
+                    heads -= 1
+            if idx >= next_snapshot and heads == 1:
+                self.snapshots[revision] = dict(schema)
+                next_snapshot = idx + interval
+
+    def replay_plan(
+        self, graph: RevisionGraph, revision: str
+    ) -> tuple[str | None, list[str]]:
+        # Walk back through the ancestors, latest first, until reaching one
+        # with a snapshot; everything walked past has to be replayed
+        order_map = graph.order_map
+        to_replay: list[str] = []
+        seen = {revision}
+        heap = [(-order_map[revision], revision)]
+        while heap:
+            _, current = heapq.heappop(heap)
+            if current in self.snapshots:
+                return current, to_replay[::-1]
+            to_replay.append(current)
+            for parent in graph.parents.get(current, ()):
+                if parent in graph.revisions and parent not in seen:
+                    seen.add(parent)
+                    heapq.heappush(heap, (-order_map[parent], parent))
+        return None, to_replay[::-1]
+
+    def schema_at(
+        self,
+        graph: RevisionGraph,
+        revision: str,
+        analyses: dict[str, ar.Revision],
+    ) -> Schema:
+        start, to_replay = self.replay_plan(graph, revision)
+        schema = {} if start is None else dict(self.snapshots[start])
+        for rev in to_replay:
+            apply_revision(schema, rev, analyses[rev])
+        return schema
+
+    def save(self, cache_dir: Path = CACHE_DIR) -> None:
+        cache_dir.mkdir(exist_ok=True)
+        path = cache_dir / SCHEMA_FILE
+        tmp_path = path.with_suffix(".tmp")
+        with tmp_path.open("wb") as f:
+            pickle.dump(
+                {
+                    "version": [SCHEMA_VERSION, ar.analyzer_version()],
+                    "files": self.files,
+                    "git": self.git,
+                    "snapshots": self.snapshots,
+                },
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, cache_dir: Path = CACHE_DIR) -> "SchemaSnapshots | None":
+        path = cache_dir / SCHEMA_FILE
+        if not path.exists():
+            return None
+        try:
+            with path.open("rb") as f:
+                data = pickle.load(f)
+        except Exception:
+            return None
+        if data.get("version") != [SCHEMA_VERSION, ar.analyzer_version()]:
+            return None
+        snapshots = cls()
+        snapshots.files = data["files"]
+        snapshots.git = data["git"]
+        snapshots.snapshots = data["snapshots"]
+        return snapshots
+
+
+def analyze_by_revision(
+    graph: RevisionGraph, revisions: list[str], cache: AnalysisCache | None, jobs: int
+) -> dict[str, ar.Revision]:
+    paths = [Path(graph.revisions[rev].path) for rev in revisions]
+    return dict(zip(revisions, analyze_revisions(paths, cache, jobs=jobs)))
+
+
+def load_snapshots(
+    graph: RevisionGraph, cache: AnalysisCache | None, jobs: int = 1
+) -> SchemaSnapshots:
+    assert graph.script_folder is not None
+    paths = list_revision_files(graph.script_folder)
+    with timings.phase("load_snapshots"):
+        snapshots = SchemaSnapshots.load()
+    if snapshots is not None and files_are_fresh(snapshots.files, paths, snapshots.git):
+        return snapshots
+    print("Building schema snapshots...")
+    state = git_state.repo_state()
+    analyses = analyze_by_revision(graph, list(graph.revisions), cache, jobs)
+    if cache is not None:
+        cache.save()
+    snapshots = SchemaSnapshots()
+    with timings.phase("build_snapshots"):
+        snapshots.build(graph, analyses)
+    snapshots.files = {str(p): file_fingerprint(p) for p in paths}
+    snapshots.git = state
+    snapshots.save()
+    return snapshots
+
+
+def print_table(table_name: str, table: TableState) -> None:
+    created = "" if table.created_in is None else f" (created in {table.created_in})"
+    print(f"{table_name}{created}")
+    for column_name, column in table.columns.items():
+        notes = []
+        if column.added_in is not None:
+            notes.append(f"added in {column.added_in}")
+        if column.altered_in is not None:
+            notes.append(f"altered in {column.altered_in}")
+        notes_text = f" ({', '.join(notes)})" if notes else ""
+        print(f"    {column_name}{notes_text}")
+
+
+def schema_collection(
+    graph: RevisionGraph,
+    at_revision: str,
+    table_name: str | None,
+    use_cache: bool = True,
+    jobs: int = 1,
+) -> int:
+    success, revision = get_unambiguous_revision(at_revision, graph)
+    if not success:
+        return 1
+    cache = None
+    if use_cache:
+        cache = AnalysisCache()
+        cache.load()
+    snapshots = load_snapshots(graph, cache, jobs)
+    _, to_replay = snapshots.replay_plan(graph, revision)
+    # Only part of the history is looked at here, so the cache isn't saved:
+    # saving drops every entry that wasn't looked up
+    analyses = analyze_by_revision(graph, to_replay, cache, jobs)
+    with timings.phase("replay"):
+        schema = snapshots.schema_at(graph, revision, analyses)
+    timings.count("revisions_replayed", len(to_replay))
+    return print_schema(schema, revision, table_name)
+
+
+def print_schema(schema: Schema, revision: str, table_name: str | None) -> int:
+    if table_name is not None:
+        if table_name not in schema:
+            print(f"Table {table_name} does not exist at {revision}")
+            return 1
+        print_table(table_name, schema[table_name])
+        return 0
+    print(f"Schema at {revision}: {len(schema)} tables")
+    for name in sorted(schema):
+        print_table(name, schema[name])
+    return 0
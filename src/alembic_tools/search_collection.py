@@ -1,10 +1,14 @@
 from pathlib import Path
+from typing import TYPE_CHECKING
+
 import alembic_tools.analyze_revision as ar
-from alembic_tools.revision_collection import (
-    assign_order,
-    get_revision_walk,
-    get_script_directory,
-)
+import alembic_tools.timings as timings
+from alembic_tools.analysis_cache import AnalysisCache, analyze_revisions
+from alembic_tools.entity_index import EntityIndex, load_fresh_index
+from alembic_tools.revision_collection import RevisionGraph
+
+if TYPE_CHECKING:
+    from alembic.script import ScriptDirectory
 
 
 def table_search(table_name: str, rev_analysis: ar.Revision):
@@ -65,6 +69,39 @@ def table_search(table_name: str, rev_analysis: ar.Revision):
     return out
 
 
+def column_search(
+    table_name: str, column_name: str, rev_analysis: ar.Revision
+) -> list[str]:
+    out = []
+    for stmt in rev_analysis.statements:
+        match stmt:
+            case ar.CreateTableStatement():
+                if stmt.table_name == table_name and any(
+                    c.column_name == column_name for c in stmt.columns
+                ):
+                    out.append("created with the table")
+            case ar.AddColumnStatement():
+                if stmt.table_name == table_name and stmt.column_name == column_name:
+                    out.append("added")
+            case ar.AlterColumnStatement():
+                if stmt.table_name == table_name and stmt.column_name == column_name:
+                    out.append("altered")
+            case ar.DropColumnStatement():
+                if stmt.table_name == table_name and stmt.column_name == column_name:
+                    out.append("dropped")
+            case _:
+                pass
+    return out
+
+
+def split_column_name(name: str) -> tuple[str, str] | None:
+    # "table.column"; the table may itself be qualified with a schema
+    table_name, _, column_name = name.rpartition(".")
+    if not table_name or not column_name:
+        return None
+    return table_name, column_name
+
+
 def replaceable_search(replaceable_name, rev_analysis) -> list[str]:
     out = []
     for stmt in rev_analysis.statements:
@@ -90,29 +127,247 @@ def replaceable_search(replaceable_name, rev_analysis) -> list[str]:
     return out
 
 
-def search_collection(table_name: str | None, replaceable_name: str | None):
-    if table_name is not None:
-        print(f"Table: {table_name}")
-    if replaceable_name is not None:
-        print(f"Replacable entity {replaceable_name}")
-    script_folder = get_script_directory()
-    script_order_map = assign_order(script_folder)
-    output_lines: list[tuple[str, str, int]] = []
-    for rev in list(get_revision_walk(script_folder)):
-        p = Path(rev.path)
-        rev_analysis = ar.analyze_revision(p)
-        if table_name is not None:
-            out = table_search(table_name, rev_analysis)
-            if out:
-                order_num = script_order_map[rev.revision]
-                output_lines.append((rev.revision, ", ".join(out), order_num))
-        if replaceable_name is not None:
-            out = replaceable_search(replaceable_name, rev_analysis)
-            if out:
-                order_num = script_order_map[rev.revision]
-                output_lines.append((rev.revision, ", ".join(out), order_num))
+# (revision, description, order number)
+SearchLine = tuple[str, str, int]
+
+
+class SearchResults:
+    tables: dict[str, list[SearchLine]]
+    replaceables: dict[str, list[SearchLine]]
+    # keyed by (table, column)
+    columns: dict[tuple[str, str], list[SearchLine]]
+
+    def __init__(
+        self,
+        table_names: list[str],
+        replaceable_names: list[str],
+        columns: list[tuple[str, str]] | None = None,
+    ) -> None:
+        self.tables = {name: [] for name in table_names}
+        self.replaceables = {name: [] for name in replaceable_names}
+        self.columns = {column: [] for column in columns or []}
+
+
+class NamesFileException(Exception):
+    pass
+
+
+def read_names_file(p: Path) -> tuple[list[str], list[str], list[tuple[str, str]]]:
+    # One name per line, a table unless prefixed with "replaceable:" or
+    # "column:" (for a table.column). Blank lines and lines starting with # are
+    # skipped.
+    table_names: list[str] = []
+    replaceable_names: list[str] = []
+    columns: list[tuple[str, str]] = []
+    for line in p.read_text().splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        kind, sep, name = line.partition(":")
+        kind, name = kind.strip(), name.strip()
+        if not sep:
+            table_names.append(line)
+        elif kind == "table":
+            table_names.append(name)
+        elif kind == "replaceable":
+            replaceable_names.append(name)
+        elif kind == "column":
+            column = split_column_name(name)
+            if column is None:
+                raise NamesFileException(
+                    f"Columns are given as table.column, not {name!r} in {p}"
+                )
+            columns.append(column)
+        else:
+            raise NamesFileException(f"Unknown entity kind {kind!r} in {p}")
+    return table_names, replaceable_names, columns
+
+
+def dispatch_statements(
+    rev_analysis: ar.Revision, table_names: set[str], replaceable_names: set[str]
+) -> tuple[dict[str, ar.Revision], dict[str, ar.Revision]]:
+    # Split one revision's statements between the requested entities, so each
+    # entity's search only looks at the statements that mention it
+    tables: dict[str, ar.Revision] = {}
+    replaceables: dict[str, ar.Revision] = {}
+
+    def post(found: dict[str, ar.Revision], name: str, stmt: ar.Statement) -> None:
+        found.setdefault(name, ar.Revision()).statements.append(stmt)
+
+    for stmt in rev_analysis.statements:
+        match stmt:
+            case ar.ReplaceableStatement():
+                if stmt.replaceable_name in replaceable_names:
+                    post(replaceables, stmt.replaceable_name, stmt)
+            case ar.CreateForeignKeyStatement():
+                if stmt.table_name in table_names:
+                    post(tables, stmt.table_name, stmt)
+                if (
+                    stmt.referent_table_name in table_names
+                    and stmt.referent_table_name != stmt.table_name
+                ):
+                    post(tables, stmt.referent_table_name, stmt)
+            case (
+                ar.CreateTableStatement()
+                | ar.AddColumnStatement()
+                | ar.AlterColumnStatement()
+                | ar.DropColumnStatement()
+                | ar.CreateIndexStatement()
+                | ar.DropTableStatement()
+            ):
+                if stmt.table_name in table_names:
+                    post(tables, stmt.table_name, stmt)
+    return tables, replaceables
+
+
+def search_index(
+    index: EntityIndex,
+    table_names: list[str],
+    replaceable_names: list[str],
+    columns: list[tuple[str, str]] | None = None,
+) -> SearchResults:
+    results = SearchResults(table_names, replaceable_names, columns)
+    with timings.phase("match"):
+        for table_name, lines in results.tables.items():
+            for revision, rev_analysis in index.table_hits(table_name).items():
+                out = table_search(table_name, rev_analysis)
+                if out:
+                    lines.append((revision, ", ".join(out), index.order[revision]))
+        for replaceable_name, lines in results.replaceables.items():
+            hits = index.replaceable_hits(replaceable_name)
+            for revision, rev_analysis in hits.items():
+                out = replaceable_search(replaceable_name, rev_analysis)
+                if out:
+                    lines.append((revision, ", ".join(out), index.order[revision]))
+        for (table_name, column), lines in results.columns.items():
+            hits = index.column_hits(table_name, column)
+            for revision, rev_analysis in hits.items():
+                out = column_search(table_name, column, rev_analysis)
+                if out:
+                    lines.append((revision, ", ".join(out), index.order[revision]))
+    return results
+
+
+def search_scan(
+    graph: RevisionGraph,
+    table_names: list[str],
+    replaceable_names: list[str],
+    use_cache: bool,
+    jobs: int,
+    columns: list[tuple[str, str]] | None = None,
+) -> SearchResults:
+    revisions = list(graph.revisions.values())
+    cache = None
+    if use_cache:
+        cache = AnalysisCache()
+        cache.load()
+    analyses = analyze_revisions(
+        [Path(rev.path) for rev in revisions], cache, jobs=jobs
+    )
+    if cache is not None:
+        cache.save()
+    return search_analyses(
+        graph,
+        dict(zip(graph.revisions, analyses)),
+        table_names,
+        replaceable_names,
+        columns,
+    )
+
+
+def search_analyses(
+    graph: RevisionGraph,
+    analyses: dict[str, ar.Revision],
+    table_names: list[str],
+    replaceable_names: list[str],
+    columns: list[tuple[str, str]] | None = None,
+) -> SearchResults:
+    # One pass over the history however many names are asked for
+    results = SearchResults(table_names, replaceable_names, columns)
+    # a column's statements are found among its table's
+    wanted_tables = set(table_names) | {table for table, _ in results.columns}
+    wanted_replaceables = set(replaceable_names)
+    with timings.phase("match"):
+        for revision, rev_analysis in analyses.items():
+            tables, replaceables = dispatch_statements(
+                rev_analysis, wanted_tables, wanted_replaceables
+            )
+            order_num = graph.order_map[revision]
+            for table_name, hits in tables.items():
+                if table_name not in results.tables:
+                    continue
+                out = table_search(table_name, hits)
+                if out:
+                    line = (revision, ", ".join(out), order_num)
+                    results.tables[table_name].append(line)
+            for (table_name, column), lines in results.columns.items():
+                if table_name not in tables:
+                    continue
+                out = column_search(table_name, column, tables[table_name])
+                if out:
+                    lines.append((revision, ", ".join(out), order_num))
+            for replaceable_name, hits in replaceables.items():
+                out = replaceable_search(replaceable_name, hits)
+                if out:
+                    line = (revision, ", ".join(out), order_num)
+                    results.replaceables[replaceable_name].append(line)
+    return results
+
+
+def print_search_lines(output_lines: list[SearchLine]) -> None:
+    if not output_lines:
+        return
     output_lines.sort(key=lambda x: x[2])
     latest_order_num = max([v[2] for v in output_lines])
     for rev_num, ol, order_num in output_lines:
         latest_maybe = "" if order_num != latest_order_num else " (latest)"
         print(f"{rev_num} {ol}{latest_maybe}")
+
+
+def search_collection(
+    script_folder: "ScriptDirectory",
+    table_names: list[str],
+    replaceable_names: list[str],
+    use_cache: bool = True,
+    jobs: int = 1,
+    columns: list[tuple[str, str]] | None = None,
+):
+    # drop repeated names but keep the order they were asked for in
+    table_names = list(dict.fromkeys(table_names))
+    replaceable_names = list(dict.fromkeys(replaceable_names))
+    columns = list(dict.fromkeys(columns or []))
+    index = load_fresh_index(script_folder) if use_cache else None
+    if index is not None:
+        results = search_index(index, table_names, replaceable_names, columns)
+    else:
+        results = search_scan(
+            RevisionGraph.load(script_folder),
+            table_names,
+            replaceable_names,
+            use_cache,
+            jobs,
+            columns,
+        )
+    print_search_results(results)
+
+
+def print_search_results(results: SearchResults) -> None:
+    first = True
+    for table_name, output_lines in results.tables.items():
+        if not first:
+            print()
+        first = False
+        print(f"Table: {table_name}")
+        print_search_lines(output_lines)
+    for replaceable_name, output_lines in results.replaceables.items():
+        if not first:
+            print()
+        first = False
+        print(f"Replacable entity {replaceable_name}")
+        print_search_lines(output_lines)
+    for (table_name, column), output_lines in results.columns.items():
+        if not first:
+            print()
+        first = False
+        print(f"Column: {table_name}.{column}")
+        print_search_lines(output_lines)
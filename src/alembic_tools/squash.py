@@ -1,158 +1,220 @@
 import ast
 from pathlib import Path
 import re
-from typing import NamedTuple
-from alembic.script import Script
-import alembic.util
 
-from alembic_tools.code_reader import get_revision_methods
+from alembic_tools.code_reader import (
+    RevisionSource,
+    get_node_source,
+    read_revision_source,
+)
+from alembic_tools.move_revision import set_down_revision_text
+from alembic_tools.prefetch import prefetch, read_text
 from alembic_tools.revision_collection import (
-    find_revs_that_start_with,
-    get_revision_map,
-    get_script_directory,
+    RevisionGraph,
+    RevisionHeader,
+    get_unambiguous_revisions,
 )
 
-
-class ConnectedRevisions(NamedTuple):
-    from_rev: Script
-    to_rev: Script
-
-
-def find_revisions_to_squash(
-    rev1_prefix: str, rev2_prefix: str, revision_map: dict[str, Script]
-) -> ConnectedRevisions | None:
-    revs1 = find_revs_that_start_with(rev1_prefix, revision_map)
-    revs2 = find_revs_that_start_with(rev2_prefix, revision_map)
-    if len(revs1) == 0:
-        print(f"Could not find revision beginning with {rev1_prefix}")
-        return None
-    if len(revs1) > 1:
-        print(
-            f"Revision {rev1_prefix} is ambiguous. Could be any of {', '.join(revs1)}"
-        )
-        return None
-    if len(revs2) == 0:
-        print(f"Could not find revision beginning with {rev2_prefix}")
-        return None
-    if len(revs2) > 1:
-        print(
-            f"Revision {rev2_prefix} is ambiguous. Could be any of {', '.join(revs1)}"
-        )
-        return None
-    rev1_prefix = revs1[0]
-    rev2_prefix = revs2[0]
-    rev1 = revision_map[rev1_prefix]
-    rev2 = revision_map[rev2_prefix]
-
-    if rev1.down_revision == rev2.revision:
-        to_rev = rev1
-        from_rev = rev2
-    elif rev2.down_revision == rev1.revision:
-        to_rev = rev2
-        from_rev = rev1
-    else:
-        print(
-            f"Error: These two revisions don't seem to be connected. {rev1} has down revision {rev1.down_revision} and {rev2} has down revision {rev2.down_revision}. "
-            "One of the two should point to the other."
-        )
-        return None
-    return ConnectedRevisions(from_rev, to_rev)
+# Names every revision file assigns for alembic; each file has its own
+IDENTIFIER_NAMES = {"revision", "down_revision", "branch_labels", "depends_on"}
+
+
+def find_chain(
+    graph: RevisionGraph, rev1: str, rev2: str
+) -> list[RevisionHeader] | None:
+    # The revisions from the earlier of the two to the later, as long as they
+    # form a single line: nothing merges into it or branches off it part way
+    if graph.order_map[rev1] > graph.order_map[rev2]:
+        rev1, rev2 = rev2, rev1
+    chain = [rev2]
+    while chain[-1] != rev1:
+        current = chain[-1]
+        parents = graph.parents[current]
+        if len(parents) > 1:
+            print(
+                f"Error: {current} merges {', '.join(parents)}. Only a single line of revisions can be squashed."
+            )
+            return None
+        if (
+            not parents
+            or parents[0] not in graph.revisions
+            or graph.order_map[parents[0]] < graph.order_map[rev1]
+        ):
+            print(f"Error: {rev2} does not descend from {rev1}.")
+            return None
+        parent = parents[0]
+        if graph.children[parent] != [current]:
+            others = [child for child in graph.children[parent] if child != current]
+            print(
+                f"Error: {', '.join(others)} also come after {parent}. Only a single line of revisions can be squashed."
+            )
+            return None
+        chain.append(parent)
+    return [graph.revisions[rev] for rev in reversed(chain)]
 
 
 class FormatException(Exception):
     pass
 
 
-def make_squashed_text(
-    new_rev_text: str,
-    rev1_methods: tuple[str, str],
-    rev2_methods: tuple[str, str],
-    from_rev: Script,
-    to_rev: Script,
-    new_script: Script,
+def method_body(function_code: str) -> str:
+    # The indented lines under the def, or "" when all it does is pass
+    signature, _, body = function_code.partition("\n")
+    if not signature.rstrip().endswith(":"):
+        raise FormatException(f"Could not find where {signature} ends")
+    function = ast.parse(function_code).body[0]
+    assert isinstance(function, ast.FunctionDef)
+    if all(isinstance(stmt, ast.Pass) for stmt in function.body):
+        return ""
+    return body
+
+
+def combine_bodies(function_code: str, bodies: list[tuple[RevisionHeader, str]]) -> str:
+    # function_code supplies the signature; each non-empty body is labeled
+    # with the revision it came from
+    lines = [function_code.partition("\n")[0]]
+    for header, body in bodies:
+        if body:
+            doc = header.doc.splitlines()[0] if header.doc else ""
+            lines.append(f"    # {header.revision}: {doc}".rstrip())
+            lines.append(body)
+    if len(lines) == 1:
+        lines.append("    pass")
+    return "\n".join(lines) + "\n"
+
+
+def assigned_name(node: ast.stmt) -> str | None:
+    if isinstance(node, ast.Assign) and len(node.targets) == 1:
+        target = node.targets[0]
+    elif isinstance(node, ast.AnnAssign):
+        target = node.target
+    else:
+        return None
+    return target.id if isinstance(target, ast.Name) else None
+
+
+def module_statements(source: RevisionSource) -> list[str]:
+    # Top-level code besides the docstring, the identifiers and the methods:
+    # imports, and objects such as ReplaceableObjects that the methods use
+    statements = []
+    for idx, node in enumerate(source.tree.body):
+        if idx == 0 and isinstance(node, ast.Expr):
+            continue
+        if isinstance(node, ast.FunctionDef) and node.name in ("upgrade", "downgrade"):
+            continue
+        if assigned_name(node) in IDENTIFIER_NAMES:
+            continue
+        statement = get_node_source(source.lines, node)
+        if statement is not None:
+            statements.append(statement)
+    return statements
+
+
+def make_range_text(
+    chain: list[RevisionHeader],
+    sources: list[RevisionSource],
+    commit_name: str | None,
 ) -> str:
-
-    upgrade_1, downgrade_1 = rev1_methods
-    upgrade_2, downgrade_2 = rev2_methods
-
-    upgrade_1 = upgrade_1.split("def upgrade() -> None:")[1]
-    upgrade_2 = upgrade_2.split("def upgrade() -> None:")[1]
-    downgrade_1 = downgrade_1.split("def downgrade() -> None:")[1]
-    downgrade_2 = downgrade_2.split("def downgrade() -> None:")[1]
-    combined_upgrade = f"<<<<<<< {from_rev.revision}\n {upgrade_1}\n=======\n{upgrade_2}\n>>>>>>> {to_rev.revision}"
-    combined_downgrade = f"<<<<<<< {to_rev.revision}\n {downgrade_2}\n=======\n{downgrade_1}\n>>>>>>> {from_rev.revision}"
-    if "def upgrade() -> None:\n    pass" not in new_rev_text:
-        raise FormatException("Could not match upgrade string in source file")
-    new_rev_text = new_rev_text.replace(
-        "def upgrade() -> None:\n    pass",
-        f"def upgrade() -> None:\n{combined_upgrade}",
-    )
-    if "def downgrade() -> None:\n    pass" not in new_rev_text:
-        raise FormatException("Could not match downgrade string in source file")
-    new_rev_text = new_rev_text.replace(
-        "def downgrade() -> None:\n    pass",
-        f"def downgrade() -> None:\n{combined_downgrade}",
+    # The last revision's file, with the upgrades of the whole chain in order,
+    # the downgrades in reverse, and whatever else the other files define
+    last = sources[-1]
+    upgrade = combine_bodies(
+        last.methods.upgrade,
+        [(h, method_body(s.methods.upgrade)) for h, s in zip(chain, sources)],
     )
-    new_rev_text = re.sub(
-        R'down_revision: Union\[str, None\] = ["\'][^"\']+["\']',
-        f"down_revision: Union[str, None] = {repr(from_rev.down_revision)}",
-        new_rev_text,
-    )
-    new_rev_text = new_rev_text.replace(new_script.revision, to_rev.revision)
-    new_rev_text = re.sub(
-        R"Revises: [^\n]+", f"Revises: {from_rev.down_revision or ''}", new_rev_text
+    downgrade = combine_bodies(
+        last.methods.downgrade,
+        [(h, method_body(s.methods.downgrade)) for h, s in zip(chain, sources)][::-1],
     )
+    seen = set(module_statements(last))
+    extra = []
+    for source in sources[:-1]:
+        for statement in module_statements(source):
+            if statement not in seen:
+                seen.add(statement)
+                extra.append(statement)
+    # (first line, last line) to replace, 1-based and inclusive, with the text
+    edits = [
+        (*last.methods.upgrade_lines, upgrade),
+        (*last.methods.downgrade_lines, downgrade),
+    ]
+    if extra:
+        # after the last of the file's own statements that come before its
+        # identifiers
+        end = 0
+        for node in last.tree.body:
+            if assigned_name(node) in IDENTIFIER_NAMES:
+                break
+            assert node.end_lineno is not None
+            end = node.end_lineno
+        edits.append((end + 1, end, "".join(f"{s}\n" for s in extra)))
+    lines = list(last.lines)
+    for first_line, last_line, text in sorted(edits, reverse=True):
+        lines[first_line - 1 : last_line] = [text]
+    new_rev_text = set_down_revision_text("".join(lines), chain[0].down_revision)
+    if commit_name is not None and chain[-1].doc:
+        new_rev_text = new_rev_text.replace(chain[-1].doc, commit_name, 1)
     return new_rev_text
 
 
-def squash_commits(rev1_prefix: str, rev2_prefix: str, commit_name: str | None) -> int:
-    script_folder = get_script_directory()
-    revision_map = get_revision_map(script_folder)
-    revs_to_squash = find_revisions_to_squash(rev1_prefix, rev2_prefix, revision_map)
-    if revs_to_squash is None:
-        return 1
-    from_rev = revs_to_squash.from_rev
-    to_rev = revs_to_squash.to_rev
-    from_rev_path = Path(from_rev.path)
-    to_rev_path = Path(to_rev.path)
-    print(f"Squashing {from_rev.revision} and {to_rev.revision}")
-    new_script = script_folder.generate_revision(alembic.util.rev_id(), commit_name)
-    if new_script is None:
-        print("Unable to make script!")
-        return 1
-    script_path = Path(new_script.path)
-    rev1_methods = get_revision_methods(from_rev_path)
-    rev2_methods = get_revision_methods(to_rev_path)
-    if rev1_methods is None:
-        return 1
-    if rev2_methods is None:
+def squash_range(chain: list[RevisionHeader], commit_name: str | None) -> int:
+    # Everything comes from files that are already known, so alembic doesn't
+    # need to load the script directory again
+    first, last = chain[0], chain[-1]
+    print(f"Squashing {len(chain)} revisions from {first.revision} to {last.revision}")
+    sources = []
+    paths = [Path(header.path) for header in chain]
+    for p, text in prefetch(read_text, paths):
+        source = read_revision_source(p, text)
+        if source is None:
+            print(f"Could not find upgrade and downgrade in {p}")
+            return 1
+        sources.append(source)
+    try:
+        new_rev_text = make_range_text(chain, sources, commit_name)
+    except FormatException as e:
+        print(f"Error: {e}")
         return 1
-    new_rev_text = script_path.read_text()
-    new_rev_text = make_squashed_text(
-        new_rev_text, rev1_methods, rev2_methods, from_rev, to_rev, new_script
-    )
-    rev_part, msg_part = script_path.name.split("_", maxsplit=1)
-
-    script_path = script_path.rename(
-        script_path.parent / "_".join([to_rev.revision, msg_part])
-    )
-    script_path.write_text(new_rev_text)
+    last_path = Path(last.path)
+    script_path = last_path
+    if commit_name is not None:
+        slug = "_".join(re.sub(R"\W", " ", commit_name).lower().split())
+        if slug:
+            script_path = last_path.parent / f"{last.revision}_{slug}.py"
     squashed_folder = Path(".") / "squashed_revisions"
     squashed_folder.mkdir(exist_ok=True)
-    to_rev_path.rename(squashed_folder / to_rev_path.name)
-    from_rev_path.rename(squashed_folder / from_rev_path.name)
+    for header in chain:
+        path = Path(header.path)
+        path.rename(squashed_folder / path.name)
+    script_path.write_text(new_rev_text)
     print(
         f"""
-Commits squashed successfully. You will need to open {script_path.resolve()} 
-and modify it to finish the squash. 
+Revisions squashed successfully into {script_path.resolve()}.
+Check it over before using it: code outside upgrade and downgrade was copied
+from every squashed revision and may need tidying up.
 
 If any databases are currently on one of the squashed
 commits, alembic will be unable to run migrations. In that case, you'll have to manually 
 run update the database using SQL:
 
-    update alembic_version set version_num = '{new_script.revision}'
+    update alembic_version set version_num = '{last.revision}'
 
 To undo this change, copy the files from the squashed_revisions folder back into versions
 and delete the new revision."""
     )
     return 0
+
+
+def squash_commits(
+    graph: RevisionGraph, rev1_prefix: str, rev2_prefix: str, commit_name: str | None
+) -> int:
+    success, revs = get_unambiguous_revisions([rev1_prefix, rev2_prefix], graph)
+    if not success:
+        return 1
+    if revs[0] == revs[1]:
+        print("Error: Both revisions are the same, so there's nothing to squash.")
+        return 1
+    chain = find_chain(graph, revs[0], revs[1])
+    if chain is None:
+        return 1
+    return squash_range(chain, commit_name)
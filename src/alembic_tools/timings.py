@@ -0,0 +1,78 @@
+from contextlib import contextmanager, nullcontext
+import json
+import sys
+import time
+from typing import Any, ContextManager, Iterator, TextIO
+
+
+# Wall time spent in each phase of a run, plus counters such as files read and
+# bytes parsed. Phases nest, and are reported by their path ("search/analyze").
+# Recording is off unless enabled, and costs next to nothing while it is.
+class Timings:
+    enabled: bool
+    # path -> [calls, seconds]
+    phases: dict[str, list[Any]]
+    counts: dict[str, int]
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.phases = {}
+        self.counts = {}
+        self._stack: list[str] = []
+
+    def phase(self, name: str) -> ContextManager[None]:
+        if not self.enabled:
+            return nullcontext()
+        return self._record(name)
+
+    @contextmanager
+    def _record(self, name: str) -> Iterator[None]:
+        self._stack.append(name)
+        # added on entry, so that phases are listed in the order they started
+        entry = self.phases.setdefault("/".join(self._stack), [0, 0.0])
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._stack.pop()
+            entry[0] += 1
+            entry[1] += elapsed
+
+    def count(self, name: str, n: int = 1) -> None:
+        if self.enabled:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "phases": {
+                path: {"calls": calls, "seconds": seconds}
+                for path, (calls, seconds) in self.phases.items()
+            },
+            "counts": self.counts,
+        }
+
+    def write_json(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump(self.to_json(), f, indent=2)
+
+    def print_summary(self, out: TextIO = sys.stderr) -> None:
+        print("Timings:", file=out)
+        for path, (calls, seconds) in self.phases.items():
+            depth = path.count("/")
+            name = "  " * depth + path.rsplit("/", 1)[-1]
+            calls_text = f" ({calls} calls)" if calls > 1 else ""
+            print(f"  {name:<32} {seconds * 1000:10.1f} ms{calls_text}", file=out)
+        for name, n in sorted(self.counts.items()):
+            print(f"  {name:<32} {n:10}", file=out)
+
+
+TIMINGS = Timings()
+
+
+def phase(name: str) -> ContextManager[None]:
+    return TIMINGS.phase(name)
+
+
+def count(name: str, n: int = 1) -> None:
+    TIMINGS.count(name, n)
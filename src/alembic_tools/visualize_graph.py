@@ -1,7 +1,35 @@
+from collections import deque
+import hashlib
+import json
+import os
+from pathlib import Path
 import subprocess
-from alembic.config import Config
-from alembic.script import ScriptDirectory
-from graphviz import Digraph
+from typing import TYPE_CHECKING
+
+from alembic_tools.analysis_cache import CACHE_DIR
+import alembic_tools.timings as timings
+
+# The command line reads the formats from here before it knows whether it will
+# need alembic or Graphviz at all, so neither is imported up front
+if TYPE_CHECKING:
+    from graphviz import Digraph
+
+    from alembic_tools.revision_collection import RevisionGraph
+
+# Stands in for everything before the first revision shown
+BASE_NODE = "base"
+# Stands in for revisions that were left out of the picture
+ELIDED_NODE = "..."
+# Linear runs shorter than this are left alone when collapsing
+DEFAULT_COLLAPSE_RUN = 3
+OUTPUT_NAME = "alembic_graph"
+# format -> file extension; png and svg are laid out by Graphviz, the rest are
+# written directly
+FORMATS = {"png": "png", "svg": "svg", "dot": "dot", "json": "json", "mermaid": "mmd"}
+GRAPHVIZ_FORMATS = {"png", "svg"}
+RENDER_CACHE_FILE = "render.json"
+# Bump when the output for the same view and options changes
+RENDER_VERSION = 1
 
 
 def is_graphviz_installed():
@@ -20,22 +48,233 @@ def is_graphviz_installed():
         return False
 
 
-def visualize_graph_graphviz(horiz: bool):
-    alembic_config = Config(file_="alembic.ini", ini_section="alembic")
-    script = ScriptDirectory.from_config(alembic_config)
+# The nodes and edges to draw, worked out before anything is handed to a
+# renderer so that they can be cut down first
+class GraphView:
+    # node id -> label
+    nodes: dict[str, str]
+    edges: list[tuple[str, str]]
+    # placeholder nodes (base, elided revisions, collapsed runs)
+    placeholders: set[str]
+
+    def __init__(self) -> None:
+        self.nodes = {}
+        self.edges = []
+        self.placeholders = set()
+
+
+def neighborhood(graph: "RevisionGraph", revision: str, depth: int) -> set[str]:
+    # Everything within depth steps of revision, following edges either way
+    found = {revision}
+    frontier = deque([(revision, 0)])
+    while frontier:
+        current, distance = frontier.popleft()
+        if distance == depth:
+            continue
+        for rev in graph.parents[current] + graph.children[current]:
+            if rev in graph.revisions and rev not in found:
+                found.add(rev)
+                frontier.append((rev, distance + 1))
+    return found
+
+
+def descendants(graph: "RevisionGraph", revision: str) -> set[str]:
+    # revision and everything that comes after it
+    found = {revision}
+    stack = [revision]
+    while stack:
+        for child in graph.children[stack.pop()]:
+            if child not in found:
+                found.add(child)
+                stack.append(child)
+    return found
+
+
+def graph_view(graph: "RevisionGraph", revisions: set[str] | None = None) -> GraphView:
+    # revisions limits the view to a subset; anything leading into it from
+    # outside is drawn as coming from a single elided node
+    view = GraphView()
+    for rev in graph.order:
+        header = graph.revisions.get(rev)
+        if header is None or (revisions is not None and rev not in revisions):
+            continue
+        view.nodes[rev] = f"{rev}\n{header.doc}"
+        parents = graph.parents[rev]
+        if not parents:  # this is the origin
+            view.edges.append((BASE_NODE, rev))
+        shown = [p for p in parents if p in view.nodes]
+        for parent in shown:
+            view.edges.append((parent, rev))
+        if len(shown) < len(parents):
+            view.edges.append((ELIDED_NODE, rev))
+    for placeholder in (BASE_NODE, ELIDED_NODE):
+        if any(src == placeholder for src, _ in view.edges):
+            view.placeholders.add(placeholder)
+    return view
+
+
+def collapse_chains(view: GraphView, min_run: int = DEFAULT_COLLAPSE_RUN) -> GraphView:
+    # Replace each run of at least min_run revisions that have exactly one edge
+    # in and one edge out with a single node. Branch and merge points, and the
+    # ends of the history, stay as they are.
+    parents: dict[str, list[str]] = {node: [] for node in view.nodes}
+    children: dict[str, list[str]] = {node: [] for node in view.nodes}
+    for src, dst in view.edges:
+        children.setdefault(src, []).append(dst)
+        parents.setdefault(dst, []).append(src)
+
+    def in_chain(node: str) -> bool:
+        return (
+            node not in view.placeholders
+            and len(parents[node]) == 1
+            and len(children[node]) == 1
+        )
+
+    replacement: dict[str, str] = {}
+    collapsed = GraphView()
+    collapsed.placeholders = set(view.placeholders)
+    for node in view.nodes:
+        if not in_chain(node) or in_chain(parents[node][0]):
+            continue
+        # node starts a run; follow it to the end
+        run = [node]
+        while in_chain(children[run[-1]][0]):
+            run.append(children[run[-1]][0])
+        if len(run) < min_run:
+            continue
+        run_id = f"{run[0]}..{run[-1]}"
+        collapsed.placeholders.add(run_id)
+        collapsed.nodes[run_id] = f"{len(run)} revisions\n{run[0]} .. {run[-1]}"
+        for rev in run:
+            replacement[rev] = run_id
+    for node, label in view.nodes.items():
+        if node not in replacement:
+            collapsed.nodes[node] = label
+    for src, dst in view.edges:
+        src = replacement.get(src, src)
+        dst = replacement.get(dst, dst)
+        if src != dst:
+            collapsed.edges.append((src, dst))
+    return collapsed
+
+
+def make_digraph(view: GraphView, horiz: bool, fmt: str = "png") -> "Digraph":
+    from graphviz import Digraph
+
     rankdir = "LR" if horiz else "TB"
     dot = Digraph(
-        format="png",
+        format=fmt,
         graph_attr={"rankdir": rankdir},
         node_attr={"fontname": "Helvetica,Arial,sans-serif", "shape": "rect"},
     )
-    for revision in script.walk_revisions():
-        dot.node(revision.revision, label=f"{revision.revision}\n{revision.doc}")
-        if revision.down_revision is None:  # this is the origin
-            dot.edge("base", revision.revision)
-        elif isinstance(revision.down_revision, str):
-            dot.edge(revision.down_revision, revision.revision)
-        else:
-            for down_revision in revision.down_revision:
-                dot.edge(down_revision, revision.revision)
-    dot.render("alembic_graph")
+    with timings.phase("build_dot"):
+        for node, label in view.nodes.items():
+            if node in view.placeholders:
+                dot.node(node, label=label, style="dashed")
+            else:
+                dot.node(node, label=label)
+        for src, dst in view.edges:
+            if src == ELIDED_NODE:
+                dot.edge(src, dst, style="dashed")
+            else:
+                dot.edge(src, dst)
+    return dot
+
+
+def view_to_json(view: GraphView) -> dict:
+    return {
+        "nodes": [
+            {"id": node, "label": label, "placeholder": node in view.placeholders}
+            for node, label in view.nodes.items()
+        ],
+        "edges": [list(edge) for edge in view.edges],
+    }
+
+
+def view_to_mermaid(view: GraphView, horiz: bool) -> str:
+    # Mermaid ids can't hold most punctuation, so nodes get numbered ids
+    ids: dict[str, str] = {}
+    lines = [f"flowchart {'LR' if horiz else 'TB'}"]
+
+    def node_id(node: str) -> str:
+        if node not in ids:
+            ids[node] = f"n{len(ids)}"
+            label = view.nodes.get(node, node).replace('"', "#quot;")
+            label = label.replace("\n", "<br/>")
+            lines.append(f'    {ids[node]}["{label}"]')
+        return ids[node]
+
+    for node in view.nodes:
+        node_id(node)
+    for src, dst in view.edges:
+        arrow = "-.->" if src == ELIDED_NODE else "-->"
+        lines.append(f"    {node_id(src)} {arrow} {node_id(dst)}")
+    return "\n".join(lines) + "\n"
+
+
+def view_hash(view: GraphView, horiz: bool, fmt: str) -> str:
+    data = {
+        "version": RENDER_VERSION,
+        "horiz": horiz,
+        "format": fmt,
+        "view": view_to_json(view),
+    }
+    return hashlib.sha256(json.dumps(data).encode()).hexdigest()
+
+
+def load_render_cache(cache_dir: Path) -> dict[str, str]:
+    try:
+        return json.loads((cache_dir / RENDER_CACHE_FILE).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def save_render_cache(cache_dir: Path, entries: dict[str, str]) -> None:
+    cache_dir.mkdir(exist_ok=True)
+    path = cache_dir / RENDER_CACHE_FILE
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(entries))
+    os.replace(tmp_path, path)
+
+
+def visualize_graph_graphviz(view: GraphView, horiz: bool, fmt: str = "png") -> Path:
+    dot = make_digraph(view, horiz, fmt)
+    with timings.phase("render"):
+        return Path(dot.render(OUTPUT_NAME))
+
+
+def write_view(view: GraphView, horiz: bool, fmt: str) -> Path:
+    if fmt in GRAPHVIZ_FORMATS:
+        return visualize_graph_graphviz(view, horiz, fmt)
+    output = Path(f"{OUTPUT_NAME}.{FORMATS[fmt]}")
+    with timings.phase("write"):
+        match fmt:
+            case "dot":
+                output.write_text(make_digraph(view, horiz).source)
+            case "json":
+                output.write_text(json.dumps(view_to_json(view), indent=2) + "\n")
+            case "mermaid":
+                output.write_text(view_to_mermaid(view, horiz))
+    return output
+
+
+def render_view(
+    view: GraphView,
+    horiz: bool,
+    fmt: str,
+    use_cache: bool = True,
+    cache_dir: Path = CACHE_DIR,
+) -> tuple[Path, bool]:
+    # Returns the output file and whether it had to be written; an output that
+    # was made from the same view and options is left alone
+    output = Path(f"{OUTPUT_NAME}.{FORMATS[fmt]}")
+    digest = view_hash(view, horiz, fmt)
+    entries = load_render_cache(cache_dir)
+    if use_cache and output.exists() and entries.get(str(output)) == digest:
+        return output, False
+    output = write_view(view, horiz, fmt)
+    # recorded even without the cache, since the old digest no longer matches
+    # what's in the file
+    entries[str(output)] = digest
+    save_render_cache(cache_dir, entries)
+    return output, True
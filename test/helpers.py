@@ -0,0 +1,93 @@
+import subprocess
+
+import alembic_tools.analyze_revision as ar
+from alembic_tools.move_revision import set_down_revision_text
+from alembic_tools.revision_collection import RevisionGraph, scan_revision_header
+
+# Shared by the test modules, which import from here rather than from each other
+
+
+def make_revision(lines: str, preamble_lines: str = ""):
+    return f"""\"\"\"a description
+
+Revision ID: a38df1d1f70f
+Revises: 70421ef63b0d
+Create Date: 2024-03-01 17:03:22.817200
+
+\"\"\"
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from replaceable import ReplaceableObject
+import utils
+
+{preamble_lines}
+
+# revision identifiers, used by Alembic.
+revision: str = "a38df1d1f70f"
+down_revision: Union[str, None] = '70421ef63b0d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+{lines}
+
+
+def downgrade() -> None:
+    pass
+"""
+
+
+def write_revision(
+    folder,
+    rev: str,
+    down: str | tuple[str, ...] | None,
+    upgrade: str = "    pass",
+    downgrade: str = "    pass",
+    preamble: str = "",
+):
+    text = make_revision(upgrade, preamble).replace("a38df1d1f70f", rev)
+    text = text.replace(
+        "def downgrade() -> None:\n    pass", f"def downgrade() -> None:\n{downgrade}"
+    )
+    p = folder / f"{rev}_rev.py"
+    p.write_text(set_down_revision_text(text, down))
+    return p
+
+
+def write_chain(folder, chain: list[tuple[str, str | tuple[str, ...] | None]]):
+    headers = []
+    for rev, down in chain:
+        header = scan_revision_header(write_revision(folder, rev, down))
+        assert header is not None
+        headers.append(header)
+    return RevisionGraph(None, headers)
+
+
+def git(*args):
+    subprocess.run(
+        ["git", "-c", "user.name=t", "-c", "user.email=t@t", *args],
+        check=True,
+        capture_output=True,
+    )
+
+
+def make_analysis() -> ar.Revision:
+    rev = ar.Revision()
+    create = ar.CreateTableStatement("post")
+    create.columns = [ar.Column("post_id"), ar.Column("title")]
+    rev.statements.append(create)
+    rev.statements.append(ar.AddColumnStatement("post", "author_id"))
+    rev.statements.append(ar.CreateIndexStatement("post"))
+    rev.statements.append(ar.CreateForeignKeyStatement("post", "user"))
+    rev.statements.append(ar.DropColumnStatement("tag", "old"))
+    rev.statements.append(
+        ar.ReplaceableStatement(
+            "vw_posts", ar.ReplaceableOperation.REPLACE, replaces="abc.vw_posts"
+        )
+    )
+    rev.statements.append(ar.Statement(ar.StatementType.UNKNOWN))
+    return rev
@@ -0,0 +1,124 @@
+import os
+from pathlib import Path
+
+import alembic_tools.analyze_revision as ar
+import alembic_tools.analysis_cache as analysis_cache
+from alembic_tools.analysis_cache import AnalysisCache, analyze_revisions
+from test.helpers import git, write_revision
+
+
+def test_warm_cache_does_not_reparse(tmp_path, monkeypatch):
+    p = write_revision(tmp_path, "rev1", None, '    op.drop_table("table1")')
+    cache = AnalysisCache(tmp_path / "cache")
+    cache.load()
+    analyze_revisions([p], cache)
+    cache.save()
+
+    def fail(*args, **kwargs):
+        raise AssertionError("revision should not have been re-analyzed")
+
+    monkeypatch.setattr(ar, "analyze_revision", fail)
+    cache = AnalysisCache(tmp_path / "cache")
+    cache.load()
+    [result] = analyze_revisions([p], cache)
+    assert isinstance(result.statements[0], ar.DropTableStatement)
+    assert result.statements[0].table_name == "table1"
+
+
+def test_changed_file_is_reanalyzed(tmp_path):
+    p = write_revision(tmp_path, "rev1", None, '    op.drop_table("table1")')
+    cache = AnalysisCache(tmp_path / "cache")
+    cache.load()
+    analyze_revisions([p], cache)
+    cache.save()
+    write_revision(tmp_path, "rev1", None, '    op.drop_table("a_longer_table_name")')
+    st = p.stat()
+    os.utime(p, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    cache = AnalysisCache(tmp_path / "cache")
+    cache.load()
+    [result] = analyze_revisions([p], cache)
+    stmt = result.statements[0]
+    assert isinstance(stmt, ar.DropTableStatement)
+    assert stmt.table_name == "a_longer_table_name"
+
+
+def test_deleted_files_are_evicted(tmp_path):
+    p1 = write_revision(tmp_path, "rev1", None, '    op.drop_table("table1")')
+    p2 = write_revision(tmp_path, "rev2", None, '    op.drop_table("table2")')
+    cache = AnalysisCache(tmp_path / "cache")
+    cache.load()
+    analyze_revisions([p1, p2], cache)
+    cache.save()
+    p2.unlink()
+    cache = AnalysisCache(tmp_path / "cache")
+    cache.load()
+    analyze_revisions([p1], cache)
+    cache.save()
+    cache = AnalysisCache(tmp_path / "cache")
+    cache.load()
+    assert list(cache.entries) == [str(p1)]
+
+
+def test_analyzer_version_change_invalidates(tmp_path, monkeypatch):
+    p = write_revision(tmp_path, "rev1", None, '    op.drop_table("table1")')
+    cache = AnalysisCache(tmp_path / "cache")
+    cache.load()
+    analyze_revisions([p], cache)
+    cache.save()
+    monkeypatch.setattr(ar, "ANALYZER_VERSION", ar.ANALYZER_VERSION + 1)
+    cache = AnalysisCache(tmp_path / "cache")
+    cache.load()
+    assert cache.entries == {}
+
+
+def test_parallel_matches_serial(tmp_path, monkeypatch):
+    paths = []
+    for i in range(8):
+        lines = f'    op.add_column("table{i}", sa.Column("col{i}", sa.Integer))'
+        paths.append(write_revision(tmp_path, f"rev{i}", None, lines))
+    monkeypatch.setattr(analysis_cache, "PARALLEL_THRESHOLD", 1)
+    serial = analyze_revisions(paths, jobs=1)
+    parallel = analyze_revisions(paths, jobs=3)
+    assert added_columns(parallel) == added_columns(serial)
+
+
+def added_columns(results: list[ar.Revision]) -> list[tuple[str, str]]:
+    columns = []
+    for result in results:
+        for stmt in result.statements:
+            assert isinstance(stmt, ar.AddColumnStatement)
+            columns.append((stmt.table_name, stmt.column_name))
+    return columns
+
+
+def test_files_unchanged_in_git_are_not_looked_at(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    p1 = write_revision(tmp_path, "rev1", None, '    op.drop_table("table1")')
+    p2 = write_revision(tmp_path, "rev2", None, '    op.drop_table("table2")')
+    git("init", "-q")
+    git("add", "rev1_rev.py", "rev2_rev.py")
+    git("commit", "-q", "-m", "init")
+    cache = AnalysisCache(tmp_path / "cache")
+    cache.load()
+    analyze_revisions([p1, p2], cache)
+    cache.save()
+
+    write_revision(tmp_path, "rev2", None, '    op.drop_table("a_longer_table_name")')
+    git("commit", "-q", "-am", "change rev2")
+    stat = Path.stat
+    stat_calls = []
+
+    def counting_stat(self, *args, **kwargs):
+        stat_calls.append(self.name)
+        return stat(self, *args, **kwargs)
+
+    monkeypatch.setattr(Path, "stat", counting_stat)
+    cache = AnalysisCache(tmp_path / "cache")
+    cache.load()
+    first, second = analyze_revisions([p1, p2], cache)
+    stmt1, stmt2 = first.statements[0], second.statements[0]
+    assert isinstance(stmt1, ar.DropTableStatement)
+    assert isinstance(stmt2, ar.DropTableStatement)
+    assert stmt1.table_name == "table1"
+    assert stmt2.table_name == "a_longer_table_name"
+    assert "rev1_rev.py" not in stat_calls
@@ -1,6 +1,7 @@
 import pytest
 import alembic_tools.analyze_revision as ar
 from alembic_tools.search_collection import table_search
+from test.helpers import make_revision
 
 
 def test_empty_when_is_pass():
@@ -263,35 +264,71 @@ def test_compose_table_search_create_fk():
     assert result[0] == "Created FK to table1"
 
 
-def make_revision(lines: str, preamble_lines: str = ""):
-    return f"""\"\"\"a description
+def test_replaceable_op_on_any_object():
+    lines = """
+    utils.create_view(vw_foobar)
+"""
+    rev = make_revision(lines)
+    result = ar.analyze_revision_text(rev, "whatever.py")
+    assert len(result.statements) == 1
+    assert isinstance(result.statements[0], ar.ReplaceableStatement)
+
+
+def test_alembic_op_needs_op_object():
+    lines = """
+    other.create_table("foo")
+    op.execute("select 1")
+"""
+    rev = make_revision(lines)
+    result = ar.analyze_revision_text(rev, "whatever.py")
+    assert [s.stype for s in result.statements] == [
+        ar.StatementType.UNKNOWN,
+        ar.StatementType.UNKNOWN,
+    ]
+
+
+class CreatePartitionStatement(ar.Statement):
+    def __init__(self, table_name: str) -> None:
+        super().__init__(ar.StatementType.CUSTOM)
+        self.table_name = table_name
 
-Revision ID: a38df1d1f70f
-Revises: 70421ef63b0d
-Create Date: 2024-03-01 17:03:22.817200
 
-\"\"\"
+def test_register_custom_operation(monkeypatch):
+    monkeypatch.setattr(ar, "OPERATION_HANDLERS", dict(ar.OPERATION_HANDLERS))
+    version_before = ar.analyzer_version()
 
-from typing import Sequence, Union
+    def parse_create_partition(child):
+        table_name = ar.get_value_from_constant(child.args[0])
+        assert table_name is not None
+        return CreatePartitionStatement(table_name)
 
-from alembic import op
-import sqlalchemy as sa
-from replaceable import ReplaceableObject
-import utils
+    ar.register_operation("create_partition", parse_create_partition)
+    assert ar.analyzer_version() != version_before
+    lines = """
+    op.create_partition("events", "2024")
+"""
+    rev = make_revision(lines)
+    result = ar.analyze_revision_text(rev, "whatever.py")
+    assert len(result.statements) == 1
+    stmt = result.statements[0]
+    assert stmt.stype == ar.StatementType.CUSTOM
+    assert isinstance(stmt, CreatePartitionStatement)
+    assert stmt.table_name == "events"
 
-{preamble_lines}
 
-# revision identifiers, used by Alembic.
-revision: str = "a38df1d1f70f"
-down_revision: Union[str, None] = '70421ef63b0d'
-branch_labels: Union[str, Sequence[str], None] = None
-depends_on: Union[str, Sequence[str], None] = None
+def test_replacing_a_handler_changes_the_version(monkeypatch):
+    monkeypatch.setattr(ar, "OPERATION_HANDLERS", dict(ar.OPERATION_HANDLERS))
+    version_before = ar.analyzer_version()
 
+    def parse_drop_table(child):
+        return ar.DropTableStatement("always_this_table")
 
-def upgrade() -> None:
-{lines}
+    ar.register_operation("drop_table", parse_drop_table)
+    assert ar.analyzer_version() != version_before
 
 
-def downgrade() -> None:
-    pass
-"""
+def test_plugin_versions_are_part_of_the_version(monkeypatch):
+    monkeypatch.setattr(ar, "PLUGIN_VERSIONS", {"alembic-tools-partitions": "1.0"})
+    version_before = ar.analyzer_version()
+    ar.PLUGIN_VERSIONS["alembic-tools-partitions"] = "1.1"
+    assert ar.analyzer_version() != version_before
@@ -0,0 +1,119 @@
+import json
+import os
+
+from alembic.script import ScriptDirectory
+
+import alembic_tools.revision_collection as revision_collection
+from alembic_tools.analysis_cache import AnalysisCache, analyze_revisions
+from alembic_tools.catalog import query_collection, statement_rows
+from test.helpers import make_analysis, write_revision
+
+
+def test_statement_rows():
+    statements, created_columns = statement_rows("rev1", make_analysis())
+    assert statements[0] == (
+        "rev1",
+        0,
+        "create_table",
+        "post",
+        None,
+        None,
+        None,
+        None,
+        None,
+    )
+    assert statements[3][2:6] == ("create_fk", "post", None, "user")
+    assert statements[5][2:] == (
+        "replaceable_op",
+        None,
+        None,
+        None,
+        "vw_posts",
+        "replace",
+        "abc.vw_posts",
+    )
+    assert statements[6][2:4] == ("unknown", None)
+    assert created_columns == [
+        ("rev1", 0, "post", "post_id"),
+        ("rev1", 0, "post", "title"),
+    ]
+
+
+def query(sql, capsys):
+    # the tests run from the project folder
+    assert query_collection(ScriptDirectory("."), sql, as_json=True, jobs=1) == 0
+    return json.loads(capsys.readouterr().out)
+
+
+def test_catalog_is_updated_incrementally(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    versions = tmp_path / "versions"
+    versions.mkdir()
+    monkeypatch.setattr(
+        revision_collection, "list_revision_files", lambda _: sorted(versions.iterdir())
+    )
+    write_revision(
+        versions, "aaa", None, '    op.create_table("users", sa.Column("id"))'
+    )
+    write_revision(
+        versions,
+        "bbb",
+        "aaa",
+        '    op.add_column("posts", sa.Column("user_id"))\n'
+        '    op.create_foreign_key("fk", "posts", "users", ["user_id"], ["id"])',
+    )
+    p = write_revision(versions, "ccc", "bbb", '    op.drop_table("old")')
+
+    assert query(
+        "SELECT revision FROM statements"
+        " WHERE type = 'create_fk' AND referent_table = 'users'",
+        capsys,
+    ) == [{"revision": "bbb"}]
+    assert query("SELECT table_name, column_name FROM created_columns", capsys) == [
+        {"table_name": "users", "column_name": "id"}
+    ]
+
+    # a search fills the shared analysis cache; the catalog mustn't empty it
+    cache = AnalysisCache()
+    cache.load()
+    analyze_revisions(sorted(versions.iterdir()), cache)
+    cache.save()
+
+    write_revision(versions, "ccc", "aaa", '    op.drop_table("older")')
+    st = p.stat()
+    os.utime(p, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    write_revision(versions, "ddd", ("bbb", "ccc"), "    pass")
+    assert query_collection(ScriptDirectory("."), "SELECT 1") == 0
+    assert "Updated the catalog from 2 revision files" in capsys.readouterr().out
+    cache = AnalysisCache()
+    cache.load()
+    assert len(cache.entries) == 3
+    assert query(
+        "SELECT table_name FROM statements WHERE type = 'drop_table'", capsys
+    ) == [{"table_name": "older"}]
+    assert query(
+        "SELECT revision, down_revision FROM edges ORDER BY revision, ordinal", capsys
+    ) == [
+        {"revision": "bbb", "down_revision": "aaa"},
+        {"revision": "ccc", "down_revision": "aaa"},
+        {"revision": "ddd", "down_revision": "bbb"},
+        {"revision": "ddd", "down_revision": "ccc"},
+    ]
+
+    (versions / "bbb_rev.py").unlink()
+    assert query("SELECT DISTINCT revision FROM statements", capsys) == [
+        {"revision": "aaa"},
+        {"revision": "ccc"},
+    ]
+    assert query("SELECT revision FROM revisions ORDER BY position", capsys) == [
+        {"revision": "aaa"},
+        {"revision": "ccc"},
+        {"revision": "ddd"},
+    ]
+
+
+def test_query_can_only_read(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(revision_collection, "list_revision_files", lambda _: [])
+    assert query_collection(ScriptDirectory("."), "DELETE FROM files") == 1
+    assert "readonly" in capsys.readouterr().out
@@ -0,0 +1,104 @@
+import json
+import shutil
+
+from alembic_tools.check_graph import check_collection, check_headers, scan_files
+from alembic_tools.revision_collection import RevisionHeader
+from test.helpers import git, write_chain
+
+
+def header(rev, down):
+    return RevisionHeader(rev, down, "", f"{rev}.py")
+
+
+def codes(diagnostics):
+    return sorted(d.code for d in diagnostics)
+
+
+def test_healthy_graph_with_merge():
+    headers = [
+        header("a", None),
+        header("b", "a"),
+        header("c", "a"),
+        header("m", ("b", "c")),
+    ]
+    assert check_headers(headers) == []
+
+
+def test_reports_each_problem():
+    headers = [
+        header("a", None),
+        header("b", "a"),
+        header("b", "a"),
+        header("c", "missing"),
+        header("x", "z"),
+        header("y", "x"),
+        header("z", "y"),
+        header("after_cycle", "z"),
+    ]
+    diagnostics = check_headers(headers)
+    assert codes(diagnostics) == [
+        "cycle",
+        "dangling-down-revision",
+        "duplicate-revision",
+        "multiple-heads",
+    ]
+    by_code = {d.code: d for d in diagnostics}
+    # after_cycle follows the cycle but isn't on it
+    assert by_code["cycle"].revisions == ["x", "y", "z"]
+    assert by_code["dangling-down-revision"].revisions == ["c", "missing"]
+    assert by_code["duplicate-revision"].paths == ["b.py", "b.py"]
+    assert by_code["multiple-heads"].revisions == ["b", "c", "after_cycle"]
+
+
+def test_unreadable_file_is_reported_not_imported(tmp_path):
+    write_chain(tmp_path, [("aaa", None)])
+    computed = tmp_path / "computed.py"
+    computed.write_text('revision = "b" + "bb"\ndown_revision = "aaa"\n')
+    headers, diagnostics = scan_files(sorted(tmp_path.iterdir()))
+    assert [h.revision for h in headers] == ["aaa"]
+    assert codes(diagnostics) == ["unreadable-revision"]
+    assert diagnostics[0].paths == [str(computed)]
+
+
+def test_changed_only(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "alembic.ini").write_text("[alembic]\nscript_location = .\n")
+    versions = tmp_path / "versions"
+    versions.mkdir()
+    write_chain(versions, [("aaa", "gone"), ("bbb", "aaa")])
+    git("init", "-q")
+    git("add", ".")
+    git("commit", "-q", "-m", "init")
+    assert check_collection(as_json=True) == 1
+    report = json.loads(capsys.readouterr().out)
+    assert not report["ok"]
+    assert [d["code"] for d in report["diagnostics"]] == ["dangling-down-revision"]
+    # the dangling revision was already there, so it's left out
+    assert check_collection(changed_only=True) == 0
+    capsys.readouterr()
+    write_chain(versions, [("ccc", ("bbb", "nope"))])
+    assert check_collection(changed_only=True, as_json=True) == 1
+    report = json.loads(capsys.readouterr().out)
+    assert [d["revisions"] for d in report["diagnostics"]] == [["ccc", "nope"]]
+    git("add", ".")
+    git("commit", "-q", "-m", "ccc")
+    assert check_collection(changed_only=True) == 0
+    assert check_collection(changed_only=True, git_range="HEAD~1..HEAD") == 1
+
+
+def test_locations_follow_a_moved_project(tmp_path, monkeypatch, capsys):
+    first = tmp_path / "first"
+    versions = first / "versions"
+    versions.mkdir(parents=True)
+    (first / "alembic.ini").write_text("[alembic]\nscript_location = .\n")
+    write_chain(versions, [("aaa", "gone")])
+    monkeypatch.chdir(first)
+    assert check_collection() == 1
+    capsys.readouterr()
+    # cp -p keeps the mtime of alembic.ini, so only its place tells them apart
+    moved = tmp_path / "moved"
+    shutil.copytree(first, moved)
+    shutil.rmtree(first)
+    monkeypatch.chdir(moved)
+    assert check_collection() == 1
+    assert "gone" in capsys.readouterr().out
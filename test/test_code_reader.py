@@ -0,0 +1,51 @@
+import ast
+
+from alembic_tools.code_reader import (
+    get_node_source,
+    get_revision_methods,
+    read_revision_methods_many,
+    read_revision_methods_text,
+)
+from test.helpers import make_revision
+
+
+def test_reads_both_functions_and_lines():
+    text = make_revision('    op.drop_table("table1")\n    op.drop_table("ü")')
+    methods = read_revision_methods_text(text, "rev.py")
+    assert methods is not None
+    assert methods.upgrade == (
+        'def upgrade() -> None:\n    op.drop_table("table1")\n    op.drop_table("ü")'
+    )
+    assert methods.downgrade == "def downgrade() -> None:\n    pass"
+    lines = text.splitlines()
+    start, end = methods.upgrade_lines
+    assert lines[start - 1] == "def upgrade() -> None:"
+    assert lines[end - 1] == '    op.drop_table("ü")'
+    start, end = methods.downgrade_lines
+    assert lines[start - 1] == "def downgrade() -> None:"
+    assert lines[end - 1] == "    pass"
+
+
+def test_node_source_matches_ast():
+    text = make_revision('    op.drop_table("ü")  # ü\n    op.drop_table("table1")')
+    lines = text.splitlines(keepends=True)
+    for node in ast.walk(ast.parse(text)):
+        if isinstance(node, ast.stmt):
+            assert get_node_source(lines, node) == ast.get_source_segment(text, node)
+
+
+def test_missing_downgrade():
+    text = "def upgrade() -> None:\n    pass\n"
+    assert read_revision_methods_text(text, "rev.py") is None
+
+
+def test_batch_and_single_agree(tmp_path):
+    paths = []
+    for i in range(3):
+        p = tmp_path / f"rev{i}.py"
+        p.write_text(make_revision(f'    op.drop_table("table{i}")'))
+        paths.append(p)
+    batch = read_revision_methods_many(paths)
+    for p, methods in zip(paths, batch):
+        assert methods is not None
+        assert get_revision_methods(p) == (methods.upgrade, methods.downgrade)
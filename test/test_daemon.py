@@ -0,0 +1,66 @@
+from alembic.script import ScriptDirectory
+
+from alembic_tools.daemon import WarmProject
+from alembic_tools.daemon_client import daemon_version
+from alembic_tools.move_revision import set_down_revision_text
+from test.helpers import make_revision, write_chain
+
+
+def make_project(tmp_path):
+    versions = tmp_path / "versions"
+    versions.mkdir()
+    write_chain(versions, [("aaa", None), ("bbb", "aaa")])
+    return WarmProject(ScriptDirectory(str(tmp_path))), versions
+
+
+def search(project, table):
+    request = {
+        "command": "search",
+        "tables": [table],
+        "replaceables": [],
+        "columns": [],
+        "version": daemon_version(),
+    }
+    return project.answer(request)
+
+
+def test_refresh_reads_only_changed_files(tmp_path):
+    project, versions = make_project(tmp_path)
+    assert project.refresh()
+    assert project.graph is not None
+    assert project.graph.heads == ["bbb"]
+    assert not project.refresh()
+    analysis = project.analyses[str((versions / "aaa_rev.py").resolve())]
+    text = make_revision('    op.create_table("post", sa.Column("id", sa.Integer))')
+    text = set_down_revision_text(text.replace("a38df1d1f70f", "ccc"), "bbb")
+    (versions / "ccc_rev.py").write_text(text)
+    assert project.refresh()
+    assert project.graph.heads == ["ccc"]
+    # untouched files keep their analysis
+    assert project.analyses[str((versions / "aaa_rev.py").resolve())] is analysis
+    code, output = search(project, "post")
+    assert code == 0
+    assert "ccc" in output
+    (versions / "ccc_rev.py").unlink()
+    code, output = search(project, "post")
+    assert code == 0
+    assert "ccc" not in output
+    assert project.graph.heads == ["bbb"]
+
+
+def test_answer_defers_to_client(tmp_path, capsys):
+    project, _ = make_project(tmp_path)
+    assert project.answer({"command": "order", "version": "0:old"}) == (None, "")
+    assert project.answer({"command": "index", "version": daemon_version()}) == (
+        None,
+        "",
+    )
+    # a malformed request fails inside the daemon
+    assert project.answer({"command": "search", "version": daemon_version()}) == (
+        None,
+        "",
+    )
+    assert "KeyError: 'tables'" in capsys.readouterr().err
+    code, output = project.answer({"command": "order", "version": daemon_version()})
+    assert code == 0
+    assert [line.split()[1] for line in output.splitlines()] == ["aaa", "bbb"]
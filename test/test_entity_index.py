@@ -0,0 +1,98 @@
+from alembic.script import ScriptDirectory
+
+import alembic_tools.analyze_revision as ar
+import alembic_tools.revision_collection as revision_collection
+from alembic_tools.entity_index import (
+    EntityIndex,
+    index_collection,
+    statement_from_record,
+    statement_to_record,
+)
+from alembic_tools.search_collection import replaceable_search, table_search
+from test.helpers import git, make_analysis, write_chain
+
+
+def test_records_round_trip():
+    for stmt in make_analysis().statements:
+        record = statement_to_record(stmt)
+        if record is None:
+            assert stmt.stype == ar.StatementType.UNKNOWN
+            continue
+        assert statement_to_record(statement_from_record(record)) == record
+
+
+def test_index_hits_give_same_search_results():
+    analysis = make_analysis()
+    index = EntityIndex()
+    index.add_revision("rev1", analysis)
+    for table_name in ["post", "user", "tag"]:
+        hits = index.table_hits(table_name)
+        assert list(hits) == ["rev1"]
+        assert table_search(table_name, hits["rev1"]) == table_search(
+            table_name, analysis
+        )
+    hits = index.replaceable_hits("vw_posts")
+    assert replaceable_search("vw_posts", hits["rev1"]) == ["Replaced abc.vw_posts"]
+    assert index.table_hits("comment") == {}
+
+
+def test_columns_include_create_table():
+    index = EntityIndex()
+    index.add_revision("rev1", make_analysis())
+    assert index.columns["post.post_id"] == ["rev1"]
+    assert index.columns["post.author_id"] == ["rev1"]
+    assert index.columns["tag.old"] == ["rev1"]
+
+
+def test_save_load_and_freshness(tmp_path):
+    p = tmp_path / "rev1.py"
+    p.write_text("revision = 'rev1'\n")
+    index = EntityIndex()
+    index.files[str(p)] = [p.stat().st_size, p.stat().st_mtime_ns]
+    index.order = {"rev1": 0}
+    index.add_revision("rev1", make_analysis())
+    index.save(tmp_path / "cache")
+    loaded = EntityIndex.load(tmp_path / "cache")
+    assert loaded is not None
+    assert loaded.tables == index.tables
+    assert loaded.is_fresh([p])
+    p.write_text("revision = 'rev1'\ndown_revision = None\n")
+    assert not loaded.is_fresh([p])
+    assert not loaded.is_fresh([p, tmp_path / "rev2.py"])
+
+
+def test_reindex_after_commit_reads_only_changed_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    versions = tmp_path / "versions"
+    versions.mkdir()
+    write_chain(versions, [("aaa", None), ("bbb", "aaa")])
+    git("init", "-q")
+    git("add", "versions")
+    git("commit", "-q", "-m", "init")
+    monkeypatch.setattr(
+        revision_collection, "list_revision_files", lambda _: sorted(versions.iterdir())
+    )
+    assert index_collection(ScriptDirectory(str(tmp_path))) == 0
+
+    write_chain(versions, [("ccc", ("aaa", "bbb"))])
+    git("add", "versions")
+    git("commit", "-q", "-m", "ccc")
+    read = []
+    read_revision_header = revision_collection.read_revision_header
+
+    def counting_read(script_folder, p, **kwargs):
+        read.append(p.name)
+        return read_revision_header(script_folder, p, **kwargs)
+
+    monkeypatch.setattr(revision_collection, "read_revision_header", counting_read)
+    assert index_collection(ScriptDirectory(str(tmp_path))) == 0
+    assert read == ["ccc_rev.py"]
+    index = EntityIndex.load()
+    assert index is not None
+    assert index.order == {"aaa": 0, "bbb": 1, "ccc": 2}
+    assert index.headers[str(versions / "ccc_rev.py")] == [
+        "ccc",
+        ["aaa", "bbb"],
+        "a description",
+    ]
+    assert index.is_fresh(sorted(versions.iterdir()))
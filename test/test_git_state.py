@@ -0,0 +1,48 @@
+from alembic_tools.git_state import repo_state, unchanged_files
+from test.helpers import git
+
+
+def test_unchanged_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for name in ["a.py", "b.py", "c.py"]:
+        (tmp_path / name).write_text(name)
+    (tmp_path / ".gitignore").write_text("ignored/\n")
+    git("init", "-q")
+    git("add", ".")
+    git("commit", "-q", "-m", "init")
+    (tmp_path / "c.py").write_text("changed before")
+    state = repo_state()
+    assert state is not None
+    assert state["dirty"] == [str(tmp_path / "c.py")]
+
+    (tmp_path / "b.py").write_text("changed after")
+    (tmp_path / "ignored").mkdir()
+    (tmp_path / "ignored" / "d.py").write_text("d")
+    (tmp_path / "e.py").write_text("untracked")
+    paths = [
+        str(tmp_path / name)
+        for name in ["a.py", "b.py", "c.py", "ignored/d.py", "e.py"]
+    ]
+    # c.py was already changed when the state was taken, so it can't be vouched
+    # for even though it hasn't changed since
+    assert unchanged_files(state, paths + [str(tmp_path.parent / "x.py")]) == {
+        str(tmp_path / "a.py")
+    }
+
+    git("add", ".")
+    git("commit", "-q", "-m", "more")
+    state = repo_state()
+    assert state is not None
+    assert state["dirty"] == []
+    assert unchanged_files(state, paths) == set(paths) - {
+        str(tmp_path / "ignored/d.py")
+    }
+
+
+def test_no_state_outside_git(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("GIT_CEILING_DIRECTORIES", str(tmp_path.parent))
+    assert repo_state() is None
+    assert unchanged_files(None, [str(tmp_path / "a.py")]) == set()
+    state = {"commit": "0" * 40, "dirty": []}
+    assert unchanged_files(state, [str(tmp_path / "a.py")]) == set()
@@ -0,0 +1,193 @@
+from alembic_tools.move_revision import (
+    move_in_graph,
+    move_plan,
+    move_revision,
+    read_plan,
+    replace_parent,
+    set_down_revision_text,
+)
+from alembic_tools.revision_collection import scan_revision_header
+from test.helpers import make_revision, write_chain
+
+
+def make_graph_dicts(graph: dict[str, list[str]]):
+    children: dict[str, list[str]] = {rev: [] for rev in graph}
+    for rev, parents in graph.items():
+        for parent in parents:
+            children[parent].append(rev)
+    return {rev: list(ps) for rev, ps in graph.items()}, children
+
+
+def test_replace_parent_keeps_position_and_dedupes():
+    assert replace_parent(["a", "b"], "a", ["x"]) == ["x", "b"]
+    assert replace_parent(["a", "b"], "a", ["b"]) == ["b"]
+    assert replace_parent(["a"], "a", []) == []
+
+
+def test_move_in_linear_chain():
+    parents, children = make_graph_dicts({"a": [], "b": ["a"], "c": ["b"], "d": ["c"]})
+    move_in_graph(parents, children, "c", "a")
+    assert parents == {"a": [], "b": ["c"], "c": ["a"], "d": ["b"]}
+    assert children["a"] == ["c"]
+    assert children["c"] == ["b"]
+
+
+def test_move_to_base_and_head():
+    parents, children = make_graph_dicts({"a": [], "b": ["a"], "c": ["b"]})
+    move_in_graph(parents, children, "c", None)
+    assert parents == {"a": ["c"], "b": ["a"], "c": []}
+    parents, children = make_graph_dicts({"a": [], "b": ["a"], "c": ["b"]})
+    move_in_graph(parents, children, "a", "c")
+    assert parents == {"a": ["c"], "b": [], "c": ["b"]}
+
+
+def test_move_to_base_keeps_other_bases():
+    # x is the base of an independent line
+    parents, children = make_graph_dicts(
+        {"a": [], "b": ["a"], "c": ["b"], "x": [], "y": ["x"]}
+    )
+    move_in_graph(parents, children, "c", None)
+    assert parents == {"a": ["c"], "b": ["a"], "c": [], "x": [], "y": ["x"]}
+    move_in_graph(parents, children, "x", None)
+    assert parents["x"] == [] and parents["y"] == ["x"]
+
+
+def test_move_next_to_merge_point():
+    # m merges the b and c branches
+    parents, children = make_graph_dicts(
+        {"a": [], "b": ["a"], "c": ["a"], "m": ["b", "c"], "x": ["m"]}
+    )
+    move_in_graph(parents, children, "x", "b")
+    assert parents["x"] == ["b"]
+    assert parents["m"] == ["x", "c"]
+    move_in_graph(parents, children, "x", "m")
+    assert parents["m"] == ["b", "c"]
+    assert parents["x"] == ["m"]
+
+
+def test_move_out_of_merge_parent():
+    parents, children = make_graph_dicts(
+        {"a": [], "b": ["a"], "c": ["a"], "m": ["b", "c"]}
+    )
+    move_in_graph(parents, children, "b", "m")
+    assert parents["m"] == ["a", "c"]
+    assert parents["b"] == ["m"]
+
+
+def test_set_down_revision_text_single():
+    text = make_revision("    pass")
+    result = set_down_revision_text(text, "abc123")
+    assert "down_revision: Union[str, None] = 'abc123'" in result
+    assert "Revises: abc123\n" in result
+    assert set_down_revision_text(result, None).count("= None") == 3
+
+
+def test_set_down_revision_text_merge():
+    text = make_revision("    pass")
+    result = set_down_revision_text(text, ("abc", "def"))
+    assert "down_revision: Union[str, None] = ('abc', 'def')" in result
+    assert "Revises: abc, def\n" in result
+    back = set_down_revision_text(result, "70421ef63b0d")
+    assert back == text
+
+
+def test_move_revision_rewrites_only_changed_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    versions = tmp_path / "versions"
+    versions.mkdir()
+    graph = write_chain(
+        versions,
+        [("aaa", None), ("bbb", "aaa"), ("ccc", "bbb"), ("ddd", "ccc"), ("eee", "ddd")],
+    )
+    assert move_revision(graph, "ddd", "bbb") == 0
+    moved = sorted(p.name for p in (tmp_path / "moved_revisions").iterdir())
+    assert moved == ["ccc_rev.py", "ddd_rev.py", "eee_rev.py"]
+    scanned = {
+        h.revision: h.down_revision
+        for h in (scan_revision_header(p) for p in versions.iterdir())
+        if h is not None
+    }
+    assert scanned == {
+        "aaa": None,
+        "bbb": "aaa",
+        "ddd": "bbb",
+        "ccc": "ddd",
+        "eee": "ccc",
+    }
+
+
+def scan_parents(versions):
+    return {
+        h.revision: h.down_revision
+        for h in (scan_revision_header(p) for p in versions.iterdir())
+        if h is not None
+    }
+
+
+def test_move_plan_rebases_a_branch(tmp_path, monkeypatch):
+    # x and y branched off a; they move onto the end of the main line
+    monkeypatch.chdir(tmp_path)
+    versions = tmp_path / "versions"
+    versions.mkdir()
+    graph = write_chain(
+        versions,
+        [("aaa", None), ("bbb", "aaa"), ("ccc", "bbb"), ("xxx", "aaa"), ("yyy", "xxx")],
+    )
+    plan = tmp_path / "plan.txt"
+    plan.write_text("# rebase\nxxx ccc\nyyy xxx\n")
+    assert move_plan(graph, read_plan(plan)) == 0
+    assert scan_parents(versions) == {
+        "aaa": None,
+        "bbb": "aaa",
+        "ccc": "bbb",
+        "xxx": "ccc",
+        "yyy": "xxx",
+    }
+    moved = sorted(p.name for p in (tmp_path / "moved_revisions").iterdir())
+    assert moved == ["xxx_rev.py"]
+
+
+def test_move_plan_full_order(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    versions = tmp_path / "versions"
+    versions.mkdir()
+    graph = write_chain(versions, [("aaa", None), ("bbb", "aaa"), ("ccc", "bbb")])
+    assert move_plan(graph, [["ccc"], ["aaa"], ["bbb"]]) == 0
+    assert scan_parents(versions) == {"ccc": None, "aaa": "ccc", "bbb": "aaa"}
+
+
+def test_move_with_dangling_down_revision(tmp_path, monkeypatch):
+    # the file for zzz is missing
+    monkeypatch.chdir(tmp_path)
+    versions = tmp_path / "versions"
+    versions.mkdir()
+    graph = write_chain(versions, [("aaa", "zzz"), ("bbb", "aaa"), ("ccc", "bbb")])
+    assert move_revision(graph, "ccc", "aaa") == 0
+    assert scan_parents(versions) == {"aaa": "zzz", "ccc": "aaa", "bbb": "ccc"}
+
+
+def test_merge_revisions_are_not_moved(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    versions = tmp_path / "versions"
+    versions.mkdir()
+    graph = write_chain(
+        versions,
+        [("aaa", None), ("bbb", "aaa"), ("ccc", "aaa"), ("mmm", ("bbb", "ccc"))],
+    )
+    assert move_revision(graph, "mmm", "aaa") == 1
+    assert "mmm merges bbb, ccc" in capsys.readouterr().out
+    assert not (tmp_path / "moved_revisions").exists()
+
+
+def test_move_plan_checks_before_writing(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    versions = tmp_path / "versions"
+    versions.mkdir()
+    graph = write_chain(versions, [("aaa", None), ("bbb", "aaa"), ("ccc", "bbb")])
+    before = scan_parents(versions)
+    # the first move is fine, the second can't be resolved
+    assert move_plan(graph, [["ccc", "aaa"], ["zzz", "aaa"]]) == 1
+    assert move_plan(graph, [["ccc"], ["aaa"]]) == 1
+    assert move_plan(graph, [["ccc"], ["aaa", "bbb"]]) == 1
+    assert scan_parents(versions) == before
+    assert not (tmp_path / "moved_revisions").exists()
@@ -0,0 +1,64 @@
+import threading
+import time
+
+import pytest
+
+from alembic_tools.prefetch import READ_AHEAD, prefetch
+
+
+def test_results_come_in_order(tmp_path):
+    paths = [tmp_path / f"{i}.py" for i in range(50)]
+
+    def slow_read(p):
+        # later files finish first
+        time.sleep((50 - int(p.stem)) / 10000)
+        return p.stem
+
+    assert list(prefetch(slow_read, paths, threads=8)) == [(p, p.stem) for p in paths]
+    assert list(prefetch(slow_read, paths, threads=1)) == [(p, p.stem) for p in paths]
+
+
+def test_reads_ahead_are_bounded(tmp_path):
+    paths = [tmp_path / f"{i}.py" for i in range(100)]
+    lock = threading.Lock()
+    started = []
+    consumed = 0
+    most_ahead = 0
+
+    def read(p):
+        nonlocal most_ahead
+        with lock:
+            started.append(p)
+            most_ahead = max(most_ahead, len(started) - consumed)
+        return p
+
+    for _ in prefetch(read, paths, threads=4):
+        time.sleep(0.0005)
+        with lock:
+            consumed += 1
+    assert len(started) == 100
+    # the one being handed over, plus those queued behind it
+    assert most_ahead <= 4 * READ_AHEAD + 1
+
+
+def test_error_is_raised_at_its_file(tmp_path):
+    paths = [tmp_path / f"{i}.py" for i in range(20)]
+    (tmp_path / "0.py").write_text("zero")
+    seen = []
+    with pytest.raises(FileNotFoundError):
+        for p, text in prefetch(lambda p: p.read_text(), paths, threads=4):
+            seen.append(text)
+    assert seen == ["zero"]
+
+
+def test_latency_overlaps(tmp_path):
+    paths = [tmp_path / f"{i}.py" for i in range(64)]
+
+    def remote_read(p):
+        time.sleep(0.005)
+        return p
+
+    start = time.perf_counter()
+    list(prefetch(remote_read, paths, threads=16))
+    # one at a time would take 0.32s
+    assert time.perf_counter() - start < 0.2
@@ -0,0 +1,199 @@
+from pathlib import Path
+import sys
+
+import pytest
+
+import alembic_tools.command as command
+import alembic_tools.revision_collection as rc
+from test.helpers import make_revision, write_revision
+
+
+def test_header_from_typed_assignments():
+    header = rc.header_from_source(make_revision("    pass"), Path("rev.py"))
+    assert header is not None
+    assert header.revision == "a38df1d1f70f"
+    assert header.down_revision == "70421ef63b0d"
+    assert header.doc == "a description"
+    assert header.path == "rev.py"
+
+
+def test_header_from_plain_assignments_with_merge():
+    text = '''"""merge heads"""
+revision = "abc"
+down_revision = ("def", "ghi")
+'''
+    header = rc.header_from_source(text, Path("rev.py"))
+    assert header is not None
+    assert header.down_revision == ("def", "ghi")
+    assert header.doc == "merge heads"
+
+
+def test_header_base_revision():
+    text = "revision = 'abc'\ndown_revision = None\n"
+    header = rc.header_from_source(text, Path("rev.py"))
+    assert header is not None
+    assert header.down_revision is None
+    assert header.doc == ""
+
+
+def test_computed_revision_is_not_scanned():
+    text = "revision = make_id()\ndown_revision = None\n"
+    assert rc.header_from_source(text, Path("rev.py")) is None
+
+
+def test_scan_reads_only_the_header(tmp_path):
+    p = tmp_path / "rev.py"
+    p.write_text(make_revision("    this is not python"))
+    header = rc.scan_revision_header(p)
+    assert header is not None
+    assert header.revision == "a38df1d1f70f"
+
+
+def test_scan_falls_back_to_whole_file(tmp_path):
+    p = tmp_path / "rev.py"
+    p.write_text(
+        "def make_id():\n    return 'abc'\n\nrevision = 'abc'\ndown_revision = None\n"
+    )
+    header = rc.scan_revision_header(p)
+    assert header is not None
+    assert header.revision == "abc"
+
+
+def test_graph_from_headers():
+    headers = [
+        rc.RevisionHeader("c", ("a", "b"), "", "c.py"),
+        rc.RevisionHeader("b", "a", "", "b.py"),
+        rc.RevisionHeader("a", None, "", "a.py"),
+    ]
+    assert rc.build_graph_from_headers(headers) == {
+        "c": ["a", "b"],
+        "b": ["a"],
+        "a": [],
+    }
+
+
+def test_revision_graph_structures():
+    headers = [
+        rc.RevisionHeader("d", ("b", "c"), "", "d.py"),
+        rc.RevisionHeader("c", "a", "", "c.py"),
+        rc.RevisionHeader("b", "a", "", "b.py"),
+        rc.RevisionHeader("a", None, "", "a.py"),
+    ]
+    graph = rc.RevisionGraph(None, headers)
+    assert graph.parents["d"] == ["b", "c"]
+    assert sorted(graph.children["a"]) == ["b", "c"]
+    assert graph.children["d"] == []
+    assert graph.heads == ["d"]
+    assert graph.bases == ["a"]
+    assert graph.order[0] == "a"
+    assert graph.order[-1] == "d"
+    assert graph.order_map == {rev: i for i, rev in enumerate(graph.order)}
+    assert graph.find_revs_that_start_with("b") == ["b"]
+
+
+def assert_parents_first(graph: dict[str, list[str]], order: list[str]):
+    position = {rev: i for i, rev in enumerate(order)}
+    assert len(position) == len(order)
+    for rev, parents in graph.items():
+        for parent in parents:
+            assert position[parent] < position[rev]
+
+
+def test_topological_sort_long_chain():
+    n = 50_000
+    graph = {f"r{i}": [f"r{i - 1}"] if i > 0 else [] for i in range(n)}
+    # walk order from alembic is head first
+    graph = dict(reversed(graph.items()))
+    order, generations = rc.topological_sort_with_generations(graph)
+    assert order == [f"r{i}" for i in range(n)]
+    assert generations[f"r{n - 1}"] == n - 1
+
+
+def test_topological_sort_wide_merge():
+    width = 5_000
+    graph: dict[str, list[str]] = {"base": []}
+    for i in range(width):
+        graph[f"branch{i}"] = ["base"]
+        graph[f"tip{i}"] = [f"branch{i}"]
+    graph["merge"] = [f"tip{i}" for i in range(width)]
+    graph["head"] = ["merge", "branch0"]
+    order, generations = rc.topological_sort_with_generations(graph)
+    assert_parents_first(graph, order)
+    assert order[0] == "base"
+    assert order[-1] == "head"
+    assert generations["merge"] == 3
+    assert generations["head"] == 4
+    assert rc.topological_sort(graph) == order
+
+
+def test_topological_sort_is_stable():
+    graph = {"d": ["b", "c"], "c": ["a"], "b": ["a"], "a": []}
+    assert rc.topological_sort(graph) == ["a", "c", "b", "d"]
+    assert rc.topological_sort(dict(graph)) == rc.topological_sort(graph)
+
+
+def test_topological_sort_missing_down_revision():
+    order = rc.topological_sort({"b": ["a"]})
+    assert order == ["a", "b"]
+
+
+def test_topological_sort_cycle():
+    with pytest.raises(rc.CycleException):
+        rc.topological_sort({"a": ["c"], "b": ["a"], "c": ["b"], "d": []})
+
+
+def test_commands_report_a_cycle(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "alembic.ini").write_text("[alembic]\nscript_location = migrations\n")
+    versions = tmp_path / "migrations" / "versions"
+    versions.mkdir(parents=True)
+    write_revision(versions, "aaa", "bbb")
+    write_revision(versions, "bbb", "aaa")
+    for args in [["--no-daemon", "order"], ["squash", "aaa", "bbb"], ["index"]]:
+        monkeypatch.setattr(sys, "argv", ["alembic_tools", *args])
+        assert command.main() == 1
+        out = capsys.readouterr().out
+        assert "Error: Revision graph has a cycle through aaa, bbb" in out
+
+
+def test_prefix_index_find():
+    index = rc.PrefixIndex(["ab12", "ab34", "b999", "abc0", "a"])
+    assert index.find("ab") == ["ab12", "ab34", "abc0"]
+    assert index.find("ab3") == ["ab34"]
+    assert index.find("a") == ["a", "ab12", "ab34", "abc0"]
+    assert index.find("c") == []
+    assert index.find("") == ["a", "ab12", "ab34", "abc0", "b999"]
+
+
+def make_prefix_graph() -> rc.RevisionGraph:
+    headers = [
+        rc.RevisionHeader("ab12", None, "", "1.py"),
+        rc.RevisionHeader("ab34", "ab12", "", "2.py"),
+        rc.RevisionHeader("cd56", "ab34", "", "3.py"),
+    ]
+    return rc.RevisionGraph(None, headers)
+
+
+def test_get_unambiguous_revisions_resolves_in_order():
+    graph = make_prefix_graph()
+    success, revs = rc.get_unambiguous_revisions(["cd", "ab1", "ab3"], graph)
+    assert success
+    assert revs == ["cd56", "ab12", "ab34"]
+
+
+def test_get_unambiguous_revisions_reports_all_problems(capsys):
+    graph = make_prefix_graph()
+    success, revs = rc.get_unambiguous_revisions(["ab", "cd", "zz"], graph)
+    assert not success
+    assert revs == []
+    out = capsys.readouterr().out.splitlines()
+    assert out == [
+        "Revision ab is ambiguous. Could be any of ab12, ab34",
+        "Could not find revision beginning with zz",
+    ]
+
+
+def test_get_unambiguous_revision():
+    graph = make_prefix_graph()
+    assert rc.get_unambiguous_revision("cd", graph) == (True, "cd56")
+    assert rc.get_unambiguous_revision("ab", graph) == (False, "")
@@ -0,0 +1,107 @@
+import pytest
+
+import alembic_tools.analyze_revision as ar
+from alembic_tools.entity_index import EntityIndex
+from alembic_tools.revision_collection import RevisionGraph, RevisionHeader
+from alembic_tools.search_collection import (
+    NamesFileException,
+    dispatch_statements,
+    read_names_file,
+    replaceable_search,
+    search_analyses,
+    search_index,
+    search_scan,
+    table_search,
+)
+from test.helpers import make_analysis, write_chain
+
+
+def test_dispatch_gives_same_search_results():
+    analysis = make_analysis()
+    tables, replaceables = dispatch_statements(
+        analysis, {"post", "user", "tag", "comment"}, {"vw_posts"}
+    )
+    assert sorted(tables) == ["post", "tag", "user"]
+    for table_name, hits in tables.items():
+        assert table_search(table_name, hits) == table_search(table_name, analysis)
+    assert replaceable_search("vw_posts", replaceables["vw_posts"]) == [
+        "Replaced abc.vw_posts"
+    ]
+
+
+def test_read_names_file(tmp_path):
+    p = tmp_path / "names.txt"
+    p.write_text(
+        "# audit\npost\n\ntable: user\nreplaceable: vw_posts\n"
+        "column: abc.orders.status\n"
+    )
+    assert read_names_file(p) == (
+        ["post", "user"],
+        ["vw_posts"],
+        [("abc.orders", "status")],
+    )
+    p.write_text("post\ncolumn: orders\n")
+    with pytest.raises(NamesFileException, match="not 'orders'"):
+        read_names_file(p)
+    p.write_text("post\nview: vw_posts\n")
+    with pytest.raises(NamesFileException, match="Unknown entity kind 'view'"):
+        read_names_file(p)
+
+
+def test_scan_analyzes_each_revision_once(tmp_path, monkeypatch):
+    graph = write_chain(tmp_path, [("aaa", None), ("bbb", "aaa"), ("ccc", "bbb")])
+    calls = []
+    analyze = ar.analyze_revision
+
+    def counting(p, text=None):
+        calls.append(p)
+        return analyze(p, text)
+
+    monkeypatch.setattr(ar, "analyze_revision", counting)
+    results = search_scan(graph, ["post", "user", "tag"], ["vw"], False, 1)
+    assert len(calls) == 3
+    assert list(results.tables) == ["post", "user", "tag"]
+    assert results.replaceables == {"vw": []}
+
+
+def results_by_order(lines):
+    return sorted(lines, key=lambda line: line[2])
+
+
+def test_column_history_from_index_and_scan():
+    graph = RevisionGraph(
+        None,
+        [
+            RevisionHeader("ccc", "bbb", "", "ccc.py"),
+            RevisionHeader("aaa", None, "", "aaa.py"),
+            RevisionHeader("bbb", "aaa", "", "bbb.py"),
+        ],
+    )
+    create = ar.CreateTableStatement("orders")
+    create.columns = [ar.Column("id"), ar.Column("status")]
+    analyses = {rev: ar.Revision() for rev in graph.revisions}
+    analyses["aaa"].statements = [create]
+    analyses["bbb"].statements = [
+        ar.AddColumnStatement("orders", "total"),
+        ar.AlterColumnStatement("orders", "status"),
+        ar.AlterColumnStatement("customers", "status"),
+    ]
+    analyses["ccc"].statements = [ar.DropColumnStatement("orders", "status")]
+    expected = [
+        ("aaa", "created with the table", 0),
+        ("bbb", "altered", 1),
+        ("ccc", "dropped", 2),
+    ]
+
+    scanned = search_analyses(graph, analyses, [], [], [("orders", "status")])
+    assert results_by_order(scanned.columns["orders", "status"]) == expected
+    # the column's table wasn't asked for, so it isn't reported
+    assert scanned.tables == {}
+
+    index = EntityIndex()
+    index.order = graph.order_map
+    for rev, rev_analysis in analyses.items():
+        index.add_revision(rev, rev_analysis)
+    indexed = search_index(index, [], [], [("orders", "status"), ("orders", "missing")])
+    assert results_by_order(indexed.columns["orders", "status"]) == expected
+    assert indexed.columns["orders", "missing"] == []
@@ -1,95 +1,137 @@
-from types import ModuleType
+import ast
 
-import pytest
-from alembic_tools.squash import FormatException, make_squashed_text
-from alembic.script import Script
+from alembic_tools.squash import find_chain, squash_commits
+from alembic_tools.revision_collection import RevisionGraph, scan_revision_header
+from test.helpers import write_chain, write_revision
 
 
-class FakeScript(Script):
-    def __init__(self, rev_id: str, down_rev_id: str):
-        self.revision = rev_id
-        self.down_revision = down_rev_id
-
-
-def test_new_revision_is_the_same_as_the_previous_to():
-    new_rev_text = make_template("new_id")
-    rev1_methods = (make_upgrade(), make_downgrade())
-    rev2_methods = (make_upgrade(), make_downgrade())
-    from_script = FakeScript("from_id", "previous_to_from")
-    to_script = FakeScript("to_id", "from_id")
-    new_script = FakeScript("new_id", "new_id_prev")
-    result = make_squashed_text(
-        new_rev_text, rev1_methods, rev2_methods, from_script, to_script, new_script
+def test_find_chain_needs_a_single_line(tmp_path):
+    # c branches off b next to the chain, and m merges d and c
+    graph = write_chain(
+        tmp_path,
+        [("a", None), ("b", "a"), ("c", "b"), ("d", "b"), ("m", ("d", "c"))],
     )
-    assert f'revision: str = "to_id"' in result
-
-
-def test_raises_if_no_upgrade():
-    new_rev_text = ""
-    rev1_methods = (make_upgrade(), make_downgrade())
-    rev2_methods = (make_upgrade(), make_downgrade())
-    from_script = FakeScript("from_id", "previous_to_from")
-    to_script = FakeScript("to_id", "from_id")
-    new_script = FakeScript("new_id", "new_id_prev")
-    with pytest.raises(FormatException):
-        result = make_squashed_text(
-            new_rev_text, rev1_methods, rev2_methods, from_script, to_script, new_script
-        )
-
-
-def test_raises_if_no_downgrade():
-    new_rev_text = "def upgrade() -> None:\n    pass"
-    rev1_methods = (make_upgrade(), make_downgrade())
-    rev2_methods = (make_upgrade(), make_downgrade())
-    from_script = FakeScript("from_id", "previous_to_from")
-    to_script = FakeScript("to_id", "from_id")
-    new_script = FakeScript("new_id", "new_id_prev")
-    with pytest.raises(FormatException):
-        result = make_squashed_text(
-            new_rev_text, rev1_methods, rev2_methods, from_script, to_script, new_script
-        )
-
-
-def make_upgrade() -> str:
-    return """
-def upgrade() -> None:
-    pass
-"""
-
-
-def make_downgrade() -> str:
-    return """
-def downgrade() -> None:
-    pass
-"""
-
-
-def make_template(revision_id: str) -> str:
-    return f"""
-\"\"\"define post
-
-Revision ID: {revision_id}
-Revises: 
-Create Date: 2024-02-29 15:02:20.932182
-
-\"\"\"
-
-from typing import Sequence, Union
-
-from alembic import op
-import sqlalchemy as sa
-
-
-# revision identifiers, used by Alembic.
-revision: str = "{revision_id}"
-down_revision: Union[str, None] = None
-branch_labels: Union[str, Sequence[str], None] = None
-depends_on: Union[str, Sequence[str], None] = None
-
-def upgrade() -> None:
-    pass
-
-def downgrade() -> None:
-    pass
-
-"""
+    chain = find_chain(graph, "b", "a")
+    assert chain is not None
+    assert [h.revision for h in chain] == ["a", "b"]
+    assert find_chain(graph, "a", "d") is None
+    assert find_chain(graph, "b", "m") is None
+    assert find_chain(graph, "c", "d") is None
+
+
+def test_squash_range(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    versions = tmp_path / "versions"
+    versions.mkdir()
+    paths = [
+        write_revision(versions, "aaa", None),
+        write_revision(
+            versions,
+            "bbb",
+            "aaa",
+            '    op.create_table("post")',
+            '    op.drop_table("post")',
+        ),
+        write_revision(
+            versions,
+            "ccc",
+            "bbb",
+            "    op.create_view(vw)",
+            "    op.drop_view(vw)",
+            'vw = ReplaceableObject("vw", "select 1")',
+        ),
+        write_revision(
+            versions,
+            "ddd",
+            "ccc",
+            '    op.add_column("post", sa.Column("id", sa.Integer))',
+            '    op.drop_column("post", "id")',
+        ),
+        write_revision(versions, "eee", "ddd"),
+    ]
+    headers = [scan_revision_header(p) for p in paths]
+    graph = RevisionGraph(None, [h for h in headers if h is not None])
+    assert len(graph.revisions) == len(paths)
+    assert squash_commits(graph, "ddd", "bbb", "Add posts") == 0
+    squashed = sorted(p.name for p in (tmp_path / "squashed_revisions").iterdir())
+    assert squashed == ["bbb_rev.py", "ccc_rev.py", "ddd_rev.py"]
+    assert sorted(p.name for p in versions.iterdir()) == [
+        "aaa_rev.py",
+        "ddd_add_posts.py",
+        "eee_rev.py",
+    ]
+    text = (versions / "ddd_add_posts.py").read_text()
+    header = scan_revision_header(versions / "ddd_add_posts.py")
+    assert header is not None
+    assert (header.revision, header.down_revision) == ("ddd", "aaa")
+    assert text.startswith('"""Add posts')
+    assert "Revises: aaa\n" in text
+    assert text.count('vw = ReplaceableObject("vw", "select 1")') == 1
+    assert text.count("import utils") == 1
+    tree = ast.parse(text)
+    methods = {
+        node.name: [ast.unparse(stmt) for stmt in node.body]
+        for node in tree.body
+        if isinstance(node, ast.FunctionDef)
+    }
+    assert methods == {
+        "upgrade": [
+            "op.create_table('post')",
+            "op.create_view(vw)",
+            "op.add_column('post', sa.Column('id', sa.Integer))",
+        ],
+        "downgrade": [
+            "op.drop_column('post', 'id')",
+            "op.drop_view(vw)",
+            "op.drop_table('post')",
+        ],
+    }
+
+
+def test_squash_range_rejects_a_split_signature(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    versions = tmp_path / "versions"
+    versions.mkdir()
+    graph = write_chain(versions, [("aaa", None), ("bbb", "aaa"), ("ccc", "bbb")])
+    p = versions / "bbb_rev.py"
+    p.write_text(
+        p.read_text().replace("def upgrade() -> None:", "def upgrade(\n) -> None:")
+    )
+    assert squash_commits(graph, "aaa", "ccc", None) == 1
+    assert "Error: Could not find where def upgrade( ends" in capsys.readouterr().out
+    assert sorted(p.name for p in versions.iterdir()) == [
+        "aaa_rev.py",
+        "bbb_rev.py",
+        "ccc_rev.py",
+    ]
+    assert not (tmp_path / "squashed_revisions").exists()
+
+
+def test_squash_two_revisions(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    versions = tmp_path / "versions"
+    versions.mkdir()
+    graph = write_chain(versions, [("aaa", None), ("bbb", "aaa"), ("ccc", "bbb")])
+    write_revision(
+        versions,
+        "bbb",
+        "aaa",
+        '    op.create_table("post")',
+        '    op.drop_table("post")',
+    )
+    write_revision(
+        versions,
+        "ccc",
+        "bbb",
+        '    op.add_column("post", sa.Column("id", sa.Integer))',
+        '    op.drop_column("post", "id")',
+    )
+    assert squash_commits(graph, "ccc", "bbb", None) == 0
+    assert sorted(p.name for p in versions.iterdir()) == ["aaa_rev.py", "ccc_rev.py"]
+    text = (versions / "ccc_rev.py").read_text()
+    assert "<<<<<<<" not in text
+    assert 'op.create_table("post")' in text
+    assert 'op.drop_column("post", "id")' in text
+    header = scan_revision_header(versions / "ccc_rev.py")
+    assert header is not None
+    assert (header.revision, header.down_revision) == ("ccc", "aaa")
@@ -0,0 +1,38 @@
+from alembic_tools.timings import Timings
+
+
+def test_disabled_records_nothing():
+    t = Timings()
+    with t.phase("scan"):
+        t.count("files_read")
+    assert t.phases == {}
+    assert t.counts == {}
+
+
+def test_nested_phases_and_counts():
+    t = Timings()
+    t.enabled = True
+    with t.phase("search"):
+        for _ in range(3):
+            with t.phase("parse"):
+                t.count("files_read")
+        with t.phase("match"):
+            pass
+    assert list(t.phases) == ["search", "search/parse", "search/match"]
+    assert t.phases["search/parse"][0] == 3
+    assert t.phases["search"][1] >= t.phases["search/parse"][1]
+    assert t.to_json()["counts"] == {"files_read": 3}
+
+
+def test_phase_is_recorded_when_it_raises():
+    t = Timings()
+    t.enabled = True
+    try:
+        with t.phase("move"):
+            raise ValueError()
+    except ValueError:
+        pass
+    assert t.phases["move"][0] == 1
+    with t.phase("after"):
+        pass
+    assert "after" in t.phases
@@ -0,0 +1,99 @@
+from alembic_tools.revision_collection import RevisionGraph, RevisionHeader
+from alembic_tools.visualize_graph import (
+    BASE_NODE,
+    ELIDED_NODE,
+    collapse_chains,
+    descendants,
+    graph_view,
+    neighborhood,
+    render_view,
+    view_to_json,
+    view_to_mermaid,
+)
+
+
+def make_graph(chain: list[tuple[str, str | tuple[str, ...] | None]]) -> RevisionGraph:
+    return RevisionGraph(
+        None,
+        [RevisionHeader(rev, down, f"doc {rev}", f"{rev}.py") for rev, down in chain],
+    )
+
+
+# a - b - c - d - e - m - f - g - h
+#          \           /
+#           x ------- y
+GRAPH = [
+    ("a", None),
+    ("b", "a"),
+    ("c", "b"),
+    ("d", "c"),
+    ("e", "d"),
+    ("x", "b"),
+    ("y", "x"),
+    ("m", ("e", "y")),
+    ("f", "m"),
+    ("g", "f"),
+    ("h", "g"),
+]
+
+
+def test_full_view():
+    view = graph_view(make_graph(GRAPH))
+    assert len(view.nodes) == 11
+    assert (BASE_NODE, "a") in view.edges
+    assert ("e", "m") in view.edges and ("y", "m") in view.edges
+    assert view.placeholders == {BASE_NODE}
+
+
+def test_neighborhood_and_since():
+    graph = make_graph(GRAPH)
+    assert neighborhood(graph, "m", 1) == {"m", "e", "y", "f"}
+    assert neighborhood(graph, "m", 0) == {"m"}
+    assert descendants(graph, "y") == {"y", "m", "f", "g", "h"}
+    view = graph_view(graph, descendants(graph, "y"))
+    # m's other down revision isn't shown
+    assert (ELIDED_NODE, "y") in view.edges and (ELIDED_NODE, "m") in view.edges
+    assert BASE_NODE not in view.placeholders
+
+
+def test_collapse_keeps_branch_and_merge_points():
+    view = collapse_chains(graph_view(make_graph(GRAPH)), 3)
+    assert set(view.nodes) == {"a", "b", "c..e", "x", "y", "m", "f", "g", "h"}
+    assert view.nodes["c..e"].startswith("3 revisions")
+    assert ("b", "c..e") in view.edges
+    assert ("c..e", "m") in view.edges
+    # runs shorter than the minimum are left alone
+    assert ("x", "y") in view.edges
+    view = collapse_chains(graph_view(make_graph(GRAPH)), 2)
+    # the head is always shown
+    assert set(view.nodes) == {"a", "b", "c..e", "x..y", "m", "f..g", "h"}
+    assert ("f..g", "h") in view.edges
+
+
+def test_json_and_mermaid():
+    view = graph_view(make_graph(GRAPH[:3]))
+    data = view_to_json(view)
+    assert [n["id"] for n in data["nodes"]] == ["a", "b", "c"]
+    assert data["edges"] == [["base", "a"], ["a", "b"], ["b", "c"]]
+    mermaid = view_to_mermaid(view, horiz=True)
+    assert mermaid.startswith("flowchart LR\n")
+    assert '    n0["a<br/>doc a"]' in mermaid
+    assert "    n3 --> n0" in mermaid
+
+
+def test_render_cache_skips_unchanged_output(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache_dir = tmp_path / "cache"
+    view = graph_view(make_graph(GRAPH))
+    output, written = render_view(view, False, "dot", cache_dir=cache_dir)
+    assert written and output.read_text().startswith("digraph")
+    assert render_view(view, False, "dot", cache_dir=cache_dir) == (output, False)
+    # other options or another graph are written again
+    assert render_view(view, True, "dot", cache_dir=cache_dir)[1]
+    smaller = graph_view(make_graph(GRAPH[:3]))
+    assert render_view(smaller, True, "dot", cache_dir=cache_dir)[1]
+    output.unlink()
+    assert render_view(smaller, True, "dot", cache_dir=cache_dir)[1]
+    # --no-cache writes the output anyway, and leaves the digest of what it wrote
+    assert render_view(view, False, "dot", use_cache=False, cache_dir=cache_dir)[1]
+    assert render_view(smaller, True, "dot", cache_dir=cache_dir)[1]